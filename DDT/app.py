@@ -1,140 +1,46 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session
-import psycopg2
-from psycopg2.extras import RealDictCursor
-from psycopg2 import pool
-import os
-import requests
-from datetime import datetime
-import threading
+from flask import Flask, render_template, request, jsonify, redirect, url_for, session, Response, stream_with_context
 import atexit
+import time
+from auth import AdminTokenVerifier, central_admin_login
+from config import load_config
+from backends import create_backend
+from door_client import DoorClient
+from session_store import MemorySessionInterface
 
-app = Flask(__name__)
-app.secret_key = 'your-secret-key-change-this-in-production'
+# Settings come from defaults, an optional DDT_CONFIG JSON file and the environment (see config.py)
+config = load_config()
 
-# Database configuration
-DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'shadowfly',
-    'user': 'postgres',
-    'password': 'admin',
-    'port': 5432
-}
+app = Flask(__name__)
+app.secret_key = config['secret_key']
+# Sessions live on the terminal; the cookie only carries an opaque id
+app.session_interface = MemorySessionInterface(ttl=config['session_ttl'])
 
 # Raspberry Pi DDT Control URL
-DDT_CONTROL_URL = "https://sddtlaunch-akshai.in1.pitunnel.net"
-
-# Connection pool for better performance
-connection_pool = None
-pool_lock = threading.Lock()
-
-def initialize_connection_pool():
-    """Initialize database connection pool"""
-    global connection_pool
-    if connection_pool is None:
-        with pool_lock:
-            if connection_pool is None:
-                try:
-                    connection_pool = psycopg2.pool.ThreadedConnectionPool(
-                        minconn=2,
-                        maxconn=10,
-                        **DB_CONFIG
-                    )
-                    print("[INFO] Database connection pool initialized")
-                except psycopg2.Error as e:
-                    print(f"[ERROR] Failed to create connection pool: {e}")
-
-def get_pooled_connection():
-    """Get connection from pool"""
-    global connection_pool
-    if connection_pool is None:
-        initialize_connection_pool()
-    
-    try:
-        return connection_pool.getconn()
-    except psycopg2.Error as e:
-        print(f"[ERROR] Failed to get connection from pool: {e}")
-        return None
-
-def return_pooled_connection(conn):
-    """Return connection to pool"""
-    global connection_pool
-    if connection_pool and conn:
-        connection_pool.putconn(conn)
-
-def close_connection_pool():
-    """Close all connections in the pool"""
-    global connection_pool
-    if connection_pool:
-        connection_pool.closeall()
-        connection_pool = None
+DDT_CONTROL_URL = config['control_url']
+door_client = DoorClient(DDT_CONTROL_URL)
+
+# Tower served by this terminal and where its data comes from (postgres, replica or mock)
+DDT_NAME = config['ddt_name']
+backend = create_backend(config)
+
+# Admin access tokens from the central admins service are verified locally
+admin_tokens = AdminTokenVerifier(config)
 
 def validate_otp(otp):
-    """Optimized OTP validation"""
-    conn = get_pooled_connection()
-    if not conn:
-        return None
-        
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM customers WHERE otp = %s LIMIT 1", (otp,))
-        customer = cursor.fetchone()
-        cursor.close()
-        return dict(customer) if customer else None
-    except psycopg2.Error as e:
-        print(f"Database query error: {e}")
-        return None
-    finally:
-        return_pooled_connection(conn)
+    """Validate and consume a single-use OTP for this tower"""
+    return backend.validate_otp(otp)
+
+def release_otp(customer):
+    """Give a consumed OTP back (door failed to open) so the customer can retry"""
+    return backend.release_otp(customer)
 
 def trigger_door_open(rack_name):
-    """Send door open command to Raspberry Pi DDT system"""
-    try:
-        url = f"{DDT_CONTROL_URL}/door-open"
-        payload = {"cmd": rack_name.lower()}
-                
-        print(f"[INFO] Sending door open command to {url} with payload: {payload}")
-                
-        response = requests.post(
-            url, 
-            json=payload, 
-            timeout=10,
-            headers={'Content-Type': 'application/json'}
-        )
-                
-        if response.status_code == 200:
-            print(f"[SUCCESS] Door open command sent successfully for {rack_name}")
-            return True
-        else:
-            print(f"[ERROR] Door open failed with status code: {response.status_code}")
-            return False
-                
-    except requests.exceptions.RequestException as e:
-        print(f"[ERROR] Failed to send door open command: {e}")
-        return False
-    except Exception as e:
-        print(f"[ERROR] Unexpected error in door open: {e}")
-        return False
+    """Send door open command to Raspberry Pi DDT system and wait for the result"""
+    return door_client.open_door(rack_name)
 
 def get_package_details(package_id):
-    """Get package details from packagemanagement table"""
-    conn = get_pooled_connection()
-    if not conn:
-        return None
-        
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute(
-            "SELECT package_id, current_status, item_details FROM packagemanagement WHERE package_id = %s LIMIT 1",
-            (package_id,)
-        )
-        package = cursor.fetchone()
-        cursor.close()
-        return dict(package) if package else None
-    except psycopg2.Error as e:
-        print(f"Database query error: {e}")
-        return None
-    finally:
-        return_pooled_connection(conn)
+    """Get package details for a package"""
+    return backend.get_package_details(package_id)
 
 def validate_admin_credentials(username, password):
     """Validate admin credentials with fallback logic"""
@@ -142,74 +48,36 @@ def validate_admin_credentials(username, password):
     if username == "admin@shadowfly" and password == "drone12345":
         return True
         
-    # If not hardcoded admin, check admins_data table
-    conn = get_pooled_connection()
-    if not conn:
-        return False
-        
-    try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM admins_data WHERE username = %s AND password = %s LIMIT 1",
-                       (username, password))
-        admin = cursor.fetchone()
-        cursor.close()
-        return admin is not None
-    except psycopg2.Error as e:
-        print(f"Admin validation error: {e}")
+    # Otherwise the central admins service checks the stored password hash
+    return central_admin_login(config['admin_api_url'], username, password) is not None
+
+def admin_authenticated():
+    """Admin session on this terminal, or a valid admin bearer token; no database lookup either way"""
+    if session.get('admin_logged_in'):
+        expires_at = session.get('admin_token_exp')
+        if expires_at is None or expires_at > time.time():
+            return True
+        session.clear()
         return False
-    finally:
-        return_pooled_connection(conn)
+    header = request.headers.get('Authorization', '')
+    return header.startswith('Bearer ') and admin_tokens.verify(header[7:].strip()) is not None
 
-def get_ddt_details(ddt_name="SFDDT"):
+def get_ddt_details():
     """Get DDT details and associated packages"""
-    conn = get_pooled_connection()
-    if not conn:
-        return None
-        
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-                
-        # Get DDT details
-        cursor.execute("""
-            SELECT id, name, latitude, longitude, status,
-                    rack_01, rack_02, rack_03, rack_04, rack_05, rack_06,
-                   total_racks, control_key
-            FROM ddts WHERE name = %s LIMIT 1
-        """, (ddt_name,))
-        ddt = cursor.fetchone()
-                
-        if not ddt:
-            cursor.close()
-            return None
-                    
-        # Get packages for each rack
-        ddt_dict = dict(ddt)
-        ddt_dict['rack_packages'] = {}
-                
-        for i in range(1, 7):  # rack_01 to rack_06
-            rack_key = f'rack_{i:02d}'
-            package_id = ddt_dict.get(rack_key)
-                        
-            if package_id:
-                # Get OTP for this package
-                cursor.execute("SELECT otp FROM customers WHERE package_id = %s LIMIT 1", (package_id,))
-                otp_result = cursor.fetchone()
-                otp = otp_result['otp'] if otp_result else None
-                                
-                ddt_dict['rack_packages'][rack_key] = {
-                    'package_id': package_id,
-                    'otp': otp,
-                    'rack_number': f'R{i:03d}'
-                }
-        
-        cursor.close()
-        return ddt_dict
-            
-    except psycopg2.Error as e:
-        print(f"DDT query error: {e}")
-        return None
-    finally:
-        return_pooled_connection(conn)
+    return backend.get_ddt_details()
+
+def run_self_test():
+    """Report which backend the terminal runs with and whether lookups fit the latency budget"""
+    report = backend.self_test()
+    lookup_ms = report.get('lookup_ms')
+    report['within_budget'] = lookup_ms is not None and lookup_ms <= report['latency_budget_ms']
+    status = "OK" if report['ok'] and report['within_budget'] else "DEGRADED"
+    print(f"[INFO] DDT terminal self-test {status}: tower {report['ddt_name']}, backend '{report['backend']}', "
+          f"lookup {lookup_ms} ms (budget {report['latency_budget_ms']} ms)")
+    for key in ('db_round_trip_ms', 'replica_ready', 'pending_pickups', 'error'):
+        if key in report:
+            print(f"[INFO]   {key}: {report[key]}")
+    return report
 
 @app.route('/')
 def index():
@@ -229,7 +97,7 @@ def admin_login():
 @app.route('/dashboard')
 def dashboard():
     """Serve the admin dashboard"""
-    if not session.get('admin_logged_in'):
+    if not admin_authenticated():
         return redirect(url_for('admin_login'))
     return render_template('dashboard.html')
 
@@ -247,29 +115,29 @@ def validate_otp_route():
         
     if customer:
         # Store OTP in session for package details page
+        session.pop('package_data', None)
         session['validated_otp'] = otp
         session['customer_data'] = customer
                 
-        # Get rack information and trigger door opening
+        # Get rack information and queue the door opening; the kiosk follows it on /door-status
         rack_name = customer.get('rack')
         if rack_name:
             print(f"[INFO] Triggering door open for rack: {rack_name}")
-            door_success = trigger_door_open(rack_name)
-                        
-            if door_success:
-                return jsonify({
-                    'success': True, 
-                    'message': 'OTP validated successfully. Door is opening!',
-                    'door_opened': True,
-                    'rack': rack_name
-                })
-            else:
-                return jsonify({
-                    'success': True, 
-                    'message': 'OTP validated but door opening failed. Please contact support.',
-                    'door_opened': False,
-                    'rack': rack_name
-                })
+            
+            def door_done(door_success):
+                if not door_success:
+                    release_otp(customer)
+            
+            command_id = door_client.open_door_async(rack_name, on_done=door_done)
+            session['door_command_id'] = command_id
+            return jsonify({
+                'success': True, 
+                'message': 'OTP validated successfully. Opening your rack door...',
+                'door_opened': False,
+                'door_status': 'pending',
+                'command_id': command_id,
+                'rack': rack_name
+            }), 202
         else:
             return jsonify({
                 'success': True, 
@@ -277,7 +145,27 @@ def validate_otp_route():
                 'door_opened': False
             })
     else:
-        return jsonify({'success': False, 'message': 'Invalid OTP. Please try again.'}), 401
+        return jsonify({'success': False, 'message': 'Invalid or already used OTP. Please try again.'}), 401
+
+@app.route('/door-status/<command_id>')
+def door_status(command_id):
+    """Server-Sent Events: pushes the door command result to the kiosk when it completes"""
+    if session.get('door_command_id') != command_id:
+        return jsonify({'error': 'Unknown door command'}), 404
+    return Response(
+        stream_with_context(door_client.door_status_stream(command_id)),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+def get_session_package(customer_data):
+    """Package details cached in the session, so kiosk page reloads cost no queries"""
+    package_data = session.get('package_data')
+    if package_data is None:
+        package_data = get_package_details(customer_data['package_id'])
+        if package_data is not None:
+            session['package_data'] = package_data
+    return package_data
 
 @app.route('/package-details')
 def package_details():
@@ -293,7 +181,7 @@ def package_details():
         return redirect(url_for('user_login'))
         
     # Get package details
-    package_data = get_package_details(customer_data['package_id'])
+    package_data = get_session_package(customer_data)
         
     # Prepare data for template
     template_data = {
@@ -314,7 +202,7 @@ def api_package_data():
     if not customer_data:
         return jsonify({'error': 'No customer data'}), 401
         
-    package_data = get_package_details(customer_data['package_id'])
+    package_data = get_session_package(customer_data)
         
     return jsonify({
         'customer': customer_data,
@@ -329,8 +217,20 @@ def logout():
 
 @app.route('/validate-admin', methods=['POST'])
 def validate_admin_route():
-    """API endpoint to validate admin credentials"""
+    """API endpoint to validate admin credentials or an admin access token"""
     data = request.get_json()
+
+    # Token from the central admins service: checked locally, the session ends when it expires
+    token = data.get('token')
+    if token:
+        claims = admin_tokens.verify(token)
+        if not claims:
+            return jsonify({'success': False, 'message': 'Invalid or expired token'}), 401
+        session['admin_logged_in'] = True
+        session['admin_username'] = claims['sub']
+        session['admin_token_exp'] = claims['exp']
+        return jsonify({'success': True, 'message': 'Admin login successful'})
+
     username = data.get('username')
     password = data.get('password')
         
@@ -347,7 +247,7 @@ def validate_admin_route():
 @app.route('/api/ddt-data')
 def api_ddt_data():
     """API endpoint to get DDT data for admin dashboard"""
-    if not session.get('admin_logged_in'):
+    if not admin_authenticated():
         return jsonify({'error': 'Not authenticated'}), 401
         
     ddt_data = get_ddt_details()
@@ -359,7 +259,7 @@ def api_ddt_data():
 @app.route('/manual-door-open', methods=['POST'])
 def manual_door_open():
     """Manual door opening endpoint for admin use"""
-    if not session.get('admin_logged_in'):
+    if not admin_authenticated():
         return jsonify({'error': 'Not authenticated'}), 401
         
     data = request.get_json()
@@ -375,11 +275,19 @@ def manual_door_open():
     else:
         return jsonify({'success': False, 'message': f'Failed to open door for {rack_name}'}), 500
 
-# Initialize connection pool on startup
-initialize_connection_pool()
+@app.route('/api/self-test')
+def api_self_test():
+    """Backend and latency report for the admin dashboard"""
+    if not admin_authenticated():
+        return jsonify({'error': 'Not authenticated'}), 401
+    return jsonify(run_self_test())
+
+# Start the backend (connection pool, replica sync) and report how the terminal is running
+backend.start()
+run_self_test()
 
 # Close pool on shutdown
-atexit.register(close_connection_pool)
+atexit.register(backend.close)
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=7000)
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=config['port'])
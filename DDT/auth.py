@@ -0,0 +1,59 @@
+"""
+Admin authentication for the terminal. Passwords are checked by the central admins
+service, which owns the password hashes (and upgrades legacy ones on login); the
+access tokens it issues are verified here locally with the public key (or the shared
+HS256 secret on single host setups), loaded once, so admin actions need no database lookup.
+"""
+import functools
+
+import jwt
+import requests
+from cryptography.hazmat.primitives import serialization
+
+AUTH_ISSUER = 'shadowfly'
+CLOCK_SKEW_SECONDS = 30
+
+
+class AdminTokenVerifier:
+    def __init__(self, config):
+        self._public_key_file = config['auth_public_key_file']
+        self._secret = config['auth_secret']
+
+    @property
+    def enabled(self):
+        return bool(self._public_key_file or self._secret)
+
+    @functools.cached_property
+    def _key(self):
+        if self._public_key_file:
+            with open(self._public_key_file, 'rb') as f:
+                return serialization.load_pem_public_key(f.read()), 'RS256'
+        return self._secret, 'HS256'
+
+    def verify(self, token):
+        """Claims of a valid admin access token, or None"""
+        if not token or not self.enabled:
+            return None
+        key, algorithm = self._key
+        try:
+            claims = jwt.decode(token, key, algorithms=[algorithm], issuer=AUTH_ISSUER,
+                                leeway=CLOCK_SKEW_SECONDS, options={'require': ['exp', 'sub', 'typ']})
+        except jwt.InvalidTokenError as e:
+            print(f"[WARNING] Rejected admin token: {e}")
+            return None
+        if claims.get('typ') != 'access' or claims.get('role') != 'admin':
+            return None
+        return claims
+
+
+def central_admin_login(api_url, username, password, timeout=(3.05, 8)):
+    """Login response (with tokens) from the central admins service, or None if rejected or unreachable"""
+    try:
+        response = requests.post(f"{api_url.rstrip('/')}/api/login",
+                                 json={'username': username, 'password': password}, timeout=timeout)
+    except requests.RequestException as e:
+        print(f"[ERROR] Admin service unreachable: {e}")
+        return None
+    if response.status_code != 200:
+        return None
+    return response.json()
@@ -0,0 +1,354 @@
+"""
+Data backends for the DDT terminal, selected with the `backend` setting:
+
+- postgres: every lookup goes to the central database through a connection pool
+- replica:  lookups are answered from the on-device replica (local_store.py), with
+            the pooled database as fallback and sync target
+- mock:     in-memory sample tower for UI work without a database
+"""
+import threading
+import time
+
+import psycopg2.pool
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+from config import db_config
+from local_store import LocalReplica, RACK_COLUMN
+
+# Tower row plus every occupied rack_NN column with its package OTP, in one round trip.
+# Racks are discovered from the row itself, so towers with more than six racks work unchanged.
+DDT_DETAILS_QUERY = """
+    SELECT d.*, COALESCE(racks.rack_packages, '{}'::jsonb) AS rack_packages
+    FROM ddts d
+    LEFT JOIN LATERAL (
+        SELECT jsonb_object_agg(r.key, jsonb_build_object(
+                   'package_id', r.value,
+                   'otp', c.otp,
+                   'rack_number', 'R' || to_char(substring(r.key FROM '[0-9]+$')::int, 'FM000')
+               )) AS rack_packages
+        FROM jsonb_each_text(to_jsonb(d)) r
+        LEFT JOIN LATERAL (
+            SELECT otp FROM customers WHERE package_id = r.value LIMIT 1
+        ) c ON TRUE
+        WHERE r.key ~ '^rack_[0-9]+$' AND r.value IS NOT NULL AND r.value <> ''
+    ) racks ON TRUE
+    WHERE d.name = %s
+    LIMIT 1
+"""
+
+
+def _parse_otp(otp):
+    try:
+        return int(otp)
+    except (TypeError, ValueError):
+        return None
+
+
+class PostgresBackend:
+    """Central Postgres through a ThreadedConnectionPool."""
+
+    name = 'postgres'
+
+    def __init__(self, config):
+        self.ddt_name = config['ddt_name']
+        self.latency_budget_ms = config['latency_budget_ms']
+        self._db_config = db_config(config)
+        self._pool_min = config['pool_min']
+        self._pool_max = config['pool_max']
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    # --- Connection pool ---
+
+    def start(self):
+        self._initialize_pool()
+
+    def _initialize_pool(self):
+        if self._pool is None:
+            with self._pool_lock:
+                if self._pool is None:
+                    try:
+                        self._pool = psycopg2.pool.ThreadedConnectionPool(
+                            minconn=self._pool_min,
+                            maxconn=self._pool_max,
+                            **self._db_config
+                        )
+                        print("[INFO] Database connection pool initialized")
+                    except psycopg2.Error as e:
+                        print(f"[ERROR] Failed to create connection pool: {e}")
+
+    def get_connection(self):
+        """Get connection from pool"""
+        self._initialize_pool()
+        if self._pool is None:
+            return None
+        try:
+            return self._pool.getconn()
+        except psycopg2.Error as e:
+            print(f"[ERROR] Failed to get connection from pool: {e}")
+            return None
+
+    def return_connection(self, conn):
+        """Return connection to pool"""
+        if self._pool and conn:
+            # Connections broken by a dropped link are discarded instead of reused
+            self._pool.putconn(conn, close=bool(conn.closed))
+
+    def close(self):
+        if self._pool:
+            self._pool.closeall()
+            self._pool = None
+
+    # --- Terminal operations ---
+
+    def validate_otp(self, otp):
+        """Consumes an OTP at this tower with consume_otp(), which also clears its rack atomically"""
+        otp = _parse_otp(otp)
+        if otp is None:
+            return None
+        conn = self.get_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("SELECT * FROM consume_otp(%s, %s)", (self.ddt_name, otp))
+            customer = cursor.fetchone()
+            conn.commit()
+            cursor.close()
+            return dict(customer) if customer else None
+        except psycopg2.Error as e:
+            print(f"Database query error: {e}")
+            conn.rollback()
+            return None
+        finally:
+            self.return_connection(conn)
+
+    def release_otp(self, customer):
+        """Give a consumed OTP back (door failed to open) so the customer can retry"""
+        conn = self.get_connection()
+        if not conn:
+            return False
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "UPDATE customers SET otp_consumed_at = NULL WHERE customer_id = %s AND otp = %s",
+                (customer['customer_id'], customer['otp'])
+            )
+            rack = customer.get('rack')
+            if rack and RACK_COLUMN.match(rack):
+                cursor.execute(
+                    sql.SQL("UPDATE ddts SET {rack} = %s WHERE name = %s AND {rack} IS NULL").format(rack=sql.Identifier(rack)),
+                    (customer['package_id'], self.ddt_name)
+                )
+            conn.commit()
+            cursor.close()
+            return True
+        except psycopg2.Error as e:
+            print(f"[ERROR] Failed to release OTP for customer {customer['customer_id']}: {e}")
+            conn.rollback()
+            return False
+        finally:
+            self.return_connection(conn)
+
+    def get_package_details(self, package_id):
+        """Get package details from packagemanagement table"""
+        conn = self.get_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(
+                "SELECT package_id, current_status, item_details FROM packagemanagement WHERE package_id = %s LIMIT 1",
+                (package_id,)
+            )
+            package = cursor.fetchone()
+            cursor.close()
+            return dict(package) if package else None
+        except psycopg2.Error as e:
+            print(f"Database query error: {e}")
+            return None
+        finally:
+            self.return_connection(conn)
+
+    def get_ddt_details(self):
+        """Get DDT details with the package and OTP in each occupied rack"""
+        conn = self.get_connection()
+        if not conn:
+            return None
+        try:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute(DDT_DETAILS_QUERY, (self.ddt_name,))
+            ddt = cursor.fetchone()
+            cursor.close()
+            return dict(ddt) if ddt else None
+        except psycopg2.Error as e:
+            print(f"DDT query error: {e}")
+            return None
+        finally:
+            self.return_connection(conn)
+
+    # --- Self-test ---
+
+    def self_test(self):
+        """Measures a database round trip and the tower lookup against the latency budget."""
+        report = {'backend': self.name, 'ddt_name': self.ddt_name, 'latency_budget_ms': self.latency_budget_ms}
+        conn = self.get_connection()
+        if not conn:
+            report.update(ok=False, error='database unreachable')
+            return report
+        try:
+            cursor = conn.cursor()
+            started = time.perf_counter()
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+            report['db_round_trip_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            started = time.perf_counter()
+            cursor.execute(DDT_DETAILS_QUERY, (self.ddt_name,))
+            report['tower_found'] = cursor.fetchone() is not None
+            report['lookup_ms'] = round((time.perf_counter() - started) * 1000, 2)
+            cursor.close()
+            conn.rollback()
+            report['ok'] = report['tower_found']
+        except psycopg2.Error as e:
+            report.update(ok=False, error=str(e))
+        finally:
+            self.return_connection(conn)
+        return report
+
+
+class ReplicaBackend(PostgresBackend):
+    """On-device replica first; the pooled database fills misses and receives queued pickups."""
+
+    name = 'replica'
+
+    def __init__(self, config):
+        super().__init__(config)
+        self.replica = LocalReplica(config['local_store'], self.ddt_name)
+        self._sync_interval = config['sync_interval']
+
+    def start(self):
+        super().start()
+        # Keep the local replica in sync and replay offline pickups
+        self.replica.start_sync(self.get_connection, self.return_connection, self._sync_interval)
+
+    def validate_otp(self, otp):
+        """
+        OTPs are single use: a replicated OTP is consumed locally and replayed to the central
+        database by the sync thread; an OTP issued since the last sync is consumed centrally.
+        """
+        otp = _parse_otp(otp)
+        if otp is None:
+            return None
+        customer = self.replica.validate_otp(otp)
+        if customer:
+            return customer if self.replica.consume(customer) else None
+        if self.replica.is_consumed(otp):
+            return None
+        customer = super().validate_otp(otp)
+        if customer:
+            self.replica.consume(customer, queue=False)
+        return customer
+
+    def release_otp(self, customer):
+        if self.replica.release(customer):
+            return True
+        return super().release_otp(customer)
+
+    def get_package_details(self, package_id):
+        return self.replica.get_package(package_id) or super().get_package_details(package_id)
+
+    def get_ddt_details(self):
+        if self.replica.is_ready():
+            return self.replica.get_tower()
+        return super().get_ddt_details()
+
+    def self_test(self):
+        report = super().self_test()
+        started = time.perf_counter()
+        self.replica.validate_otp(0)
+        report['lookup_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        report['replica_ready'] = self.replica.is_ready()
+        report['pending_pickups'] = self.replica.pending_count()
+        # The terminal keeps serving from the replica while the database is unreachable
+        report['ok'] = report['replica_ready'] or report.get('ok', False)
+        return report
+
+
+class MockBackend:
+    """In-memory sample tower for UI work and tests; no database needed."""
+
+    name = 'mock'
+
+    def __init__(self, config):
+        self.ddt_name = config['ddt_name']
+        self.latency_budget_ms = config['latency_budget_ms']
+        self._lock = threading.Lock()
+        self._tower = {'id': 1, 'name': self.ddt_name, 'latitude': 0.0, 'longitude': 0.0, 'status': 'active',
+                       'rack_01': 'PKG-MOCK-1', 'rack_02': None, 'total_racks': 2, 'control_key': None}
+        self._customers = {
+            'CUST-MOCK-1': {'customer_id': 'CUST-MOCK-1', 'customer_name': 'Test Customer',
+                            'mail_id': 'test@example.com', 'package_id': 'PKG-MOCK-1',
+                            'item_details': 'Sample item', 'otp': 123456, 'rack': 'rack_01'},
+        }
+        self._packages = {
+            'PKG-MOCK-1': {'package_id': 'PKG-MOCK-1', 'current_status': 'delivered', 'item_details': 'Sample item'},
+        }
+        self._consumed = set()
+
+    def start(self):
+        print("[INFO] Mock backend: sample OTP 123456 opens rack_01")
+
+    def close(self):
+        pass
+
+    def validate_otp(self, otp):
+        otp = _parse_otp(otp)
+        with self._lock:
+            for customer in self._customers.values():
+                if customer['otp'] == otp and customer['customer_id'] not in self._consumed:
+                    self._consumed.add(customer['customer_id'])
+                    if self._tower.get(customer['rack']) == customer['package_id']:
+                        self._tower[customer['rack']] = None
+                    return dict(customer)
+        return None
+
+    def release_otp(self, customer):
+        with self._lock:
+            self._consumed.discard(customer['customer_id'])
+            if self._tower.get(customer['rack']) is None:
+                self._tower[customer['rack']] = customer['package_id']
+        return True
+
+    def get_package_details(self, package_id):
+        package = self._packages.get(package_id)
+        return dict(package) if package else None
+
+    def get_ddt_details(self):
+        with self._lock:
+            tower = dict(self._tower)
+        otps = {c['package_id']: c['otp'] for c in self._customers.values()}
+        tower['rack_packages'] = {
+            key: {'package_id': value, 'otp': otps.get(value), 'rack_number': f'R{int(key[5:]):03d}'}
+            for key, value in tower.items() if RACK_COLUMN.match(key) and value
+        }
+        return tower
+
+    def self_test(self):
+        return {'backend': self.name, 'ddt_name': self.ddt_name, 'latency_budget_ms': self.latency_budget_ms,
+                'lookup_ms': 0.0, 'ok': True}
+
+
+BACKENDS = {
+    'postgres': PostgresBackend,
+    'replica': ReplicaBackend,
+    'mock': MockBackend,
+}
+
+
+def create_backend(config):
+    try:
+        backend_class = BACKENDS[config['backend']]
+    except KeyError:
+        raise ValueError(f"Unknown DDT backend '{config['backend']}', expected one of: {', '.join(BACKENDS)}")
+    return backend_class(config)
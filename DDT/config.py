@@ -0,0 +1,94 @@
+"""
+Terminal configuration. Defaults are overridden by an optional JSON file named in
+DDT_CONFIG, then by environment variables. A .env file next to app.py is loaded
+first when python-dotenv is installed.
+"""
+import json
+import os
+
+try:
+    from dotenv import load_dotenv
+except ImportError:
+    load_dotenv = None
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULTS = {
+    'backend': 'replica',
+    'ddt_name': 'SFDDT',
+    'control_url': 'https://sddtlaunch-akshai.in1.pitunnel.net',
+    'db_host': 'localhost',
+    'db_name': 'shadowfly',
+    'db_user': 'postgres',
+    'db_password': 'admin',
+    'db_port': 5432,
+    'pool_min': 2,
+    'pool_max': 10,
+    'local_store': os.path.join(BASE_DIR, 'ddt_local.sqlite3'),
+    'sync_interval': 5.0,
+    'session_ttl': 900,
+    'secret_key': 'your-secret-key-change-this-in-production',
+    'admin_api_url': 'http://localhost:5072',
+    'auth_public_key_file': '',
+    'auth_secret': '',
+    'latency_budget_ms': 50.0,
+    'port': 7000,
+}
+
+ENV_VARS = {
+    'backend': 'DDT_BACKEND',
+    'ddt_name': 'DDT_NAME',
+    'control_url': 'DDT_CONTROL_URL',
+    'db_host': 'DB_HOST',
+    'db_name': 'DB_NAME',
+    'db_user': 'DB_USER',
+    'db_password': 'DB_PASS',
+    'db_port': 'DB_PORT',
+    'pool_min': 'DDT_POOL_MIN',
+    'pool_max': 'DDT_POOL_MAX',
+    'local_store': 'DDT_LOCAL_STORE',
+    'sync_interval': 'DDT_SYNC_INTERVAL',
+    'session_ttl': 'DDT_SESSION_TTL',
+    'secret_key': 'DDT_SECRET_KEY',
+    'admin_api_url': 'DDT_ADMIN_API_URL',
+    'auth_public_key_file': 'AUTH_PUBLIC_KEY_FILE',
+    'auth_secret': 'AUTH_SECRET',
+    'latency_budget_ms': 'DDT_LATENCY_BUDGET_MS',
+    'port': 'DDT_PORT',
+}
+
+
+def load_config(path=None):
+    """Returns the terminal settings as a dict with the same keys and value types as DEFAULTS."""
+    if load_dotenv:
+        load_dotenv(os.path.join(BASE_DIR, '.env'))
+
+    config = dict(DEFAULTS)
+    path = path or os.environ.get('DDT_CONFIG')
+    if path:
+        with open(path) as f:
+            overrides = json.load(f)
+        unknown = set(overrides) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"Unknown settings in {path}: {', '.join(sorted(unknown))}")
+        config.update(overrides)
+
+    for key, env_var in ENV_VARS.items():
+        if env_var in os.environ:
+            config[key] = os.environ[env_var]
+
+    for key, default in DEFAULTS.items():
+        if not isinstance(config[key], type(default)):
+            config[key] = type(default)(config[key])
+    return config
+
+
+def db_config(config):
+    """psycopg2 connection keyword arguments."""
+    return {
+        'host': config['db_host'],
+        'database': config['db_name'],
+        'user': config['db_user'],
+        'password': config['db_password'],
+        'port': config['db_port'],
+    }
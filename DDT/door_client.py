@@ -0,0 +1,144 @@
+"""
+Door-open command client for the Raspberry Pi rack controller.
+
+One keep-alive session is reused for every command so PiTunnel's TCP/TLS setup is
+paid once. A command is retried only when the connection could not be made or the
+tunnel answered 503. It is never retried after a read timeout or a 502/504, because the
+proxy may have forwarded it and the controller may already have opened the door.
+Commands still carry an idempotency key for controllers that honour it. Kiosk requests submit commands asynchronously and
+follow them with door_status_stream().
+"""
+import json
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+PENDING = 'pending'
+OPENED = 'opened'
+FAILED = 'failed'
+
+
+class DoorClient:
+    """Pooled, retrying client for /door-open commands with asynchronous completion."""
+
+    def __init__(self, base_url, connect_timeout=3.05, read_timeout=8, retries=2, backoff=0.5,
+                 max_workers=4, max_tracked=256):
+        self.base_url = base_url.rstrip('/')
+        self._timeout = (connect_timeout, read_timeout)
+        self._session = requests.Session()
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,             # the door may already be open; never resend after a read timeout
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(503,),  # 502/504 may come after the controller acted on it
+            allowed_methods=frozenset(['POST']),
+            raise_on_status=False
+        )
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers, max_retries=retry)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._session.headers.update({'Content-Type': 'application/json'})
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="door")
+        self._commands = OrderedDict()
+        self._max_tracked = max_tracked
+        self._cond = threading.Condition()
+
+    def open_door(self, rack_name, command_id=None):
+        """Sends one door-open command and waits for the controller. Returns True on success."""
+        command_id = command_id or uuid.uuid4().hex
+        url = f"{self.base_url}/door-open"
+        payload = {"cmd": rack_name.lower(), "command_id": command_id}
+        print(f"[INFO] Sending door open command {command_id} to {url} with payload: {payload}")
+        started = time.monotonic()
+        try:
+            response = self._session.post(
+                url,
+                json=payload,
+                timeout=self._timeout,
+                headers={'Idempotency-Key': command_id}
+            )
+            elapsed = (time.monotonic() - started) * 1000
+            if response.status_code == 200:
+                print(f"[SUCCESS] Door open command sent successfully for {rack_name} in {elapsed:.0f} ms")
+                return True
+            print(f"[ERROR] Door open failed with status code: {response.status_code}")
+            return False
+        except requests.exceptions.RequestException as e:
+            print(f"[ERROR] Failed to send door open command: {e}")
+            return False
+
+    def open_door_async(self, rack_name, on_done=None):
+        """
+        Queues a door-open command and returns its id immediately. on_done(success) runs
+        on the worker thread once the controller answers or retries are exhausted.
+        """
+        command_id = uuid.uuid4().hex
+        self._set_status(command_id, rack_name, PENDING)
+
+        def run():
+            success = self.open_door(rack_name, command_id)
+            self._set_status(command_id, rack_name, OPENED if success else FAILED)
+            if on_done:
+                try:
+                    on_done(success)
+                except Exception as e:
+                    print(f"[ERROR] Door command callback failed for {command_id}: {e}")
+
+        self._executor.submit(run)
+        return command_id
+
+    def status(self, command_id):
+        with self._cond:
+            command = self._commands.get(command_id)
+            return dict(command) if command else None
+
+    def wait(self, command_id, timeout):
+        """Blocks until the command leaves the pending state or timeout passes; returns its status."""
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while True:
+                command = self._commands.get(command_id)
+                remaining = deadline - time.monotonic()
+                if command is None or command['status'] != PENDING or remaining <= 0:
+                    return dict(command) if command else None
+                self._cond.wait(remaining)
+
+    def door_status_stream(self, command_id, timeout=30.0, heartbeat=5.0):
+        """Server-Sent Events for one command: its current state, then the final one."""
+        yield "retry: 2000\n\n"
+        deadline = time.monotonic() + timeout
+        command = self.status(command_id)
+        if command is not None:
+            yield f"event: door\ndata: {json.dumps(command)}\n\n"
+        while command is not None and command['status'] == PENDING:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return
+            command = self.wait(command_id, min(heartbeat, remaining))
+            if command is not None and command['status'] == PENDING:
+                yield ": waiting\n\n"
+            elif command is not None:
+                yield f"event: door\ndata: {json.dumps(command)}\n\n"
+        if command is None:
+            yield f"event: door\ndata: {json.dumps({'command_id': command_id, 'status': 'unknown'})}\n\n"
+
+    def _set_status(self, command_id, rack_name, status):
+        with self._cond:
+            self._commands[command_id] = {
+                'command_id': command_id,
+                'rack': rack_name,
+                'status': status,
+                'updated_at': time.time()
+            }
+            self._commands.move_to_end(command_id)
+            while len(self._commands) > self._max_tracked:
+                self._commands.popitem(last=False)
+            self._cond.notify_all()
@@ -0,0 +1,396 @@
+"""
+On-device replica of the rows this terminal needs: its tower row, the customers
+(OTPs) and package summaries for packages sitting in its racks. Backed by SQLite
+so OTP checks keep working when the link to the central database is down.
+Pickups made offline are queued and replayed when the link returns.
+"""
+import json
+import re
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+import psycopg2
+from psycopg2 import sql
+from psycopg2.extras import RealDictCursor
+
+RACK_COLUMN = re.compile(r'^rack_[0-9]+$')
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS tower (
+        name TEXT PRIMARY KEY,
+        id INTEGER,
+        data TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS customers (
+        customer_id TEXT PRIMARY KEY,
+        customer_name TEXT,
+        mail_id TEXT,
+        package_id TEXT NOT NULL,
+        item_details TEXT,
+        otp INTEGER,
+        rack TEXT
+    );
+    CREATE INDEX IF NOT EXISTS idx_customers_otp ON customers (otp);
+    CREATE TABLE IF NOT EXISTS packages (
+        package_id TEXT PRIMARY KEY,
+        current_status TEXT,
+        item_details TEXT
+    );
+    CREATE TABLE IF NOT EXISTS sync_state (
+        key TEXT PRIMARY KEY,
+        value TEXT
+    );
+    CREATE TABLE IF NOT EXISTS pending_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        kind TEXT NOT NULL,
+        payload TEXT NOT NULL,
+        created_at TEXT NOT NULL
+    );
+"""
+
+CUSTOMER_COLUMNS = ('customer_id', 'customer_name', 'mail_id', 'package_id', 'item_details', 'otp', 'rack')
+
+
+def rack_columns(row):
+    """rack_NN column names present in a tower row, in rack order."""
+    return sorted((key for key in row if RACK_COLUMN.match(key)), key=lambda key: int(key[5:]))
+
+
+class LocalReplica:
+    """SQLite replica of one tower's slice of the central database."""
+
+    def __init__(self, path, ddt_name):
+        self.ddt_name = ddt_name
+        self.last_synced_at = None
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.row_factory = sqlite3.Row
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    # --- Local reads ---
+
+    def is_ready(self):
+        """True once the tower slice has been pulled at least once."""
+        return self._get_state('cursor') is not None
+
+    def validate_otp(self, otp):
+        """Returns the customer holding this unused OTP at this tower, or None."""
+        try:
+            otp = int(otp)
+        except (TypeError, ValueError):
+            return None
+        with self._lock:
+            row = self._db.execute("SELECT * FROM customers WHERE otp = ? LIMIT 1", (otp,)).fetchone()
+        return dict(row) if row else None
+
+    def is_consumed(self, otp):
+        """True if this OTP was used here and the pickup has not reached the backend yet."""
+        try:
+            otp = int(otp)
+        except (TypeError, ValueError):
+            return False
+        with self._lock:
+            row = self._db.execute(
+                "SELECT 1 FROM pending_events WHERE kind = 'consume' AND json_extract(payload, '$.otp') = ? LIMIT 1",
+                (otp,)
+            ).fetchone()
+        return row is not None
+
+    def get_package(self, package_id):
+        with self._lock:
+            row = self._db.execute("SELECT * FROM packages WHERE package_id = ?", (package_id,)).fetchone()
+        return dict(row) if row else None
+
+    def get_tower(self):
+        """Tower row with rack_packages, in the same shape as the central get_ddt_details."""
+        with self._lock:
+            row = self._db.execute("SELECT data FROM tower WHERE name = ?", (self.ddt_name,)).fetchone()
+            otps = dict(self._db.execute("SELECT package_id, otp FROM customers").fetchall())
+        if not row:
+            return None
+        tower = json.loads(row['data'])
+        tower['rack_packages'] = {}
+        for rack_key in rack_columns(tower):
+            package_id = tower.get(rack_key)
+            if package_id:
+                tower['rack_packages'][rack_key] = {
+                    'package_id': package_id,
+                    'otp': otps.get(package_id),
+                    'rack_number': f'R{int(rack_key[5:]):03d}'
+                }
+        return tower
+
+    def pending_count(self):
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM pending_events").fetchone()[0]
+
+    # --- Local writes ---
+
+    def consume(self, customer, queue=True):
+        """
+        Marks a customer's OTP as used and their rack as emptied locally, and queues the
+        pickup for the central database unless it was already consumed there (queue=False).
+        Returns False if the OTP was already used here.
+        """
+        event = {
+            'customer_id': customer['customer_id'],
+            'package_id': customer['package_id'],
+            'otp': customer['otp'],
+            'rack': customer.get('rack'),
+            'ddt_name': self.ddt_name,
+            'consumed_at': datetime.now().isoformat()
+        }
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                local = self._db.execute(
+                    "SELECT otp FROM customers WHERE customer_id = ?", (event['customer_id'],)
+                ).fetchone()
+                # A customer validated against the central database may not be replicated yet
+                if local is not None and local['otp'] != event['otp']:
+                    self._db.execute("ROLLBACK")
+                    return False
+                self._db.execute("UPDATE customers SET otp = NULL WHERE customer_id = ?", (event['customer_id'],))
+                self._set_local_rack(event['rack'], event['package_id'], None)
+                if queue:
+                    self._db.execute(
+                        "INSERT INTO pending_events (kind, payload, created_at) VALUES ('consume', ?, ?)",
+                        (json.dumps(event), event['consumed_at'])
+                    )
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        if queue:
+            self._wake.set()
+        return True
+
+    def release(self, customer):
+        """
+        Undoes consume() locally, e.g. when the door failed to open. Returns True if the
+        pickup was still queued, in which case the central database never saw it.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                dropped = self._db.execute(
+                    "DELETE FROM pending_events WHERE kind = 'consume' AND json_extract(payload, '$.customer_id') = ?",
+                    (customer['customer_id'],)
+                ).rowcount
+                self._db.execute(
+                    "UPDATE customers SET otp = ? WHERE customer_id = ? AND otp IS NULL",
+                    (customer['otp'], customer['customer_id'])
+                )
+                self._set_local_rack(customer.get('rack'), None, customer['package_id'])
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        return dropped > 0
+
+    def _set_local_rack(self, rack, expected, value):
+        if not rack or not RACK_COLUMN.match(rack):
+            return
+        row = self._db.execute("SELECT data FROM tower WHERE name = ?", (self.ddt_name,)).fetchone()
+        if not row:
+            return
+        tower = json.loads(row['data'])
+        if tower.get(rack) == expected:
+            tower[rack] = value
+            self._db.execute("UPDATE tower SET data = ? WHERE name = ?", (json.dumps(tower, default=str), self.ddt_name))
+
+    # --- Sync with the central database ---
+
+    def replay_pending(self, conn):
+        """
+        Applies queued pickups to the central database in order through consume_otp(),
+        which also clears the rack. Each replay is idempotent. When the OTP no longer
+        matches (regenerated centrally meanwhile) the package has still left its rack,
+        so the rack is cleared and the customer's OTP closed by package_id instead.
+        Stops at the first connection failure and leaves the rest queued.
+        Returns True when the queue is empty.
+        """
+        with self._lock:
+            events = self._db.execute("SELECT id, kind, payload FROM pending_events ORDER BY id").fetchall()
+        for event in events:
+            payload = json.loads(event['payload'])
+            try:
+                with conn.cursor() as cursor:
+                    # consume_otp() returns no row if the OTP was already consumed or has changed
+                    cursor.execute("SELECT customer_id FROM consume_otp(%s, %s)", (payload['ddt_name'], payload['otp']))
+                    if cursor.fetchone() is None:
+                        self._settle_pickup(cursor, payload)
+                conn.commit()
+            except (psycopg2.OperationalError, psycopg2.InterfaceError) as e:
+                print(f"[WARN] Central database unreachable, {len(events)} pickup(s) stay queued: {e}")
+                return False
+            except psycopg2.Error as e:
+                conn.rollback()
+                print(f"[ERROR] Dropping pickup event {event['id']} that cannot be applied: {e}")
+            with self._lock:
+                self._db.execute("DELETE FROM pending_events WHERE id = ?", (event['id'],))
+            print(f"[INFO] Replayed pickup of package {payload['package_id']} (OTP consumed at {payload['consumed_at']})")
+        return True
+
+    def _settle_pickup(self, cursor, payload):
+        cursor.execute("""
+            UPDATE customers SET otp_consumed_at = CURRENT_TIMESTAMP
+            WHERE customer_id = %s AND package_id = %s AND otp_consumed_at IS NULL
+        """, (payload['customer_id'], payload['package_id']))
+        reopened = cursor.rowcount
+        rack = payload.get('rack')
+        cleared = 0
+        if rack and RACK_COLUMN.match(rack):
+            cursor.execute(
+                sql.SQL("UPDATE ddts SET {rack} = NULL WHERE name = %s AND {rack} = %s").format(rack=sql.Identifier(rack)),
+                (payload['ddt_name'], payload['package_id'])
+            )
+            cleared = cursor.rowcount
+        if reopened or cleared:
+            print(f"[WARN] OTP {payload['otp']} of package {payload['package_id']} changed centrally after its offline pickup; "
+                  f"closed its OTP and cleared {rack if cleared else 'no rack'}")
+
+    def pull(self, conn):
+        """
+        Refreshes the tower slice when the change log shows it was touched since the last pull.
+        The cursor is a transaction id, as in the central change_log.current_cursor(): the
+        oldest transaction still in flight when it was read, so a change committed late is
+        seen on the next pull. A cursor older than the pruned log forces a full refresh.
+        """
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        try:
+            cursor.execute("""
+                SELECT to_regclass('change_log') IS NOT NULL AS tracked,
+                       to_regclass('change_log_horizon') IS NOT NULL AS pruned
+            """)
+            state = cursor.fetchone()
+            head = None
+            if state['tracked']:
+                cursor.execute("SELECT txid_snapshot_xmin(txid_current_snapshot()) AS head")
+                head = int(cursor.fetchone()['head'])
+                horizon = 0
+                if state['pruned']:
+                    cursor.execute("SELECT pruned_below FROM change_log_horizon")
+                    row = cursor.fetchone()
+                    horizon = row['pruned_below'] if row else 0
+                since = self._get_state('cursor')
+                if since is not None and int(since) >= horizon and not self._slice_changed(cursor, int(since)):
+                    self._set_state('cursor', head)
+                    conn.commit()
+                    return False
+            self._refresh_slice(cursor)
+            self._set_state('cursor', head if head is not None else 0)
+            conn.commit()
+            return True
+        finally:
+            cursor.close()
+
+    def sync(self, conn):
+        """Pushes queued pickups, then pulls. Nothing is pulled while pickups are still queued,
+        so a consumed OTP is never brought back from a stale central row."""
+        if not self.replay_pending(conn):
+            return False
+        self.pull(conn)
+        self.last_synced_at = time.time()
+        return True
+
+    def start_sync(self, get_connection, return_connection, interval=5.0):
+        """Runs sync() in a background thread every interval seconds, or right after a pickup."""
+        if self._thread and self._thread.is_alive():
+            return
+
+        def run():
+            while True:
+                conn = get_connection()
+                if conn:
+                    try:
+                        self.sync(conn)
+                    except psycopg2.Error as e:
+                        print(f"[WARN] Local replica sync failed: {e}")
+                        try:
+                            conn.rollback()
+                        except psycopg2.Error:
+                            pass
+                    finally:
+                        return_connection(conn)
+                self._wake.wait(interval)
+                self._wake.clear()
+
+        self._thread = threading.Thread(target=run, name="ddt-local-sync", daemon=True)
+        self._thread.start()
+
+    def _slice_changed(self, cursor, since):
+        with self._lock:
+            tower = self._db.execute("SELECT id FROM tower WHERE name = ?", (self.ddt_name,)).fetchone()
+            customer_ids = [r[0] for r in self._db.execute("SELECT customer_id FROM customers").fetchall()]
+            package_ids = [r[0] for r in self._db.execute("SELECT package_id FROM packages").fetchall()]
+        cursor.execute("""
+            SELECT 1 FROM change_log
+            WHERE txid >= %s AND (
+                (table_name = 'ddts' AND row_key = %s)
+                OR (table_name = 'customers' AND row_key = ANY(%s))
+                OR (table_name = 'packagemanagement' AND row_key = ANY(%s))
+            )
+            LIMIT 1
+        """, (since, str(tower['id']) if tower else None, customer_ids, package_ids))
+        # Without a local tower row any ddts change may be ours
+        return cursor.fetchone() is not None or tower is None
+
+    def _refresh_slice(self, cursor):
+        cursor.execute("SELECT * FROM ddts WHERE name = %s LIMIT 1", (self.ddt_name,))
+        tower = cursor.fetchone()
+        tower = dict(tower) if tower else None
+        package_ids = [tower[key] for key in rack_columns(tower) if tower[key]] if tower else []
+        customers, packages = [], []
+        if package_ids:
+            # Consumed OTPs are replicated as NULL so they can never validate locally
+            cursor.execute("""
+                SELECT customer_id, customer_name, mail_id, package_id, item_details, rack,
+                       CASE WHEN otp_consumed_at IS NULL THEN otp END AS otp
+                FROM customers WHERE ddt_name = %s AND package_id = ANY(%s)
+            """, (self.ddt_name, package_ids))
+            customers = cursor.fetchall()
+            cursor.execute("""
+                SELECT package_id, current_status, item_details FROM packagemanagement WHERE package_id = ANY(%s)
+            """, (package_ids,))
+            packages = cursor.fetchall()
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("DELETE FROM tower")
+                self._db.execute("DELETE FROM customers")
+                self._db.execute("DELETE FROM packages")
+                if tower:
+                    self._db.execute(
+                        "INSERT INTO tower (name, id, data) VALUES (?, ?, ?)",
+                        (self.ddt_name, tower['id'], json.dumps(tower, default=str))
+                    )
+                self._db.executemany(
+                    f"INSERT OR REPLACE INTO customers ({', '.join(CUSTOMER_COLUMNS)}) VALUES ({', '.join('?' * len(CUSTOMER_COLUMNS))})",
+                    [tuple(c[col] for col in CUSTOMER_COLUMNS) for c in customers]
+                )
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO packages (package_id, current_status, item_details) VALUES (?, ?, ?)",
+                    [(p['package_id'], p['current_status'], p['item_details']) for p in packages]
+                )
+                self._db.execute("COMMIT")
+            except sqlite3.Error:
+                self._db.execute("ROLLBACK")
+                raise
+        print(f"[INFO] Local replica refreshed: {len(package_ids)} occupied rack(s) at {self.ddt_name}")
+
+    def _get_state(self, key):
+        with self._lock:
+            row = self._db.execute("SELECT value FROM sync_state WHERE key = ?", (key,)).fetchone()
+        return row['value'] if row else None
+
+    def _set_state(self, key, value):
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)", (key, str(value)))
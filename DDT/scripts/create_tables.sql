@@ -31,3 +31,9 @@ CREATE INDEX IF NOT EXISTS idx_admins_username ON admins_data(username);
 CREATE INDEX IF NOT EXISTS idx_ddts_name ON ddts(name);
 CREATE INDEX IF NOT EXISTS idx_customers_otp ON customers(otp);
 CREATE INDEX IF NOT EXISTS idx_customers_package_id ON customers(package_id);
+
+-- OTPs are scoped to a tower and single use (consume_otp() is installed by tower_control.py)
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS ddt_name VARCHAR(255);
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS otp_consumed_at TIMESTAMP WITH TIME ZONE;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_active_otp ON customers(ddt_name, otp)
+    WHERE otp IS NOT NULL AND otp_consumed_at IS NULL;
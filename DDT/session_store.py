@@ -0,0 +1,81 @@
+"""
+Server-side session store for the DDT terminal. The cookie carries only an opaque
+random id; session data (validated customer, cached package details) stays in
+process memory and expires after a period of inactivity.
+
+The kiosk runs as a single process, so an in-memory store is enough.
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+
+class ServerSideSession(CallbackDict, SessionMixin):
+    def __init__(self, initial=None, sid=None, new=False):
+        def on_update(session):
+            session.modified = True
+        super().__init__(initial, on_update)
+        self.sid = sid
+        self.new = new
+        self.modified = False
+
+
+class MemorySessionInterface(SessionInterface):
+    """In-memory sessions with idle TTL eviction and a cap on the number kept."""
+
+    def __init__(self, ttl=900, max_sessions=1024):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._store = OrderedDict()
+        self._lock = threading.Lock()
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid:
+            with self._lock:
+                entry = self._store.get(sid)
+                if entry and entry[0] > time.monotonic():
+                    self._store.move_to_end(sid)
+                    return ServerSideSession(entry[1], sid=sid)
+                self._store.pop(sid, None)
+        return ServerSideSession(sid=secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        cookie_name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if not session:
+            with self._lock:
+                self._store.pop(session.sid, None)
+            if session.modified and not session.new:
+                response.delete_cookie(cookie_name, domain=domain, path=path)
+            return
+
+        with self._lock:
+            self._store[session.sid] = (time.monotonic() + self.ttl, dict(session))
+            self._store.move_to_end(session.sid)
+            self._evict()
+
+        if session.new or session.modified or self.should_set_cookie(app, session):
+            response.set_cookie(
+                cookie_name,
+                session.sid,
+                max_age=self.ttl,
+                httponly=self.get_cookie_httponly(app),
+                secure=self.get_cookie_secure(app),
+                samesite=self.get_cookie_samesite(app),
+                domain=domain,
+                path=path
+            )
+
+    def _evict(self):
+        """Drops expired sessions, then the least recently used beyond max_sessions. Caller holds the lock."""
+        # Entries are kept in expiry order (every save moves its session to the end)
+        now = time.monotonic()
+        while self._store and (len(self._store) > self.max_sessions or next(iter(self._store.values()))[0] <= now):
+            self._store.popitem(last=False)
@@ -4,9 +4,19 @@ import os
 import logging
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
+from location_search import install_search_indexes
+from range_matrix import RangeMatrix
+from dispatch import parse_weight
+from viewport import install_spatial_indexes, parse_bbox, bbox_condition
+from change_log import install_change_log, parse_cursor, current_cursor, changed_keys_since, delta_payload, with_cursor_header, CursorExpired, expired_cursor_body
 
 app = Flask(__name__)
 CORS(app)
+# Admin dashboard API: requires an admin access token
+protect_app(app, roles=('admin',))
 
 # Database connection details (ensure these are correct)
 DB_HOST = "localhost"
@@ -22,7 +32,7 @@ app.logger.setLevel(logging.INFO)
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -89,6 +99,9 @@ def create_tables():
     
 
         conn.commit()
+        install_change_log(conn)
+        install_spatial_indexes(conn)
+        install_search_indexes(conn)
     except (Exception, psycopg2.Error) as e:
         app.logger.error(f"Error creating tables: {e}")
         if conn: conn.rollback()
@@ -100,6 +113,9 @@ def create_tables():
 
 create_tables() # Call this once at startup to ensure tables exist
 
+# Warehouse x DDT range matrix; the routes below update only the changed row or column
+range_matrix = RangeMatrix.shared(get_db_connection)
+
 
 @app.route('/add_ddt', methods=['POST'])
 def add_ddt():
@@ -163,6 +179,7 @@ def add_ddt():
             ddt_to_return['latitude'] = float(ddt_to_return['latitude'])
             ddt_to_return['longitude'] = float(ddt_to_return['longitude'])
             ddt_to_return['total_racks'] = int(ddt_to_return['total_racks']) if ddt_to_return['total_racks'] is not None else None
+            range_matrix.upsert_tower(ddt_to_return)
             return jsonify({'message': 'DDT added successfully', 'ddt': ddt_to_return}), 201
         else:
             app.logger.error("[DEBUG][ADD DDT] Failed to retrieve added DDT after insertion (fetchone returned None).")
@@ -221,6 +238,7 @@ def add_warehouse():
             warehouse_to_return = dict(new_warehouse_record)
             warehouse_to_return['latitude'] = float(warehouse_to_return['latitude'])
             warehouse_to_return['longitude'] = float(warehouse_to_return['longitude'])
+            range_matrix.upsert_warehouse(warehouse_to_return)
             return jsonify({'message': 'Warehouse added successfully', 'warehouse': warehouse_to_return}), 201
         else:
             app.logger.error("[DEBUG][ADD WAREHOUSE] Failed to retrieve added warehouse after insertion.")
@@ -237,26 +255,41 @@ def add_warehouse():
 
 @app.route('/get_ddts', methods=['GET'])
 def get_ddts_route():
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({'error': "Invalid 'since' cursor"}), 400
+
     conn = None
     cur = None
     try:
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("""
-            SELECT
-                ROW_NUMBER() OVER (ORDER BY id) as sequential_id,
-                id,
-                name,
-                latitude,
-                longitude,
-                status,
-                total_racks,
-                control_key
-            FROM
-                ddts
+        if since is None:
+            cursor = current_cursor(cur)
+            key_filter, key_params = "", None
+        else:
+            # sequential_id is the row's current position; clients renumber after applying deletes
+            changed_keys, cursor = changed_keys_since(cur, 'ddts', since)
+            key_filter, key_params = "WHERE id = ANY(%s::int[])", (changed_keys,)
+        cur.execute(f"""
+            SELECT * FROM (
+                SELECT
+                    ROW_NUMBER() OVER (ORDER BY id) as sequential_id,
+                    id,
+                    name,
+                    latitude,
+                    longitude,
+                    status,
+                    total_racks,
+                    control_key
+                FROM
+                    ddts
+            ) numbered
+            {key_filter}
             ORDER BY
                 id;
-        """)
+        """, key_params)
         ddts_records = cur.fetchall()
 
         result_list = []
@@ -266,7 +299,11 @@ def get_ddts_route():
             ddt_item['longitude'] = float(ddt_item['longitude'])
             result_list.append(ddt_item)
 
-        return jsonify(result_list), 200
+        if since is not None:
+            return jsonify(delta_payload(changed_keys, result_list, 'id', cursor)), 200
+        return with_cursor_header(jsonify(result_list), cursor), 200
+    except CursorExpired:
+        return jsonify(expired_cursor_body()), 410
     except (Exception, psycopg2.Error) as e:
         app.logger.error(f"[DEBUG][GET DDTS] Error: {e}", exc_info=True)
         return jsonify({'error': str(e)}), 500
@@ -279,20 +316,29 @@ def get_warehouses_route():
     conn = None
     cur = None
     try:
+        try:
+            condition, params = bbox_condition(parse_bbox(request.args.get('bbox')))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid bbox: {e}'}), 400
+
         conn = get_db_connection()
         cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute("""
-            SELECT
-                ROW_NUMBER() OVER (ORDER BY id) as sequential_id,
-                id,
-                name,
-                latitude,
-                longitude
-            FROM
-                warehouses
+        # sequential_id is numbered over the whole table so it stays stable when a bbox is applied
+        cur.execute(f"""
+            SELECT * FROM (
+                SELECT
+                    ROW_NUMBER() OVER (ORDER BY id) as sequential_id,
+                    id,
+                    name,
+                    latitude,
+                    longitude
+                FROM
+                    warehouses
+            ) numbered
+            WHERE {condition}
             ORDER BY
                 id;
-        """)
+        """, params)
         warehouses_records = cur.fetchall()
 
         result_list = []
@@ -409,6 +455,7 @@ def update_ddt(ddt_id):
             ddt_to_return = dict(updated_ddt_record)
             ddt_to_return['latitude'] = float(ddt_to_return['latitude'])
             ddt_to_return['longitude'] = float(ddt_to_return['longitude'])
+            range_matrix.upsert_tower(ddt_to_return)
 
             # If the name was changed, update users_data
             # Use 'name' from the request, as it's the new name being applied
@@ -489,6 +536,7 @@ def delete_ddt(ddt_id):
         if deleted_id_tuple:
             conn.commit()
             app.logger.info(f"[DEBUG][DELETE DDT ID: {ddt_id}] Delete committed.")
+            range_matrix.remove_tower(ddt_id)
             return jsonify({'message': f'DDT {ddt_id} deleted and related entries updated successfully'}), 200
         else:
             if conn: conn.rollback()
@@ -680,6 +728,7 @@ def update_warehouse(warehouse_id):
             warehouse_to_return = dict(updated_warehouse_record)
             warehouse_to_return['latitude'] = float(warehouse_to_return['latitude'])
             warehouse_to_return['longitude'] = float(warehouse_to_return['longitude'])
+            range_matrix.upsert_warehouse(warehouse_to_return)
             return jsonify({'message': 'Warehouse updated successfully, and relevant assignments synced.', 'warehouse': warehouse_to_return}), 200
         else:
             app.logger.warning(f"[DEBUG][UPDATE WAREHOUSE ID: {warehouse_id}] Warehouse not found during update or no change made.")
@@ -739,6 +788,7 @@ def delete_warehouse(warehouse_id):
         if deleted_id_tuple: 
             conn.commit()
             app.logger.info(f"[DEBUG][DELETE WAREHOUSE ID: {warehouse_id}] Committed.")
+            range_matrix.remove_warehouse(warehouse_id)
             return jsonify({'message': f'Warehouse {warehouse_id} ({warehouse_name_to_delete}) deleted and related entries updated successfully'}), 200
         else:
             app.logger.warning(f"[DEBUG][DELETE WAREHOUSE ID: {warehouse_id}] Warehouse not found during final delete step, though initial fetch succeeded (unexpected).")
@@ -847,6 +897,11 @@ def get_warehouses():
 # API Endpoint to get assignments
 @app.route('/api/assignments', methods=['GET'])
 def get_assignments():
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "Invalid 'since' cursor"}), 400
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Could not connect to the database."}), 500
@@ -854,13 +909,20 @@ def get_assignments():
     assignments_list = []
     try:
         with conn.cursor() as cur:
+            if since is None:
+                cursor = current_cursor(cur)
+                key_filter, key_params = "", None
+            else:
+                changed_keys, cursor = changed_keys_since(cur, 'droneassignment', since)
+                key_filter, key_params = "WHERE da.id = ANY(%s::int[])", (changed_keys,)
             # Changed da.longitude to da.logitude in the SQL query
-            cur.execute("""
+            cur.execute(f"""
                 SELECT da.id, da.drone_id, da.drone_name, da.name as warehouse_name,
                        da.latitude, da.longitude, da.status
                 FROM droneassignment da
+                {key_filter}
                 ORDER BY da.drone_id ASC
-            """) #
+            """, key_params) #
             assignments_data = cur.fetchall()
             for row in assignments_data:
                 assignments_list.append({
@@ -872,13 +934,17 @@ def get_assignments():
                     'longitude': row[5], # row[5] now correctly fetches from da.logitude #
                     'status': row[6] #
                 })
+    except CursorExpired:
+        return jsonify(expired_cursor_body()), 410
     except psycopg2.Error as e:
         print(f"Error fetching assignments: {e}")
         return jsonify({"error": f"Error fetching assignments from database: {e}"}), 500
     finally:
         if conn:
             conn.close()
-    return jsonify(assignments_list)
+    if since is not None:
+        return jsonify(delta_payload(changed_keys, assignments_list, 'id', cursor))
+    return with_cursor_header(jsonify(assignments_list), cursor)
 
 # API Endpoint to assign a drone
 @app.route('/api/assign', methods=['POST'])
@@ -1033,6 +1099,60 @@ def api_delete_assignment(assignment_id):
         if conn:
             conn.close()
 
+# Which DDTs can a drone serve from a warehouse with a given package (range_matrix.py)
+@app.route('/api/reachable_ddts', methods=['GET'])
+def get_reachable_ddts():
+    drone_id = request.args.get('drone_id')
+    package_id = request.args.get('package_id')
+    warehouse_name = request.args.get('warehouse')
+    if not drone_id:
+        return jsonify({'error': 'drone_id is required'}), 400
+    try:
+        payload_kg = float(request.args.get('payload_kg', 0))
+        battery_fraction = float(request.args.get('battery', 100)) / 100
+    except ValueError:
+        return jsonify({'error': 'payload_kg and battery must be numbers'}), 400
+
+    if package_id:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Could not connect to the database."}), 500
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT warehouse_name, weight_kg FROM packagemanagement WHERE package_id = %s", (package_id,))
+                package = cur.fetchone()
+        except psycopg2.Error as e:
+            app.logger.error(f"Error fetching package {package_id} for range query: {e}")
+            return jsonify({'error': str(e)}), 500
+        finally:
+            conn.close()
+        if not package:
+            return jsonify({'error': f'Package {package_id} not found'}), 404
+        warehouse_name = warehouse_name or package[0]
+        payload_kg = parse_weight(package[1]) or 0.0
+
+    if not warehouse_name:
+        return jsonify({'error': 'warehouse or package_id is required'}), 400
+    try:
+        towers = range_matrix.reachable_towers(drone_id, warehouse_name, payload_kg, battery_fraction)
+        model = range_matrix.model_for(drone_id)
+    except (RuntimeError, psycopg2.Error) as e:
+        # RuntimeError: the matrix could not connect to load itself
+        app.logger.error(f"Range query failed: {e}")
+        return jsonify({'error': str(e)}), 500
+    if towers is None:
+        return jsonify({'error': 'Unknown warehouse, or the drone has no weight, max_payload or readable battery_capacity'}), 404
+    return jsonify({'drone_id': drone_id, 'warehouse': warehouse_name, 'payload_kg': payload_kg,
+                    'model': model.as_dict() if model else None, 'ddts': towers}), 200
+
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.on('*', range_matrix.on_change)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     app.logger.info("Starting Flask application on http://0.0.0.0:5000")
     app.run(debug=True, host='0.0.0.0', port=5000)
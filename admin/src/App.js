@@ -13,6 +13,7 @@ import Delivery from './components/DeliveryPage';
 import Monitor from './components/Monitor';
 import Packages from './components/PackageManagement';
 import DdtInfo from './components/DdtInfo';
+import { clearTokens } from './utils/authFetch';
 
 // Create Auth Context
 const AuthContext = createContext();
@@ -39,6 +40,7 @@ const AuthProvider = ({ children }) => {
   const logout = () => {
     setIsAuthenticated(false);
     localStorage.removeItem('isAuthenticated');
+    clearTokens();
   };
 
   return (
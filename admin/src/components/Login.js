@@ -30,6 +30,8 @@ const Login = () => {
       const data = await response.json()
 
       if (response.ok) {
+        sessionStorage.setItem("access_token", data.access_token) // Sent as "Authorization: Bearer <token>"
+        sessionStorage.setItem("refresh_token", data.refresh_token)
         // Call the login function from context to update auth state
         login()
         navigate("/admin-dashboard")
@@ -3,6 +3,10 @@ import ReactDOM from 'react-dom/client';
 import './index.css';
 import App from './App';
 import reportWebVitals from './reportWebVitals';
+import { installAuthFetch } from './utils/authFetch';
+
+// Every request to our services carries the access token issued at login
+installAuthFetch();
 
 const root = ReactDOM.createRoot(document.getElementById('root'));
 root.render(
@@ -2,12 +2,17 @@ import psycopg2
 import psycopg2.extras
 import os
 import logging
-import hashlib
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import AuthError, issue_tokens, protect_app, refresh_tokens
+from credential_verifier import CredentialVerifier, VerifierBusy
+from password_hashing import PasswordHasher
 
 app = Flask(__name__)
 CORS(app)
+# Managing admins requires an admin access token
+protect_app(app, roles=('admin',), exempt={'login', 'refresh', 'health_check'})
 
 # Database connection details
 DB_HOST = "localhost"
@@ -23,7 +28,7 @@ logger = logging.getLogger(__name__)
 def get_db_connection():
     """Get database connection"""
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -66,9 +71,32 @@ def create_admins_table():
         cursor.close()
         conn.close()
 
+# At import, so the table also exists when the service is mounted by gateway.py
+create_admins_table()
+
+# Algorithm and cost come from PASSWORD_HASH_ALGORITHM / PASSWORD_HASH_PARAMS; each row stores its own
+password_hasher = PasswordHasher()
+# At most 2 password checks run at once (8 more may wait); the request thread waits for its result
+credential_verifier = CredentialVerifier(max_workers=2, max_queue=8, check=password_hasher.verify)
+
 def hash_password(password):
-    """Hash password using SHA256"""
-    return hashlib.sha256(password.encode()).hexdigest()
+    """Hash password with the configured algorithm and cost"""
+    return password_hasher.hash(password)
+
+def rehash_password_if_needed(conn, admin, password):
+    """Store a just-verified password again when its row uses a legacy algorithm or an old cost"""
+    if not password_hasher.needs_rehash(admin['password']):
+        return
+    try:
+        with conn.cursor() as cursor:
+            # Guarded on the old hash so a concurrent password change is not overwritten
+            cursor.execute("UPDATE admins_data SET password = %s WHERE id = %s AND password = %s",
+                           (hash_password(password), admin['id'], admin['password']))
+        conn.commit()
+        logger.info(f"Rehashed password for admin '{admin['username']}' with {password_hasher.algorithm}")
+    except psycopg2.Error as e:
+        conn.rollback()
+        logger.error(f"Failed to rehash password for admin '{admin['username']}': {e}")
 
 @app.route('/api/admins', methods=['POST'])
 def add_admin():
@@ -330,7 +358,8 @@ def login():
             return jsonify({
                 'message': 'Login successful',
                 'username': username,
-                'role': 'admin'
+                'role': 'admin',
+                **issue_tokens(username, 'admin')
             }), 200
 
         conn = get_db_connection()
@@ -345,13 +374,15 @@ def login():
         admin = cursor.fetchone()
 
         if admin:
-            # Hash the provided password and compare with the stored hashed password
-            if hash_password(password) == admin['password']:
+            # Verify against the stored hash, whatever algorithm produced it
+            if credential_verifier.verify(password, admin['password']):
                 logger.info(f"Admin '{username}' logged in successfully from database.")
+                rehash_password_if_needed(conn, admin, password)
                 return jsonify({
                     'message': 'Login successful',
                     'username': admin['username'],
-                    'role': 'admin'
+                    'role': 'admin',
+                    **issue_tokens(admin['username'], 'admin', admin_id=admin['id'])
                 }), 200
             else:
                 logger.warning(f"Invalid password attempt for username: {username}")
@@ -360,6 +391,12 @@ def login():
             logger.warning(f"Login attempt with non-existent username: {username}")
             return jsonify({'error': 'Invalid username or password'}), 401
 
+    except VerifierBusy as e:
+        logger.warning(f"Login verifier overloaded: {e}")
+        response = jsonify({'error': 'Login service is busy. Please try again shortly.'})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
     except Exception as e:
         logger.error(f"Login error: {e}")
         return jsonify({'error': 'An unexpected error occurred during login'}), 500
@@ -369,13 +406,19 @@ def login():
         if 'conn' in locals():
             conn.close()
 
+@app.route('/api/refresh', methods=['POST'])
+def refresh():
+    """Exchange a refresh token for a new token pair"""
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(refresh_tokens(data.get('refresh_token'))), 200
+    except AuthError as e:
+        return jsonify({'error': str(e)}), 401
+
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
     return jsonify({'status': 'healthy', 'message': 'Admin API is running'}), 200
 
 if __name__ == '__main__':
-    # Create the admins table on startup
-    create_admins_table()
-
     app.run(debug=True, host='0.0.0.0', port=5072)
\ No newline at end of file
@@ -3,9 +3,18 @@ import psycopg2
 from flask import Flask, request, jsonify # Added jsonify
 import datetime
 from flask_cors import CORS # Added CORS
+import db
+import dispatch
+import route_planner
+from auth_tokens import protect_app
+from change_bus import ChangeBus
+from range_matrix import RangeMatrix
+from change_log import parse_cursor, current_cursor, changed_keys_since, delta_payload, with_cursor_header, CursorExpired, expired_cursor_body
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes, allowing requests from your React app
+# Admin dashboard API: requires an admin access token
+protect_app(app, roles=('admin',))
 
 DB_HOST = "localhost"
 DB_NAME = "shadowfly"
@@ -16,7 +25,7 @@ DB_PORT = 5432
 def get_db_connection():
     """Establishes a connection to the PostgreSQL database."""
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -28,6 +37,18 @@ def get_db_connection():
         print(f"Error connecting to PostgreSQL database: {e}")
         return None
 
+# Warehouse x DDT range matrix, shared with admin.py when both are mounted (gateway.py)
+range_matrix = RangeMatrix.shared(get_db_connection)
+
+def init_routes():
+    """Creates drone_routes, written when a dispatch plan is applied."""
+    conn = get_db_connection()
+    if conn:
+        route_planner.install_routes(conn)
+        conn.close()
+
+init_routes()
+
 # API Endpoint to get drones
 @app.route('/api/drones', methods=['GET'])
 def get_drones():
@@ -79,6 +100,11 @@ def get_warehouses():
 # API Endpoint to get assignments
 @app.route('/api/assignments', methods=['GET'])
 def get_assignments():
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "Invalid 'since' cursor"}), 400
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Could not connect to the database."}), 500
@@ -86,13 +112,20 @@ def get_assignments():
     assignments_list = []
     try:
         with conn.cursor() as cur:
+            if since is None:
+                cursor = current_cursor(cur)
+                key_filter, key_params = "", None
+            else:
+                changed_keys, cursor = changed_keys_since(cur, 'droneassignment', since)
+                key_filter, key_params = "WHERE da.id = ANY(%s::int[])", (changed_keys,)
             # Changed da.longitude to da.logitude in the SQL query
-            cur.execute("""
+            cur.execute(f"""
                 SELECT da.id, da.drone_id, da.drone_name, da.name as warehouse_name,
                        da.latitude, da.longitude, da.status
                 FROM droneassignment da
+                {key_filter}
                 ORDER BY da.drone_id ASC
-            """) #
+            """, key_params) #
             assignments_data = cur.fetchall()
             for row in assignments_data:
                 assignments_list.append({
@@ -104,13 +137,17 @@ def get_assignments():
                     'longitude': row[5], # row[5] now correctly fetches from da.logitude #
                     'status': row[6] #
                 })
+    except CursorExpired:
+        return jsonify(expired_cursor_body()), 410
     except psycopg2.Error as e:
         print(f"Error fetching assignments: {e}")
         return jsonify({"error": f"Error fetching assignments from database: {e}"}), 500
     finally:
         if conn:
             conn.close()
-    return jsonify(assignments_list)
+    if since is not None:
+        return jsonify(delta_payload(changed_keys, assignments_list, 'id', cursor))
+    return with_cursor_header(jsonify(assignments_list), cursor)
 
 # API Endpoint to assign a drone
 @app.route('/api/assign', methods=['POST'])
@@ -265,5 +302,50 @@ def api_delete_assignment(assignment_id):
         if conn:
             conn.close()
 
+# API Endpoint to plan (and optionally apply) automatic dispatch of pending packages
+@app.route('/api/dispatch/plan', methods=['POST'])
+def api_dispatch_plan():
+    data = request.get_json(silent=True) or {}
+    apply_plan = bool(data.get('apply'))
+    battery = data.get('battery') or {} # optional {drone_id: battery percent} from live telemetry
+    if not isinstance(battery, dict):
+        return jsonify({"message": "Error: 'battery' must map drone IDs to battery percentages.", "category": "warning"}), 400
+    try:
+        min_battery = float(data.get('min_battery', dispatch.DISPATCH_MIN_BATTERY))
+    except (TypeError, ValueError):
+        return jsonify({"message": "Error: 'min_battery' must be a number.", "category": "warning"}), 400
+
+    conn = get_db_connection()
+    if not conn:
+        return jsonify({"message": "Error: Could not connect to the database for dispatch.", "category": "error"}), 500
+
+    try:
+        plan = dispatch.plan(dispatch.load_round(conn, battery, min_battery), range_matrix)
+        summary = plan['summary']
+        if apply_plan:
+            dispatch.apply_plan(conn, plan['assignments'], plan['routes'])
+            message = f"Dispatched {summary['assigned']} package(s) to {summary['drones_used']} drone(s)."
+        else:
+            conn.rollback() # read-only round; release the snapshot
+            message = f"Plan assigns {summary['assigned']} of {summary['packages']} package(s) to {summary['drones_used']} drone(s)."
+        return jsonify({"message": message, "category": "success", "applied": apply_plan, **plan}), 200
+    except dispatch.DispatchConflict as e:
+        return jsonify({"message": f"Dispatch conflict, plan again: {e}", "category": "warning"}), 409
+    except psycopg2.Error as e:
+        print(f"Error planning dispatch: {e}")
+        if conn: conn.rollback()
+        return jsonify({"message": f"Database error planning dispatch: {e}", "category": "error"}), 500
+    finally:
+        if conn:
+            conn.close()
+
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+change_bus.on('*', range_matrix.on_change)
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5008, debug=True) #
\ No newline at end of file
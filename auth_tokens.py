@@ -0,0 +1,171 @@
+"""
+Signed access and refresh tokens shared by every service.
+
+Tokens are JWTs. When AUTH_PRIVATE_KEY_FILE is set, the issuing services (users.py,
+admins.py) sign with RS256 and every other service verifies with AUTH_PUBLIC_KEY_FILE
+alone. Without key files, AUTH_SECRET signs and verifies with HS256 (single host setups).
+With neither configured, each process generates a random secret at startup: tokens
+then only verify in the process that issued them (e.g. everything behind gateway.py).
+Keys are loaded once per process, so checking a request needs no database or network call.
+
+AUTH_ENFORCE=1 rejects requests without a valid access token. Until then, protected
+routes still run for anonymous callers (g.auth is None) so frontends can migrate.
+"""
+import functools
+import logging
+import os
+import secrets
+import time
+
+import jwt
+from cryptography.hazmat.primitives import serialization
+from flask import g, jsonify, request
+
+logger = logging.getLogger(__name__)
+
+AUTH_ISSUER = "shadowfly"
+AUTH_PRIVATE_KEY_FILE = os.environ.get('AUTH_PRIVATE_KEY_FILE')
+AUTH_PUBLIC_KEY_FILE = os.environ.get('AUTH_PUBLIC_KEY_FILE')
+AUTH_SECRET = os.environ.get('AUTH_SECRET')
+AUTH_ENFORCE = os.environ.get('AUTH_ENFORCE', '0') == '1'
+ACCESS_TOKEN_TTL = int(os.environ.get('AUTH_ACCESS_TTL', 15 * 60))
+REFRESH_TOKEN_TTL = int(os.environ.get('AUTH_REFRESH_TTL', 7 * 24 * 3600))
+
+# Leeway for clock drift between the issuing and verifying hosts
+CLOCK_SKEW_SECONDS = 30
+
+if not AUTH_SECRET and not (AUTH_PRIVATE_KEY_FILE or AUTH_PUBLIC_KEY_FILE):
+    AUTH_SECRET = secrets.token_urlsafe(32)
+    logger.warning("No AUTH_SECRET or AUTH_*_KEY_FILE configured; using a random per-process secret. "
+                   "Tokens will not verify across processes or restarts.")
+
+
+class AuthError(Exception):
+    """Raised when a token is missing, malformed, expired or of the wrong type."""
+
+
+def _algorithm():
+    return 'RS256' if AUTH_PRIVATE_KEY_FILE or AUTH_PUBLIC_KEY_FILE else 'HS256'
+
+
+@functools.lru_cache(maxsize=1)
+def _signing_key():
+    if not AUTH_PRIVATE_KEY_FILE:
+        return AUTH_SECRET
+    with open(AUTH_PRIVATE_KEY_FILE, 'rb') as f:
+        return serialization.load_pem_private_key(f.read(), password=None)
+
+
+@functools.lru_cache(maxsize=1)
+def _verification_key():
+    if AUTH_PUBLIC_KEY_FILE:
+        with open(AUTH_PUBLIC_KEY_FILE, 'rb') as f:
+            return serialization.load_pem_public_key(f.read())
+    if AUTH_PRIVATE_KEY_FILE:
+        return _signing_key().public_key()
+    return AUTH_SECRET
+
+
+def _encode(subject, role, token_type, ttl, claims):
+    now = int(time.time())
+    payload = dict(claims)
+    payload.update({
+        'iss': AUTH_ISSUER,
+        'sub': str(subject),
+        'role': role,
+        'typ': token_type,
+        'iat': now,
+        'exp': now + ttl,
+        'jti': secrets.token_urlsafe(12),
+    })
+    return jwt.encode(payload, _signing_key(), algorithm=_algorithm())
+
+
+def issue_tokens(subject, role, **claims):
+    """Returns a short-lived access token and a refresh token for subject (username)."""
+    return {
+        'access_token': _encode(subject, role, 'access', ACCESS_TOKEN_TTL, claims),
+        'refresh_token': _encode(subject, role, 'refresh', REFRESH_TOKEN_TTL, claims),
+        'token_type': 'Bearer',
+        'expires_in': ACCESS_TOKEN_TTL,
+    }
+
+
+def verify_token(token, token_type='access'):
+    """Checks signature, issuer, expiry and type locally. Returns the claims or raises AuthError."""
+    if not token:
+        raise AuthError("Missing token")
+    try:
+        claims = jwt.decode(
+            token,
+            _verification_key(),
+            algorithms=[_algorithm()],
+            issuer=AUTH_ISSUER,
+            leeway=CLOCK_SKEW_SECONDS,
+            options={'require': ['exp', 'iat', 'sub', 'typ']},
+        )
+    except jwt.ExpiredSignatureError:
+        raise AuthError("Token has expired")
+    except jwt.InvalidTokenError as e:
+        raise AuthError(f"Invalid token: {e}")
+    if claims['typ'] != token_type:
+        raise AuthError(f"Expected a {token_type} token")
+    return claims
+
+
+def refresh_tokens(refresh_token):
+    """Exchanges a valid refresh token for a new token pair, carrying over its custom claims."""
+    claims = verify_token(refresh_token, 'refresh')
+    extra = {k: v for k, v in claims.items() if k not in ('iss', 'sub', 'role', 'typ', 'iat', 'exp', 'jti')}
+    return issue_tokens(claims['sub'], claims['role'], **extra)
+
+
+def bearer_token():
+    """Token from the Authorization header, or ?access_token= for EventSource streams that cannot set headers."""
+    header = request.headers.get('Authorization', '')
+    if header.startswith('Bearer '):
+        return header[7:].strip()
+    return request.args.get('access_token')
+
+
+def _authenticate(roles):
+    """Sets g.auth and returns None when the request may proceed, otherwise an error response."""
+    g.auth = None
+    token = bearer_token()
+    if not token and not AUTH_ENFORCE:
+        return None
+    try:
+        claims = verify_token(token)
+    except AuthError as e:
+        if not AUTH_ENFORCE:
+            logger.warning(f"Ignoring invalid token on {request.path}: {e}")
+            return None
+        return jsonify({'error': str(e)}), 401
+    if roles and claims.get('role') not in roles:
+        return jsonify({'error': 'Insufficient permissions'}), 403
+    g.auth = claims
+    return None
+
+
+def require_auth(*roles):
+    """Route decorator: requires an access token, optionally with one of roles."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            denied = _authenticate(roles)
+            if denied:
+                return denied
+            return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def protect_app(app, roles=(), exempt=()):
+    """Checks the access token before every request of app, except CORS preflights and exempt endpoints."""
+    exempt = set(exempt) | {'static'}
+
+    @app.before_request
+    def _check_token():
+        if request.method == 'OPTIONS' or request.endpoint in exempt:
+            return None
+        return _authenticate(roles)
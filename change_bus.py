@@ -0,0 +1,199 @@
+import json
+import logging
+import queue
+import select
+import threading
+import time
+from collections import defaultdict
+from flask import Response, request, stream_with_context
+from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
+from change_log import CHANGE_CHANNEL, prune_change_log
+
+logger = logging.getLogger(__name__)
+
+# How often the listener prunes change_log entries past CHANGE_LOG_RETENTION_DAYS
+PRUNE_INTERVAL_SECONDS = 3600
+
+# Sent to handlers and clients when notifications may have been missed
+# (listener reconnect or a client that fell behind); caches should be
+# dropped and dashboards should catch up with ?since=<cursor>.
+RESYNC_EVENT = {'table': '*', 'op': 'RESYNC'}
+
+
+class ChangeBus:
+    """Subscribes to the Postgres change channel and fans events out to local cache
+    handlers and Server-Sent Events clients."""
+
+    def __init__(self, connect, channel=CHANGE_CHANNEL, client_queue_size=256, poll_timeout=5.0, reconnect_delay=2.0):
+        self._connect = connect
+        self._channel = channel
+        self._client_queue_size = client_queue_size
+        self._poll_timeout = poll_timeout
+        self._reconnect_delay = reconnect_delay
+        self._handlers = defaultdict(list)
+        self._clients = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._thread = None
+
+    _shared = {}
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, connect, channel=CHANGE_CHANNEL):
+        """The process-wide bus for channel. Services mounted in one process (gateway.py)
+        share its handlers, clients and single listener connection."""
+        with cls._shared_lock:
+            bus = cls._shared.get(channel)
+            if bus is None:
+                bus = cls._shared[channel] = cls(connect, channel)
+            return bus
+
+    def on(self, table, handler):
+        """Registers handler(event) for changes to table ('*' for every table); a repeat registration is a no-op."""
+        with self._lock:
+            if handler not in self._handlers[table]:
+                self._handlers[table].append(handler)
+        return handler
+
+    def start(self):
+        """Starts the listener thread once per process."""
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._listen, name="change-bus", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def publish(self, event):
+        """Delivers an event to the local handlers and every subscribed client."""
+        table = event.get('table')
+        with self._lock:
+            handlers = list(self._handlers.get(table, [])) + list(self._handlers.get('*', []))
+            clients = list(self._clients)
+        for handler in handlers:
+            try:
+                handler(event)
+            except Exception as e:
+                logger.error(f"Change handler failed for {event}: {e}")
+        for client in clients:
+            client.offer(event)
+
+    def subscribe(self, tables=None):
+        client = _Client(tables, self._client_queue_size)
+        with self._lock:
+            self._clients.add(client)
+        return client
+
+    def unsubscribe(self, client):
+        with self._lock:
+            self._clients.discard(client)
+
+    def stream(self, tables=None, heartbeat=15.0):
+        """Yields Server-Sent Events for changes to tables until the client disconnects."""
+        client = self.subscribe(tables)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = client.events.get(timeout=heartbeat)
+                except queue.Empty:
+                    yield ": keep-alive\n\n"
+                    continue
+                if event is RESYNC_EVENT:
+                    yield f"event: resync\ndata: {json.dumps(event)}\n\n"
+                    continue
+                event_id = event.get('id')
+                prefix = f"id: {event_id}\n" if event_id is not None else ""
+                yield f"{prefix}event: change\ndata: {json.dumps(event)}\n\n"
+        finally:
+            self.unsubscribe(client)
+
+    def sse_response(self, tables=None):
+        """Flask response streaming this bus as text/event-stream."""
+        return Response(
+            stream_with_context(self.stream(tables)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+    def register_sse(self, app, rule='/api/events'):
+        """Adds the stream_events route to app: this bus as Server-Sent Events, optionally filtered with ?tables=a,b"""
+        def stream_events():
+            return self.sse_response(tables_from_request(request.args))
+        app.add_url_rule(rule, 'stream_events', stream_events, methods=['GET'])
+
+    def _listen(self):
+        first_connect = True
+        while not self._stop_event.is_set():
+            conn = None
+            try:
+                conn = self._connect()
+                if conn is None:
+                    raise ConnectionError("no database connection")
+                conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+                with conn.cursor() as cur:
+                    cur.execute(f"LISTEN {self._channel};")
+                logger.info(f"Listening for changes on channel '{self._channel}'")
+                if not first_connect:
+                    self.publish(RESYNC_EVENT)
+                first_connect = False
+
+                pruned_at = 0.0
+                while not self._stop_event.is_set():
+                    if time.monotonic() - pruned_at > PRUNE_INTERVAL_SECONDS:
+                        pruned_at = time.monotonic()
+                        prune_change_log(conn)
+                    if select.select([conn], [], [], self._poll_timeout) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        try:
+                            event = json.loads(notify.payload)
+                        except ValueError:
+                            logger.warning(f"Ignoring malformed change notification: {notify.payload}")
+                            continue
+                        self.publish(event)
+            except Exception as e:
+                logger.error(f"Change bus listener error: {e}. Reconnecting in {self._reconnect_delay}s")
+                first_connect = False
+                self._stop_event.wait(self._reconnect_delay)
+            finally:
+                if conn is not None:
+                    try:
+                        conn.close()
+                    except Exception:
+                        pass
+
+
+class _Client:
+    """Bounded per-client event queue. A client that falls behind loses its backlog
+    and receives a single resync event instead of growing without limit."""
+
+    def __init__(self, tables, maxsize):
+        self.tables = set(tables) if tables else None
+        self.events = queue.Queue(maxsize=maxsize)
+
+    def offer(self, event):
+        if self.tables is not None and event is not RESYNC_EVENT and event.get('table') not in self.tables:
+            return
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            while True:
+                try:
+                    self.events.get_nowait()
+                except queue.Empty:
+                    break
+            self.events.put_nowait(RESYNC_EVENT)
+
+
+def tables_from_request(args):
+    """Parses ?tables=a,b from an SSE request; None means all tables."""
+    value = args.get('tables', '')
+    tables = [t.strip() for t in value.split(',') if t.strip()]
+    return tables or None
@@ -0,0 +1,213 @@
+import logging
+import os
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Tables recorded in change_log and announced on the change bus, mapped to
+# the column that identifies a row for the dashboards.
+TRACKED_TABLES = {
+    'packagemanagement': 'package_id',
+    'dronesdata': 'id',
+    'ddts': 'id',
+    'warehouses': 'id',
+    'droneassignment': 'id',
+    'customers': 'customer_id',
+}
+
+# LISTEN/NOTIFY channel every change is announced on (see change_bus.py).
+CHANGE_CHANNEL = 'shadowfly_changes'
+
+SYNC_CURSOR_HEADER = 'X-Sync-Cursor'
+
+# Entries older than this are pruned; clients holding an older cursor must re-list
+CHANGE_LOG_RETENTION_DAYS = float(os.environ.get('CHANGE_LOG_RETENTION_DAYS', 7))
+
+# Sync cursors are transaction ids, not change ids: a BIGSERIAL id is taken when the
+# row is written, so a transaction holding a lower id can commit after a client has
+# already read past a higher one. Each entry records its writer's txid instead, and a
+# cursor is the oldest transaction still in flight when it was read (snapshot xmin).
+# Every change a cursor has not seen was written by a transaction at or after it.
+# change_log_horizon remembers the txid below which entries have been pruned.
+CHANGE_LOG_DDL = """
+    CREATE TABLE IF NOT EXISTS change_log (
+        id BIGSERIAL PRIMARY KEY,
+        table_name VARCHAR(64) NOT NULL,
+        row_key VARCHAR(255) NOT NULL,
+        operation CHAR(1) NOT NULL,
+        txid BIGINT NOT NULL DEFAULT txid_current(),
+        changed_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    ALTER TABLE change_log ADD COLUMN IF NOT EXISTS txid BIGINT NOT NULL DEFAULT txid_current();
+    CREATE INDEX IF NOT EXISTS idx_change_log_table_id ON change_log (table_name, id);
+    CREATE INDEX IF NOT EXISTS idx_change_log_table_txid ON change_log (table_name, txid);
+    CREATE INDEX IF NOT EXISTS idx_change_log_changed_at ON change_log (changed_at);
+    CREATE TABLE IF NOT EXISTS change_log_horizon (
+        id BOOLEAN PRIMARY KEY DEFAULT TRUE CHECK (id),
+        pruned_below BIGINT NOT NULL DEFAULT 0
+    );
+"""
+
+PRUNE_CHANGE_LOG = """
+    WITH pruned AS (
+        DELETE FROM change_log WHERE changed_at < CURRENT_TIMESTAMP - make_interval(secs => %s)
+        RETURNING txid
+    )
+    INSERT INTO change_log_horizon (id, pruned_below)
+    SELECT TRUE, MAX(txid) + 1 FROM pruned HAVING COUNT(*) > 0
+    ON CONFLICT (id) DO UPDATE SET pruned_below = GREATEST(change_log_horizon.pruned_below, EXCLUDED.pruned_below)
+"""
+
+
+class CursorExpired(Exception):
+    """The ?since= cursor is older than the retained change log; the client must fetch the full list."""
+
+# One row per touched key. A key change on UPDATE is recorded as a delete of
+# the old key followed by an update of the new one. Every entry is also
+# announced on CHANGE_CHANNEL; NOTIFY is delivered only when the writing
+# transaction commits.
+CHANGE_LOG_FUNCTION = f"""
+    CREATE OR REPLACE FUNCTION log_row_change() RETURNS trigger AS $$
+    DECLARE
+        key_column TEXT := TG_ARGV[0];
+        old_key TEXT;
+        new_key TEXT;
+        change_id BIGINT;
+    BEGIN
+        IF TG_OP IN ('UPDATE', 'DELETE') THEN
+            old_key := to_jsonb(OLD) ->> key_column;
+        END IF;
+        IF TG_OP IN ('INSERT', 'UPDATE') THEN
+            new_key := to_jsonb(NEW) ->> key_column;
+        END IF;
+        IF old_key IS NOT NULL AND old_key IS DISTINCT FROM new_key THEN
+            INSERT INTO change_log (table_name, row_key, operation)
+            VALUES (TG_TABLE_NAME, old_key, 'D')
+            RETURNING id INTO change_id;
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'id', change_id, 'table', TG_TABLE_NAME, 'op', 'D', 'key', old_key)::text);
+        END IF;
+        IF new_key IS NOT NULL THEN
+            INSERT INTO change_log (table_name, row_key, operation)
+            VALUES (TG_TABLE_NAME, new_key, LEFT(TG_OP, 1))
+            RETURNING id INTO change_id;
+            PERFORM pg_notify('{CHANGE_CHANNEL}', json_build_object(
+                'id', change_id, 'table', TG_TABLE_NAME, 'op', LEFT(TG_OP, 1), 'key', new_key)::text);
+        END IF;
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+
+def _first_value(row):
+    """Returns the first column of a row from any psycopg2 cursor factory."""
+    if row is None:
+        return None
+    if isinstance(row, dict):
+        return next(iter(row.values()))
+    return row[0]
+
+
+def install_change_log(conn, tables=None):
+    """Ensures the change_log table and its row triggers exist. Safe to call on every startup."""
+    tables = tables or TRACKED_TABLES
+    try:
+        with conn.cursor() as cur:
+            cur.execute(CHANGE_LOG_DDL)
+            cur.execute(CHANGE_LOG_FUNCTION)
+            for table_name, key_column in tables.items():
+                cur.execute("SELECT to_regclass(%s)", (table_name,))
+                if _first_value(cur.fetchone()) is None:
+                    logger.info(f"Table '{table_name}' does not exist yet, change log trigger skipped.")
+                    continue
+                trigger_name = f"trg_{table_name}_change_log"
+                cur.execute("SELECT 1 FROM pg_trigger WHERE tgname = %s AND NOT tgisinternal", (trigger_name,))
+                if cur.fetchone():
+                    continue
+                cur.execute(f"""
+                    CREATE TRIGGER {trigger_name}
+                    AFTER INSERT OR UPDATE OR DELETE ON {table_name}
+                    FOR EACH ROW EXECUTE PROCEDURE log_row_change('{key_column}')
+                """)
+                logger.info(f"Change log trigger created on '{table_name}'.")
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"Error installing change log: {e}")
+        conn.rollback()
+        return False
+
+
+def parse_cursor(value):
+    """Parses a ?since= value. Returns None when absent and raises ValueError when malformed."""
+    if value is None or value == '':
+        return None
+    cursor = int(value)
+    if cursor < 0:
+        raise ValueError("Cursor must not be negative")
+    return cursor
+
+
+def current_cursor(cur):
+    """
+    Returns the oldest in-flight transaction id. Read it before a full listing: every
+    change the listing cannot see was written by a transaction at or after it.
+    """
+    cur.execute("SELECT txid_snapshot_xmin(txid_current_snapshot()) AS head")
+    return int(_first_value(cur.fetchone()))
+
+
+def changed_keys_since(cur, table_name, cursor):
+    """
+    Returns (keys, new_cursor) for rows of table_name written by transactions at or after
+    cursor. Changes of transactions that were still open may be sent again on the next
+    call, never skipped. Raises CursorExpired when entries the cursor needs were pruned.
+    """
+    head = current_cursor(cur)
+    cur.execute("SELECT pruned_below FROM change_log_horizon")
+    horizon = _first_value(cur.fetchone()) or 0
+    if cursor < horizon:
+        raise CursorExpired(f"Cursor {cursor} is older than the retained change log")
+    cur.execute("""
+        SELECT DISTINCT row_key FROM change_log
+        WHERE table_name = %s AND txid >= %s
+    """, (table_name, cursor))
+    return [_first_value(row) for row in cur.fetchall()], head
+
+
+def prune_change_log(conn, retention_days=CHANGE_LOG_RETENTION_DAYS):
+    """Deletes entries older than retention_days and advances the pruning horizon. Returns True when any were deleted."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(PRUNE_CHANGE_LOG, (retention_days * 86400,))
+            pruned = cur.rowcount > 0
+        conn.commit()
+        return pruned
+    except psycopg2.Error as e:
+        logger.error(f"Error pruning change log: {e}")
+        conn.rollback()
+        return False
+
+
+def expired_cursor_body():
+    """Response body (status 410) for a CursorExpired ?since= request."""
+    return {'error': "Cursor expired; fetch the full list without 'since'", 'resync': True}
+
+
+def delta_payload(changed_keys, rows, key_field, cursor):
+    """Builds the ?since= response body. Changed keys that no longer match the listing are reported as deleted."""
+    present = {str(row[key_field]) for row in rows}
+    deleted = [key for key in changed_keys if key not in present]
+    return {
+        'cursor': cursor,
+        'upserted': rows,
+        'deleted': deleted,
+    }
+
+
+def with_cursor_header(response, cursor):
+    """Attaches the sync cursor to a full-list response without changing its body."""
+    response.headers[SYNC_CURSOR_HEADER] = str(cursor)
+    response.headers['Access-Control-Expose-Headers'] = SYNC_CURSOR_HEADER
+    return response
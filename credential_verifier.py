@@ -0,0 +1,84 @@
+import hashlib
+import hmac
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+import bcrypt
+
+logger = logging.getLogger(__name__)
+
+
+def _bcrypt_check(password, stored_hash):
+    return bcrypt.checkpw(password.encode('utf-8'), stored_hash.encode('utf-8'))
+
+
+class VerifierBusy(Exception):
+    """Raised when the verifier queue is full or a check did not finish in time."""
+
+
+class CredentialVerifier:
+    """
+    Bounds how many password checks (bcrypt by default) run at once: they run on a
+    small pool while the request thread waits for the result, up to timeout. When the
+    pool and its queue are full, verify() fails fast with VerifierBusy instead of
+    queueing without limit, so a login burst cannot saturate the CPU with bcrypt.
+
+    Successful checks are remembered for cache_ttl seconds, keyed by an HMAC of the
+    password under a per-process random key plus the stored hash, so no plaintext is
+    kept and a password change invalidates the entry.
+    """
+
+    def __init__(self, max_workers=2, max_queue=8, timeout=5.0, cache_ttl=300, cache_size=1024, check=None):
+        self._check = check or _bcrypt_check
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="password-check")
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue)
+        self._timeout = timeout
+        self._cache_ttl = cache_ttl
+        self._cache_size = cache_size
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_key = os.urandom(32)
+
+    def verify(self, password, stored_hash):
+        """True if password matches stored_hash. Raises VerifierBusy when overloaded."""
+        fingerprint = hmac.new(self._cache_key, password.encode('utf-8') + b'\0' + stored_hash.encode('utf-8'),
+                               hashlib.sha256).digest()
+        if self._cached(fingerprint):
+            return True
+
+        if not self._slots.acquire(blocking=False):
+            raise VerifierBusy("Password verifier queue is full")
+        try:
+            future = self._executor.submit(self._check, password, stored_hash)
+        except Exception:
+            self._slots.release()
+            raise
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            matched = future.result(timeout=self._timeout)
+        except FutureTimeout:
+            raise VerifierBusy("Password verification timed out")
+
+        if matched:
+            self._remember(fingerprint)
+        return matched
+
+    def _cached(self, fingerprint):
+        with self._cache_lock:
+            expires = self._cache.get(fingerprint)
+            if expires is None:
+                return False
+            if expires < time.monotonic():
+                del self._cache[fingerprint]
+                return False
+            return True
+
+    def _remember(self, fingerprint):
+        with self._cache_lock:
+            self._cache[fingerprint] = time.monotonic() + self._cache_ttl
+            self._cache.move_to_end(fingerprint)
+            while len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
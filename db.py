@@ -0,0 +1,139 @@
+"""
+Shared database connections for services mounted in one process by gateway.py.
+
+Every service keeps its own get_db_connection() and calls db.connect() with its
+settings. Once enable_pool() has been called, connect() hands out connections from
+one ThreadedConnectionPool per set of settings, and close() on those connections
+returns them to the pool instead of closing the socket. Without enable_pool()
+(a service started on its own), connect() is plain psycopg2.connect().
+"""
+import logging
+import threading
+
+import psycopg2
+from psycopg2 import pool
+from psycopg2.extensions import TRANSACTION_STATUS_IDLE
+
+logger = logging.getLogger(__name__)
+
+_pool_size = None
+_pools = {}
+_lock = threading.Lock()
+
+
+def enable_pool(minconn=1, maxconn=20):
+    """Makes connect() pooled for the rest of the process; call before the services are imported."""
+    global _pool_size
+    _pool_size = (minconn, maxconn)
+
+
+def connect(**params):
+    if _pool_size is None:
+        return psycopg2.connect(**params)
+    return _pool_for(params).getconn()
+
+
+def pool_stats():
+    """Connections in use and idle per pool, for the gateway status report."""
+    with _lock:
+        pools = list(_pools.items())
+    return [{'database': dict(key).get('database'), 'host': dict(key).get('host'),
+             'in_use': shared.in_use, 'max': shared.maxconn} for key, shared in pools]
+
+
+def _pool_for(params):
+    key = tuple(sorted(params.items()))
+    with _lock:
+        shared = _pools.get(key)
+        if shared is None:
+            shared = _pools[key] = SharedPool(*_pool_size, **params)
+        return shared
+
+
+class SharedPool:
+    """ThreadedConnectionPool that waits for a free connection instead of raising when all are in use."""
+
+    def __init__(self, minconn, maxconn, timeout=10.0, **params):
+        self.maxconn = maxconn
+        self.in_use = 0
+        self._timeout = timeout
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._pool = pool.ThreadedConnectionPool(minconn, maxconn, **params)
+        self._count_lock = threading.Lock()
+
+    def getconn(self):
+        if not self._slots.acquire(timeout=self._timeout):
+            raise psycopg2.OperationalError(f"No database connection free within {self._timeout}s "
+                                            f"({self.maxconn} in use)")
+        try:
+            conn = self._pool.getconn()
+        except Exception:
+            self._slots.release()
+            raise
+        with self._count_lock:
+            self.in_use += 1
+        return PooledConnection(conn, self)
+
+    def putconn(self, conn):
+        try:
+            discard = bool(conn.closed)
+            if not discard:
+                # Hand the next borrower a clean connection in the default mode
+                if conn.info.transaction_status != TRANSACTION_STATUS_IDLE:
+                    conn.rollback()
+                if conn.autocommit:
+                    conn.autocommit = False
+        except psycopg2.Error as e:
+            logger.warning(f"Discarding pooled connection: {e}")
+            discard = True
+        try:
+            self._pool.putconn(conn, close=discard)
+        finally:
+            with self._count_lock:
+                self.in_use -= 1
+            self._slots.release()
+
+
+class PooledConnection:
+    """psycopg2 connection whose close() gives it back to the shared pool."""
+
+    def __init__(self, conn, owner):
+        self._conn = conn
+        self._owner = owner
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise psycopg2.InterfaceError("connection already closed")
+        return getattr(self._conn, name)
+
+    def __setattr__(self, name, value):
+        if name in ('_conn', '_owner'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._conn, name, value)
+
+    def __enter__(self):
+        self._conn.__enter__()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return self._conn.__exit__(exc_type, exc, tb)
+
+    @property
+    def closed(self):
+        return 1 if self._conn is None else self._conn.closed
+
+    def fileno(self):
+        return self._conn.fileno()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._owner.putconn(conn)
+
+    def __del__(self):
+        # A connection dropped without close() still goes back to the pool
+        try:
+            self.close()
+        except Exception:
+            pass
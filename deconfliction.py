@@ -0,0 +1,353 @@
+"""
+Airspace deconfliction for concurrent missions.
+
+Every launched mission is a 4D corridor: the straight legs warehouse -> stops ->
+warehouse, flown at ETA_CRUISE_KMH from its launch time with ETA_STOP_SECONDS of
+hovering at every stop, on one altitude layer. Two missions conflict when, on the
+same layer, they come within SEPARATION_KM of each other at the same moment.
+
+Corridors are indexed in buckets of CELL_KM x CELL_KM x SLOT_SECONDS. A new mission
+rasterizes only its own legs into buckets and tests the segments it finds there
+exactly (closest approach of two points moving in straight lines), so the check
+costs about the same against ten active missions or ten thousand.
+
+A conflicting mission gets the lowest altitude layer that is free along its whole
+corridor. When every layer is taken, its launch is delayed in DELAY_STEP_SECONDS
+steps, up to MAX_DELAY_SECONDS, after which it is refused with AirspaceCongested.
+The chosen layer is kept on dronesdata.cruise_altitude_m and delayed launches in
+scheduled_launches, so missions found at startup are booked again on their layer;
+those without a recorded layer block all of them.
+"""
+import heapq
+import math
+import os
+import threading
+import time
+
+import psycopg2
+import psycopg2.extras
+
+import route_planner
+from eta import ETA_CRUISE_KMH, ETA_STOP_SECONDS, IN_FLIGHT_STATUSES
+from geo import EARTH_RADIUS_KM
+
+CELL_KM = float(os.environ.get('DECONFLICT_CELL_KM', 0.5))
+SLOT_SECONDS = float(os.environ.get('DECONFLICT_SLOT_SECONDS', 30))
+SEPARATION_KM = float(os.environ.get('DECONFLICT_SEPARATION_KM', 0.15))
+ALTITUDE_LAYERS_M = tuple(float(m) for m in os.environ.get('DECONFLICT_LAYERS_M', '60,75,90,105').split(','))
+DELAY_STEP_SECONDS = float(os.environ.get('DECONFLICT_DELAY_STEP_SECONDS', 30))
+MAX_DELAY_SECONDS = float(os.environ.get('DECONFLICT_MAX_DELAY_SECONDS', 600))
+
+KM_PER_DEGREE = EARTH_RADIUS_KM * math.pi / 180
+
+AIRSPACE_DDL = """
+    ALTER TABLE dronesdata ADD COLUMN IF NOT EXISTS cruise_altitude_m DOUBLE PRECISION;
+    CREATE TABLE IF NOT EXISTS scheduled_launches (
+        package_id VARCHAR(225) PRIMARY KEY,
+        drone_id VARCHAR(225) NOT NULL,
+        control_key TEXT NOT NULL,
+        ddt_name VARCHAR(255) NOT NULL,
+        rack_column VARCHAR(50) NOT NULL,
+        altitude_m DOUBLE PRECISION,
+        launch_at TIMESTAMP WITH TIME ZONE NOT NULL
+    );
+"""
+
+
+class AirspaceCongested(Exception):
+    """No altitude layer is free along the mission's corridor within MAX_DELAY_SECONDS."""
+
+
+def install_airspace(conn):
+    """Adds dronesdata.cruise_altitude_m and the scheduled_launches table. Safe to call on every startup."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(AIRSPACE_DDL)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print(f"❌ Error creating airspace tables: {e}")
+        conn.rollback()
+        return False
+
+
+class Corridor:
+    """
+    One mission's legs as (t0, t1, x0, y0, x1, y1) segments in epoch seconds and km on
+    the airspace's local plane. layer is an index into ALTITUDE_LAYERS_M, or None.
+    """
+
+    def __init__(self, drone_id, segments, layer=None, package_ids=()):
+        self.drone_id = drone_id
+        self.segments = segments
+        self.layer = layer
+        self.package_ids = list(package_ids)
+        self.buckets = []               # (bucket, segment index) pairs, for removal
+
+    @property
+    def start(self):
+        return self.segments[0][0]
+
+    @property
+    def end(self):
+        return self.segments[-1][1]
+
+    def shifted(self, seconds):
+        return Corridor(self.drone_id, [(t0 + seconds, t1 + seconds, *xy) for t0, t1, *xy in self.segments],
+                        self.layer, self.package_ids)
+
+
+def closest_approach_km(a, b):
+    """Smallest distance between two segments' positions over the time they share; inf when they do not overlap."""
+    lo, hi = max(a[0], b[0]), min(a[1], b[1])
+    if lo > hi:
+        return math.inf
+    ax, ay = _position(a, lo)
+    bx, by = _position(b, lo)
+    rx, ry = ax - bx, ay - by
+    vx, vy = _velocity(a)
+    wx, wy = _velocity(b)
+    vx, vy = vx - wx, vy - wy
+    speed2 = vx * vx + vy * vy
+    tau = 0.0 if speed2 == 0 else min(max(-(rx * vx + ry * vy) / speed2, 0.0), hi - lo)
+    return math.hypot(rx + vx * tau, ry + vy * tau)
+
+
+def _velocity(segment):
+    t0, t1, x0, y0, x1, y1 = segment
+    duration = t1 - t0
+    if duration <= 0:
+        return 0.0, 0.0
+    return (x1 - x0) / duration, (y1 - y0) / duration
+
+
+def _position(segment, t):
+    vx, vy = _velocity(segment)
+    return segment[2] + vx * (t - segment[0]), segment[3] + vy * (t - segment[0])
+
+
+class Airspace:
+    """In-memory index of active corridors. Thread-safe; reserve() checks and books atomically."""
+
+    def __init__(self, speed_kmh=ETA_CRUISE_KMH, stop_seconds=ETA_STOP_SECONDS):
+        self.speed_kmh = speed_kmh
+        self.stop_seconds = stop_seconds
+        self._lock = threading.Lock()
+        self._origin = None             # (lat, cos(lat)) of the local plane, set by the first mission
+        self._missions = {}             # drone_id -> Corridor
+        self._buckets = {}              # (cell x, cell y, slot) -> {(drone_id, segment index)}
+        self._expiry = []               # heap of (end, drone_id)
+
+    def corridor(self, drone_id, points, start, layer=None, package_ids=()):
+        """Corridor through the (lat, lng) points from start, hovering at every point between the first and last."""
+        if self._origin is None:
+            self._origin = (points[0][0], math.cos(math.radians(points[0][0])))
+        xy = [self._project(lat, lng) for lat, lng in points]
+        segments, t = [], start
+        for i, ((x0, y0), (x1, y1)) in enumerate(zip(xy, xy[1:])):
+            flight = math.hypot(x1 - x0, y1 - y0) / self.speed_kmh * 3600
+            segments.append((t, t + flight, x0, y0, x1, y1))
+            t += flight
+            if i < len(xy) - 2:
+                segments.append((t, t + self.stop_seconds, x1, y1, x1, y1))
+                t += self.stop_seconds
+        return Corridor(drone_id, segments, layer, package_ids)
+
+    def reserve(self, drone_id, points, start=None, package_ids=()):
+        """
+        Finds the earliest launch and lowest free layer for a mission through points and
+        books it, replacing the drone's previous corridor. Returns the clearance as a dict.
+        When none is found, the previous corridor stays booked.
+        """
+        started = time.perf_counter()
+        start = time.time() if start is None else start
+        with self._lock:
+            self._expire(start)
+            base = self.corridor(drone_id, points, start, package_ids=package_ids)
+            delay, checked = 0.0, 0
+            while delay <= MAX_DELAY_SECONDS:
+                candidate = base.shifted(delay) if delay else base
+                blocked, tested = self._blocked_layers(candidate)
+                checked += tested
+                free = [layer for layer in range(len(ALTITUDE_LAYERS_M)) if layer not in blocked]
+                if free and None not in blocked:
+                    candidate.layer = free[0]
+                    self._remove(drone_id)
+                    self._insert(candidate)
+                    return {
+                        'drone_id': drone_id,
+                        'package_ids': candidate.package_ids,
+                        'layer': candidate.layer,
+                        'altitude_m': ALTITUDE_LAYERS_M[candidate.layer],
+                        'delay_s': delay,
+                        'launch_at': candidate.start,
+                        'clear_at': candidate.end,
+                        'segments_checked': checked,
+                        'active_missions': len(self._missions),
+                        'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+                    }
+                delay += DELAY_STEP_SECONDS
+        raise AirspaceCongested(f"No free altitude layer for drone {drone_id} within {MAX_DELAY_SECONDS:g}s")
+
+    def release(self, drone_id):
+        with self._lock:
+            self._remove(drone_id)
+
+    def release_package(self, package_id):
+        with self._lock:
+            for drone_id, mission in list(self._missions.items()):
+                if package_id in mission.package_ids:
+                    self._remove(drone_id)
+
+    def load(self, conn):
+        """
+        Books the corridors of missions already in flight, from their dispatch_time, and of
+        scheduled launches, from their launch time, on the drone's recorded layer.
+        """
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("""
+                SELECT p.package_id, p.assigned_drone_id, p.destination_lat, p.destination_lng,
+                       COALESCE(s.launch_at, p.dispatch_time) AS dispatch_time,
+                       COALESCE(s.altitude_m, d.cruise_altitude_m) AS altitude_m,
+                       w.latitude AS warehouse_lat, w.longitude AS warehouse_lng
+                FROM packagemanagement p
+                JOIN warehouses w ON w.name = p.warehouse_name
+                LEFT JOIN scheduled_launches s ON s.package_id = p.package_id
+                LEFT JOIN dronesdata d ON d.drone_id = p.assigned_drone_id
+                WHERE ((p.current_status = ANY(%s) AND p.dispatch_time IS NOT NULL) OR s.package_id IS NOT NULL)
+                  AND p.assigned_drone_id IS NOT NULL
+                  AND p.destination_lat IS NOT NULL AND w.latitude IS NOT NULL
+            """, (list(IN_FLIGHT_STATUSES),))
+            packages = cur.fetchall()
+            cur.execute("SELECT drone_id, origin_lat, origin_lng, stops FROM drone_routes WHERE status = 'Active'")
+            routes = {r['drone_id']: r for r in cur.fetchall()}
+        conn.rollback()
+
+        missions = {}
+        for p in packages:
+            drone_id = p['assigned_drone_id']
+            start = p['dispatch_time'].timestamp()
+            route = routes.get(drone_id)
+            if route:
+                points = [(route['origin_lat'], route['origin_lng']), *((s['lat'], s['lng']) for s in route['stops']),
+                          (route['origin_lat'], route['origin_lng'])]
+                package_ids = [s['package_id'] for s in route['stops']]
+            else:
+                origin = (float(p['warehouse_lat']), float(p['warehouse_lng']))
+                points = [origin, (float(p['destination_lat']), float(p['destination_lng'])), origin]
+                package_ids = [p['package_id']]
+            altitude = p['altitude_m']
+            layer = ALTITUDE_LAYERS_M.index(altitude) if altitude in ALTITUDE_LAYERS_M else None
+            if drone_id not in missions or start < missions[drone_id][1]:
+                missions[drone_id] = (points, start, package_ids, layer)
+
+        now = time.time()
+        with self._lock:
+            for drone_id, (points, start, package_ids, layer) in missions.items():
+                corridor = self.corridor(drone_id, points, start, layer, package_ids)
+                if corridor.end > now:
+                    self._remove(drone_id)
+                    self._insert(corridor)
+        return len(self._missions)
+
+    def snapshot(self):
+        with self._lock:
+            self._expire(time.time())
+            return [{
+                'drone_id': m.drone_id,
+                'package_ids': m.package_ids,
+                'layer': m.layer,
+                'altitude_m': ALTITUDE_LAYERS_M[m.layer] if m.layer is not None else None,
+                'launch_at': m.start,
+                'clear_at': m.end,
+            } for m in self._missions.values()]
+
+    def _project(self, lat, lng):
+        origin_lat, cos_lat = self._origin
+        return (float(lng) * cos_lat * KM_PER_DEGREE, (float(lat) - origin_lat) * KM_PER_DEGREE)
+
+    def _segment_buckets(self, segment, margin=0.0):
+        """Buckets a segment passes through, its footprint widened by margin km."""
+        t0, t1 = segment[0], segment[1]
+        buckets = []
+        for slot in range(int(t0 // SLOT_SECONDS), int(t1 // SLOT_SECONDS) + 1):
+            (ax, ay), (bx, by) = (_position(segment, max(t0, slot * SLOT_SECONDS)),
+                                  _position(segment, min(t1, (slot + 1) * SLOT_SECONDS)))
+            for cx in range(int((min(ax, bx) - margin) // CELL_KM), int((max(ax, bx) + margin) // CELL_KM) + 1):
+                for cy in range(int((min(ay, by) - margin) // CELL_KM), int((max(ay, by) + margin) // CELL_KM) + 1):
+                    buckets.append((cx, cy, slot))
+        return buckets
+
+    def _blocked_layers(self, candidate):
+        """Layers of the booked missions the candidate comes too close to, and the number of segments tested."""
+        blocked, seen, tested = set(), set(), 0
+        for segment in candidate.segments:
+            for bucket in self._segment_buckets(segment, SEPARATION_KM):
+                for drone_id, index in self._buckets.get(bucket, ()):
+                    # The drone's own previous corridor is replaced, not flown alongside
+                    if drone_id == candidate.drone_id or (drone_id, index) in seen:
+                        continue
+                    seen.add((drone_id, index))
+                    other = self._missions[drone_id]
+                    if other.layer in blocked:
+                        continue
+                    tested += 1
+                    if closest_approach_km(segment, other.segments[index]) < SEPARATION_KM:
+                        blocked.add(other.layer)
+                        if other.layer is None or len(blocked) == len(ALTITUDE_LAYERS_M):
+                            return blocked, tested
+            seen.clear()
+        return blocked, tested
+
+    def _insert(self, corridor):
+        for index, segment in enumerate(corridor.segments):
+            for bucket in self._segment_buckets(segment):
+                self._buckets.setdefault(bucket, set()).add((corridor.drone_id, index))
+                corridor.buckets.append((bucket, index))
+        self._missions[corridor.drone_id] = corridor
+        heapq.heappush(self._expiry, (corridor.end, corridor.drone_id))
+
+    def _remove(self, drone_id):
+        corridor = self._missions.pop(drone_id, None)
+        if corridor is None:
+            return
+        for bucket, index in corridor.buckets:
+            members = self._buckets.get(bucket)
+            if members is not None:
+                members.discard((drone_id, index))
+                if not members:
+                    del self._buckets[bucket]
+
+    def _expire(self, now):
+        """Drops corridors whose drone has landed back home."""
+        while self._expiry and self._expiry[0][0] < now:
+            end, drone_id = heapq.heappop(self._expiry)
+            mission = self._missions.get(drone_id)
+            if mission is not None and mission.end == end:
+                self._remove(drone_id)
+
+
+def mission_for_package(cur, package_id):
+    """
+    (drone_id, points, package_ids) of the sortie that launching package_id starts:
+    its multi-stop route, or warehouse -> destination -> warehouse. None when the
+    package has no drone or no located warehouse.
+    """
+    route = route_planner.open_route_for_package(cur, package_id)
+    if route is not None:
+        origin = (route['origin_lat'], route['origin_lng'])
+        stops = [s for s in route['stops'] if s.get('state', 'pending') == 'pending']
+        return (route['drone_id'], [origin, *((s['lat'], s['lng']) for s in stops), origin],
+                [s['package_id'] for s in stops])
+    cur.execute("""
+        SELECT p.assigned_drone_id, p.destination_lat, p.destination_lng, w.latitude, w.longitude
+        FROM packagemanagement p
+        JOIN warehouses w ON w.name = p.warehouse_name
+        WHERE p.package_id = %s
+    """, (package_id,))
+    row = cur.fetchone()
+    if not row or row[0] is None or None in row[1:]:
+        return None
+    drone_id, dest_lat, dest_lng, lat, lng = row
+    origin = (float(lat), float(lng))
+    return drone_id, [origin, (float(dest_lat), float(dest_lng)), origin], [package_id]
@@ -1,11 +1,17 @@
 import os
-import psycopg2
 from flask import Flask, request, jsonify
 import datetime
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
+from viewport import parse_bbox, bbox_condition
+from location_search import parse_limit, search_locations
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for all routes
+# Requires an access token (see auth_tokens.AUTH_ENFORCE)
+protect_app(app)
 
 # Database connection details
 DB_HOST = "localhost"
@@ -15,7 +21,7 @@ DB_PASS = "admin"
 DB_PORT = 5432
 
 def get_db_connection():
-    conn = psycopg2.connect(
+    conn = db.connect(
         host=DB_HOST,
         database=DB_NAME,
         user=DB_USER,
@@ -65,20 +71,21 @@ def search_warehouses():
     cur = None
     try:
         search_term = request.args.get('q', '')
+        try:
+            bbox = parse_bbox(request.args.get('bbox'))
+            limit = parse_limit(request.args.get('limit'))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid search parameters: {e}"}), 400
+        condition, params = bbox_condition(bbox)
         conn = get_db_connection()
         cur = conn.cursor()
         
         if search_term:
-            cur.execute("""
-                SELECT name, latitude, longitude 
-                FROM warehouses 
-                WHERE name ILIKE %s 
-                ORDER BY name;
-            """, (f'%{search_term}%',))
+            matches = search_locations(cur, search_term, types=['warehouse'], limit=limit, bbox=bbox)
+            warehouses = [(m['name'], m['latitude'], m['longitude']) for m in matches]
         else:
-            cur.execute("SELECT name, latitude, longitude FROM warehouses ORDER BY name;")
-        
-        warehouses = cur.fetchall()
+            cur.execute(f"SELECT name, latitude, longitude FROM warehouses WHERE {condition} ORDER BY name;", params)
+            warehouses = cur.fetchall()
         
         # Format the data for the dropdown
         formatted_warehouses = []
@@ -450,5 +457,12 @@ def get_delivery_missions(warehouse_name):
         if conn:
             conn.close()
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     app.run(debug=True, port=5042)
@@ -0,0 +1,432 @@
+"""
+Automatic drone-to-package dispatch.
+
+A planning round loads every pending, unassigned package, every active drone with a
+free gripper (located at the warehouse it is assigned to in droneassignment) and the
+free racks of every DDT, then assigns packages to drones so the total flight distance
+stays low while respecting:
+
+  - payload: the weight on a drone never exceeds its max_payload
+  - grippers: at most one package per free gripper
+  - racks: a DDT never receives more packages than it has free racks
+  - pickup: a drone collects all of its packages at one warehouse
+  - batching: a drone's packages go to towers within ROUTE_BATCH_RADIUS_KM of its first one
+  - routes: a drone holding packages that are not on its Planned route (loaded by hand)
+    is left out, since its sortie and route would not include them
+  - battery: drones reporting less than DISPATCH_MIN_BATTERY percent are held back, and
+    a drone's sortie must fit in its usable battery energy (range_matrix.py energy model).
+    Given the RangeMatrix, every pair must also pass its per-model check, the same one
+    /api/reachable_ddts answers, read from the matrix rather than recomputed
+
+Distances are great-circle kilometres computed with numpy in one batch per round.
+Packages are placed in order of regret (how much worse their second-best drone is
+than their best), so packages with only one good option are served first; each
+placement is one vectorized pass over the drones. Thousands of packages plan in
+well under a second.
+
+A package costs a fresh drone its repositioning flight plus the round trip to the
+tower; on a drone already bound for a nearby tower it costs only the detour. Each
+drone's stops are then ordered into a sortie by route_planner.py, and the drone's
+destination is set at launch.
+"""
+import logging
+import os
+import re
+import time
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+import range_matrix
+import route_planner
+from geo import haversine_km, location_key
+
+logger = logging.getLogger(__name__)
+
+GRIPPERS = ('gripper_01', 'gripper_02', 'gripper_03')
+DISPATCH_MIN_BATTERY = float(os.environ.get('DISPATCH_MIN_BATTERY', 30))
+
+# Packages assigned to a drone that has not launched yet still need their rack
+RESERVED_STATUSES = ('Pending',)
+# Drones carrying packages in one of these states are in the air
+AIRBORNE_STATUSES = ('Dispatched', 'In Transit', 'Out for Delivery')
+
+RACK_COLUMN = re.compile(r'^rack_(\d+)$')
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+
+
+class DispatchConflict(Exception):
+    """A package or gripper in the plan was taken by someone else before it was applied."""
+
+
+def parse_weight(value):
+    """'2.5', '2.5 kg' or 2.5 -> 2.5; None when no number can be read."""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    match = NUMBER.search(str(value))
+    return float(match.group()) if match else None
+
+
+def free_racks(ddt):
+    """Names of the empty rack_NN columns of a ddts row, up to total_racks."""
+    total = ddt.get('total_racks') or 0
+    racks = []
+    for column, value in ddt.items():
+        match = RACK_COLUMN.match(column)
+        if match and value is None and int(match.group(1)) <= total:
+            racks.append(column)
+    return sorted(racks)
+
+
+class DispatchRound:
+    """Arrays describing one planning round, indexed by package, drone, warehouse and tower."""
+
+    def __init__(self, packages, drones, warehouses, towers):
+        self.warehouse_names = [w['name'] for w in warehouses]
+        self.warehouse_lat = np.array([w['latitude'] for w in warehouses], dtype=np.float64)
+        self.warehouse_lng = np.array([w['longitude'] for w in warehouses], dtype=np.float64)
+        warehouse_index = {name: i for i, name in enumerate(self.warehouse_names)}
+
+        self.tower_names = [t['name'] for t in towers]
+        self.tower_lat = np.array([t['latitude'] for t in towers], dtype=np.float64)
+        self.tower_lng = np.array([t['longitude'] for t in towers], dtype=np.float64)
+        self.racks_free = np.array([t['racks_free'] for t in towers], dtype=np.int64)
+        tower_index = {location_key(t['latitude'], t['longitude']): i for i, t in enumerate(towers)}
+
+        self.unplannable = []
+        kept = []
+        for p in packages:
+            weight = parse_weight(p['weight_kg'])
+            warehouse = warehouse_index.get(p['warehouse_name'])
+            tower = None
+            if p['destination_lat'] is not None and p['destination_lng'] is not None:
+                tower = tower_index.get(location_key(p['destination_lat'], p['destination_lng']))
+            if weight is None:
+                self.unplannable.append({'package_id': p['package_id'], 'reason': 'invalid weight'})
+            elif warehouse is None:
+                self.unplannable.append({'package_id': p['package_id'], 'reason': 'unknown warehouse'})
+            elif tower is None:
+                self.unplannable.append({'package_id': p['package_id'], 'reason': 'no tower at destination'})
+            else:
+                kept.append((p['package_id'], warehouse, tower, weight))
+
+        self.package_ids = [k[0] for k in kept]
+        self.package_warehouse = np.array([k[1] for k in kept], dtype=np.int64)
+        self.package_tower = np.array([k[2] for k in kept], dtype=np.int64)
+        self.package_weight = np.array([k[3] for k in kept], dtype=np.float64)
+
+        self.drone_ids = [d['drone_id'] for d in drones]
+        self.drone_lat = np.array([d['latitude'] for d in drones], dtype=np.float64)
+        self.drone_lng = np.array([d['longitude'] for d in drones], dtype=np.float64)
+        self.drone_grippers = [list(d['free_grippers']) for d in drones]
+        self.drone_payload = np.array([d['payload_left'] for d in drones], dtype=np.float64)
+        self.drone_carried = np.array([d['carried_kg'] for d in drones], dtype=np.float64)
+        self.drone_weight = np.array([d['weight_kg'] or 0.0 for d in drones], dtype=np.float64)
+        self.drone_battery = np.array([d['battery_fraction'] for d in drones], dtype=np.float64)
+        # Usable Wh at the reported battery level; drones with unreadable battery data are not range-checked
+        self.drone_budget_wh = np.array([np.inf if d['budget_wh'] is None else d['budget_wh'] for d in drones],
+                                        dtype=np.float64)
+        # Drones already holding packages stay at their warehouse for this sortie
+        self.drone_pickup = np.array([warehouse_index.get(d['warehouse_name'], -1) if d['loaded'] else -1
+                                      for d in drones], dtype=np.int64)
+        # First stop of a drone's planned route from an earlier round (NaN when none)
+        self.drone_anchor_lat = np.array([d['anchor'][0] if d['anchor'] else np.nan for d in drones], dtype=np.float64)
+        self.drone_anchor_lng = np.array([d['anchor'][1] if d['anchor'] else np.nan for d in drones], dtype=np.float64)
+        # Length of that planned route's tour (0 when none)
+        self.drone_tour_km = np.array([d['tour_km'] for d in drones], dtype=np.float64)
+
+    @property
+    def size(self):
+        return len(self.package_ids), len(self.drone_ids)
+
+
+def load_round(conn, battery=None, min_battery=DISPATCH_MIN_BATTERY):
+    """
+    Reads one planning round from the database. battery optionally maps drone_id to its
+    latest reported battery percentage; drones below min_battery are left out.
+    """
+    battery = battery or {}
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT name, latitude, longitude FROM warehouses WHERE latitude IS NOT NULL AND longitude IS NOT NULL")
+        warehouses = [dict(row) for row in cur.fetchall()]
+
+        cur.execute("SELECT * FROM ddts WHERE status = 'Active'")
+        towers = []
+        for ddt in cur.fetchall():
+            if ddt['latitude'] is None or ddt['longitude'] is None:
+                continue
+            towers.append({'name': ddt['name'], 'latitude': float(ddt['latitude']),
+                           'longitude': float(ddt['longitude']), 'racks_free': len(free_racks(ddt))})
+
+        # Racks already promised to assigned packages that have not launched
+        cur.execute("""
+            SELECT destination_lat, destination_lng, COUNT(*) AS reserved
+            FROM packagemanagement
+            WHERE assigned_drone_id IS NOT NULL AND current_status = ANY(%s)
+              AND destination_lat IS NOT NULL AND destination_lng IS NOT NULL
+            GROUP BY destination_lat, destination_lng
+        """, (list(RESERVED_STATUSES),))
+        reserved = {location_key(r['destination_lat'], r['destination_lng']): r['reserved'] for r in cur.fetchall()}
+        for tower in towers:
+            tower['racks_free'] = max(0, tower['racks_free'] - reserved.get(location_key(tower['latitude'], tower['longitude']), 0))
+
+        cur.execute("""
+            SELECT package_id, warehouse_name, destination_lat, destination_lng, weight_kg
+            FROM packagemanagement
+            WHERE current_status = 'Pending' AND assigned_drone_id IS NULL
+            ORDER BY last_update_time ASC
+        """)
+        packages = cur.fetchall()
+
+        cur.execute("""
+            SELECT DISTINCT ON (d.drone_id)
+                   d.drone_id, d.max_payload, d.weight, d.battery_capacity, d.gripper_01, d.gripper_02, d.gripper_03,
+                   da.name AS warehouse_name, da.latitude, da.longitude
+            FROM dronesdata d
+            JOIN droneassignment da ON da.drone_id = d.drone_id AND da.status = 'Active'
+            WHERE d.status = 'active' AND d.max_payload > 0
+              AND (d.gripper_01 IS NULL OR d.gripper_02 IS NULL OR d.gripper_03 IS NULL)
+              AND da.latitude IS NOT NULL AND da.longitude IS NOT NULL
+              AND NOT EXISTS (
+                  SELECT 1 FROM packagemanagement p
+                  WHERE p.assigned_drone_id = d.drone_id AND p.current_status = ANY(%s)
+              )
+            ORDER BY d.drone_id, da.id DESC
+        """, (list(AIRBORNE_STATUSES),))
+        drone_rows = cur.fetchall()
+
+        loaded_ids = [row[g] for row in drone_rows for g in GRIPPERS if row[g]]
+        loaded_weight = {}
+        if loaded_ids:
+            cur.execute("SELECT package_id, weight_kg FROM packagemanagement WHERE package_id = ANY(%s)", (loaded_ids,))
+            loaded_weight = {r['package_id']: parse_weight(r['weight_kg']) or 0.0 for r in cur.fetchall()}
+
+        cur.execute("""
+            SELECT drone_id, stops -> 0 ->> 'lat' AS lat, stops -> 0 ->> 'lng' AS lng, planned_km, stops
+            FROM drone_routes
+            WHERE status = 'Planned' AND jsonb_array_length(stops) > 0 AND drone_id = ANY(%s)
+        """, ([row['drone_id'] for row in drone_rows],))
+        anchor_rows = cur.fetchall()
+        anchors = {r['drone_id']: (float(r['lat']), float(r['lng'])) for r in anchor_rows}
+        tours = {r['drone_id']: float(r['planned_km'] or 0.0) for r in anchor_rows}
+        routed = {r['drone_id']: {s['package_id'] for s in r['stops']} for r in anchor_rows}
+
+    drones = []
+    for row in drone_rows:
+        level = battery.get(row['drone_id'])
+        if level is not None and float(level) < min_battery:
+            continue
+        loaded = [row[g] for g in GRIPPERS if row[g]]
+        if not set(loaded) <= routed.get(row['drone_id'], set()):
+            continue
+        carried = sum(loaded_weight.get(p, 0.0) for p in loaded)
+        capacity = range_matrix.battery_wh(row['battery_capacity'])
+        budget = None
+        if capacity is not None and row['weight'] is not None:
+            budget = capacity * range_matrix.USABLE_FRACTION * (float(level) / 100 if level is not None else 1.0)
+        drones.append({
+            'drone_id': row['drone_id'],
+            'warehouse_name': row['warehouse_name'],
+            'latitude': float(row['latitude']),
+            'longitude': float(row['longitude']),
+            'free_grippers': [g for g in GRIPPERS if not row[g]],
+            'payload_left': float(row['max_payload']) - carried,
+            'carried_kg': carried,
+            'weight_kg': float(row['weight']) if row['weight'] is not None else None,
+            'budget_wh': budget,
+            'battery_fraction': float(level) / 100 if level is not None else 1.0,
+            'loaded': bool(loaded),
+            'anchor': anchors.get(row['drone_id']),
+            'tour_km': tours.get(row['drone_id'], 0.0),
+        })
+    return DispatchRound(packages, drones, warehouses, towers)
+
+
+def plan(round_, ranges=None):
+    """
+    Assigns packages to drones for one round; returns assignments, ordered routes, unassigned
+    packages and totals. ranges is an optional RangeMatrix that must also clear every pair.
+    """
+    started = time.perf_counter()
+    n_packages, n_drones = round_.size
+    assignments = []
+    unassigned = list(round_.unplannable)
+
+    fleet = None
+    if ranges is not None and n_packages and n_drones:
+        try:
+            fleet = ranges.fleet_range(round_.drone_ids)
+        except (RuntimeError, psycopg2.Error) as e:
+            logger.warning(f"Range matrix unavailable, planning without it: {e}")
+
+    if n_packages and n_drones:
+        # Repositioning cost from every drone to every warehouse, and each package's delivery leg
+        reposition = haversine_km(round_.warehouse_lat[:, None], round_.warehouse_lng[:, None],
+                                  round_.drone_lat[None, :], round_.drone_lng[None, :])
+        delivery = haversine_km(round_.warehouse_lat[round_.package_warehouse],
+                                round_.warehouse_lng[round_.package_warehouse],
+                                round_.tower_lat[round_.package_tower], round_.tower_lng[round_.package_tower])
+
+        capacity = np.array([len(g) for g in round_.drone_grippers], dtype=np.int64)
+        payload = round_.drone_payload.copy()
+        pickup = round_.drone_pickup.copy()
+        racks = round_.racks_free.copy()
+        anchor_lat = round_.drone_anchor_lat.copy()
+        anchor_lng = round_.drone_anchor_lng.copy()
+        carried = round_.drone_carried.copy()
+        # Length of each drone's tour so far, including a route planned in an earlier round
+        tour_km = round_.drone_tour_km.copy()
+
+        order = _placement_order(round_, reposition, payload, pickup)
+        for p in order:
+            package_id = round_.package_ids[p]
+            tower = round_.package_tower[p]
+            if racks[tower] <= 0:
+                unassigned.append({'package_id': package_id, 'reason': 'no free rack at tower'})
+                continue
+            w = round_.package_warehouse[p]
+            weight = round_.package_weight[p]
+            tower_lat, tower_lng = round_.tower_lat[tower], round_.tower_lng[tower]
+
+            # Fresh sortie: reposition, then out to the tower and back
+            cost = np.where(pickup < 0, reposition[w], np.where(pickup == w, 0.0, np.inf)) + 2 * delivery[p]
+            # Drone already bound for a nearby tower: only the detour via this one
+            bound = ~np.isnan(anchor_lat) & (pickup == w)
+            if bound.any():
+                hop = haversine_km(anchor_lat[bound], anchor_lng[bound], tower_lat, tower_lng)
+                home = haversine_km(anchor_lat[bound], anchor_lng[bound],
+                                    round_.warehouse_lat[w], round_.warehouse_lng[w])
+                cost[bound] = np.where(hop <= route_planner.ROUTE_BATCH_RADIUS_KM, hop + delivery[p] - home, np.inf)
+            cost[(capacity <= 0) | (payload < weight)] = np.inf
+            carriable = np.isfinite(cost)
+            if fleet is not None:
+                reachable = fleet.feasible(round_.warehouse_names[w], round_.tower_names[tower],
+                                           carried + weight, round_.drone_battery)
+                cost[~reachable] = np.inf
+            # Energy of the sortie with this package on board; a multi-stop tour is recosted
+            # end to end with the new total payload, as if nothing were dropped along the way
+            with np.errstate(invalid='ignore'):
+                need = range_matrix.sortie_wh(np.where(pickup < 0, reposition[w], 0.0), delivery[p],
+                                              round_.drone_weight, carried + weight)
+                need[bound] = range_matrix.tour_wh(0.0, tour_km[bound] + cost[bound], round_.drone_weight[bound],
+                                                   carried[bound] + weight)
+            cost[need > round_.drone_budget_wh] = np.inf
+            d = int(np.argmin(cost))
+            if not np.isfinite(cost[d]):
+                reason = 'out of battery range' if carriable.any() else 'no drone with capacity'
+                unassigned.append({'package_id': package_id, 'reason': reason})
+                continue
+            repositioned = float(reposition[w, d]) if pickup[d] < 0 else 0.0
+            gripper = round_.drone_grippers[d].pop(0)
+            capacity[d] -= 1
+            payload[d] -= weight
+            carried[d] += weight
+            tour_km[d] += cost[d] - repositioned
+            pickup[d] = w
+            racks[tower] -= 1
+            if np.isnan(anchor_lat[d]):
+                anchor_lat[d], anchor_lng[d] = tower_lat, tower_lng
+            assignments.append({
+                'package_id': package_id,
+                'drone_id': round_.drone_ids[d],
+                'gripper': gripper,
+                'warehouse_name': round_.warehouse_names[w],
+                'warehouse_lat': float(round_.warehouse_lat[w]),
+                'warehouse_lng': float(round_.warehouse_lng[w]),
+                'ddt_name': round_.tower_names[tower],
+                'ddt_lat': float(tower_lat),
+                'ddt_lng': float(tower_lng),
+                'reposition_km': round(repositioned, 3),
+                'delivery_km': round(float(delivery[p]), 3),
+                'sortie_wh': round(float(need[d]), 1),
+            })
+    else:
+        unassigned.extend({'package_id': pid, 'reason': 'no drone with capacity'} for pid in round_.package_ids)
+
+    routes = route_planner.build_routes(assignments)
+    reposition_km = sum(a['reposition_km'] for a in assignments)
+    route_km = sum(r['planned_km'] for r in routes)
+    return {
+        'assignments': assignments,
+        'routes': routes,
+        'unassigned': unassigned,
+        'summary': {
+            'packages': n_packages + len(round_.unplannable),
+            'drones': n_drones,
+            'assigned': len(assignments),
+            'unassigned': len(unassigned),
+            'drones_used': len(routes),
+            'reposition_km': round(reposition_km, 3),
+            'route_km': round(route_km, 3),
+            'total_km': round(reposition_km + route_km, 3),
+            'elapsed_ms': round((time.perf_counter() - started) * 1000, 2),
+        },
+    }
+
+
+def _placement_order(round_, reposition, payload, pickup):
+    """Package indices by descending regret (second-best minus best initial cost), heaviest first on ties."""
+    by_warehouse = np.where(pickup[None, :] < 0, reposition,
+                            np.where(pickup[None, :] == np.arange(len(reposition))[:, None], 0.0, np.inf))
+    costs = by_warehouse[round_.package_warehouse]
+    costs[payload[None, :] < round_.package_weight[:, None]] = np.inf
+    if costs.shape[1] >= 2:
+        two = np.partition(costs, 1, axis=1)[:, :2]
+        with np.errstate(invalid='ignore'):
+            regret = np.where(np.isfinite(two[:, 1]), two[:, 1] - two[:, 0], np.inf)
+        # Packages no drone can carry go last
+        regret = np.where(np.isfinite(two[:, 0]), regret, -np.inf)
+    else:
+        regret = np.zeros(len(costs))
+    # lexsort: last key is primary
+    return np.lexsort((-round_.package_weight, -regret))
+
+
+def apply_plan(conn, assignments, routes=()):
+    """
+    Writes a plan's assignments in one transaction: assigned_drone_id/assigned_gripper on
+    the packages, the package_id into the drones' grippers and the ordered routes into
+    drone_routes (see route_planner.save_routes). Raises DispatchConflict
+    (after rolling back) when any package or gripper changed since the round was loaded.
+    """
+    if not assignments:
+        return 0
+    try:
+        with conn.cursor() as cur:
+            applied = psycopg2.extras.execute_values(cur, """
+                UPDATE packagemanagement p
+                SET assigned_drone_id = v.drone_id, assigned_gripper = v.gripper, last_update_time = CURRENT_TIMESTAMP
+                FROM (VALUES %s) AS v(package_id, drone_id, gripper)
+                WHERE p.package_id = v.package_id AND p.assigned_drone_id IS NULL AND p.current_status = 'Pending'
+                RETURNING p.package_id
+            """, [(a['package_id'], a['drone_id'], a['gripper']) for a in assignments], fetch=True)
+            if len(applied) != len(assignments):
+                raise DispatchConflict(f"{len(assignments) - len(applied)} package(s) were assigned or changed meanwhile")
+
+            for gripper in GRIPPERS:
+                rows = [(a['drone_id'], a['package_id']) for a in assignments if a['gripper'] == gripper]
+                if not rows:
+                    continue
+                # gripper is one of GRIPPERS, never user input
+                filled = psycopg2.extras.execute_values(cur, f"""
+                    UPDATE dronesdata d SET {gripper} = v.package_id
+                    FROM (VALUES %s) AS v(drone_id, package_id)
+                    WHERE d.drone_id = v.drone_id AND d.{gripper} IS NULL
+                    RETURNING d.drone_id
+                """, rows, fetch=True)
+                if len(filled) != len(rows):
+                    raise DispatchConflict(f"{len(rows) - len(filled)} drone {gripper}(s) were filled meanwhile")
+            try:
+                route_planner.save_routes(cur, routes)
+            except ValueError as e:
+                # A drone's Planned route filled up since the round was loaded
+                raise DispatchConflict(str(e))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    logger.info(f"Dispatch applied {len(assignments)} assignment(s)")
+    return len(assignments)
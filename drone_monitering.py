@@ -1,12 +1,23 @@
 from flask import Flask, render_template, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
+from eta import EtaService
+from live_map import LiveMapHub, TelemetryPoller, parse_max_hz, position_delta
+from viewport import parse_bbox
 import psycopg2
 import psycopg2.extras
 import requests
+import hmac
 import os
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)
+# Requires an access token (see auth_tokens.AUTH_ENFORCE); drones push vision with VISION_PUSH_TOKEN instead
+protect_app(app, exempt={'health_check', 'post_drone_vision'})
 
 DB_HOST = "localhost"
 DB_NAME = "shadowfly"
@@ -16,7 +27,7 @@ DB_PORT = 5432
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -28,6 +39,21 @@ def get_db_connection():
         print(f"Database connection error: {e}")
         return None
 
+# Latest on-board camera analytics per drone, pushed by stream.py (frame_analytics.py)
+VISION_PUSH_TOKEN = os.environ.get('VISION_PUSH_TOKEN')  # Service token stream.py sends; pushes are refused when unset
+VISION_STALE_SECONDS = 30
+MAX_VISION_DRONES = 1000
+drone_vision = {}
+drone_vision_lock = threading.Lock()
+
+def current_vision(drone_id):
+    """Latest camera analytics for a drone, or None if none arrived recently"""
+    with drone_vision_lock:
+        entry = drone_vision.get(drone_id)
+    if not entry or time.time() - entry['received_at'] > VISION_STALE_SECONDS:
+        return None
+    return entry
+
 def safe(value):
     """Helper function to safely handle None values"""
     return value if value is not None else "N/A"
@@ -90,9 +116,15 @@ def get_drone_parameters(drone_id):
                 "last_heartbeat": safe(data.get("last_heartbeat"))
             }
             
+            update = position_delta(drone_id, data)
+            if update:
+                live_map_hub.publish(update)
+            eta_service.on_telemetry(drone_id, data)
+
             print(f"Successfully fetched parameters for drone {drone_id}")
             return jsonify({
                 "parameters": parameters,
+                "vision": current_vision(drone_id),
                 "drone_id": drone_id,
                 "status": "success",
                 "source_url": communication_url
@@ -109,6 +141,26 @@ def get_drone_parameters(drone_id):
         print(f"Error fetching drone parameters: {e}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/drone-vision/<drone_id>', methods=['POST'])
+def post_drone_vision(drone_id):
+    """
+    Receives the drone's latest camera analytics (motion, blur, exposure, landing-pad
+    markers per camera); served with its parameters by /api/drone-parameters.
+    Only accepted with the shared VISION_PUSH_TOKEN as a Bearer token
+    """
+    header = request.headers.get('Authorization', '')
+    supplied = header[7:].strip() if header.startswith('Bearer ') else ''
+    if not VISION_PUSH_TOKEN or not hmac.compare_digest(supplied.encode(), VISION_PUSH_TOKEN.encode()):
+        return jsonify({"error": "Invalid vision push token"}), 401
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict) or not isinstance(data.get('cameras'), dict):
+        return jsonify({"error": "Expected {\"cameras\": {name: analytics}}"}), 400
+    with drone_vision_lock:
+        drone_vision[drone_id] = {"cameras": data['cameras'], "received_at": time.time()}
+        if len(drone_vision) > MAX_VISION_DRONES:
+            del drone_vision[min(drone_vision, key=lambda key: drone_vision[key]['received_at'])]
+    return jsonify({"status": "success"})
+
 @app.route('/api/drone-monitoring/<drone_id>')
 def get_drone_monitoring_data(drone_id):
     """
@@ -311,6 +363,51 @@ def health_check():
         "version": "1.0.0"
     })
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
+# --- Arrival estimates ---
+eta_service = EtaService(get_db_connection)
+change_bus.on('packagemanagement', eta_service.invalidate)
+eta_service.ensure_running()
+
+@app.route('/api/eta', methods=['GET'])
+def get_all_etas():
+    """Cached arrival estimates of every package in flight"""
+    return jsonify({"etas": eta_service.snapshot(), "status": "success"})
+
+@app.route('/api/eta/<package_id>', methods=['GET'])
+def get_package_eta(package_id):
+    """Cached arrival estimate of one package in flight"""
+    estimate = eta_service.get(package_id)
+    if estimate is None:
+        return jsonify({"error": "No estimate: package is not in flight"}), 404
+    return jsonify({"eta": estimate, "status": "success"})
+
+# --- Live map feed ---
+live_map_hub = LiveMapHub()
+telemetry_poller = TelemetryPoller(get_db_connection, live_map_hub, on_telemetry=eta_service.on_telemetry)
+change_bus.on('dronesdata', telemetry_poller.invalidate_roster)
+
+@app.route('/api/live-map/stream', methods=['GET'])
+def stream_live_map():
+    """
+    Server-Sent Events stream of drone position deltas for the admin map.
+    Optional ?bbox=minLng,minLat,maxLng,maxLat limits it to the viewport and
+    ?max_hz= caps how often each drone is sent.
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        max_hz = parse_max_hz(request.args.get('max_hz'))
+    except ValueError as e:
+        return jsonify({"error": f"Invalid live map parameters: {e}"}), 400
+    telemetry_poller.ensure_running()
+    return live_map_hub.sse_response(bbox, max_hz)
+
 if __name__ == '__main__':
     print("Starting Drone Monitoring Server...")
     print(f"Database: {DB_HOST}:{DB_PORT}/{DB_NAME}")
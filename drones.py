@@ -4,10 +4,16 @@ import io
 import psycopg2
 from flask import Flask, render_template, request, redirect, url_for, flash, Response, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
 from datetime import datetime
+from change_log import install_change_log, parse_cursor, current_cursor, changed_keys_since, delta_payload, with_cursor_header, CursorExpired, expired_cursor_body
 
 app = Flask(__name__)
 CORS(app)
+# Admin dashboard API: requires an admin access token
+protect_app(app, roles=('admin',), exempt={'health_check'})
 
 # Database configuration
 DB_HOST = "localhost"
@@ -20,7 +26,7 @@ def get_db_connection():
     """Establishes a connection to the PostgreSQL database and ensures the table exists."""
     conn = None
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST, database=DB_NAME, user=DB_USER, password=DB_PASS, port=DB_PORT
         )
         # Create the updated table structure
@@ -63,28 +69,42 @@ def get_db_connection():
         return None
     
 
-get_db_connection()
+startup_conn = get_db_connection()
+if startup_conn:
+    install_change_log(startup_conn)
+    startup_conn.close()
 
 
 
 @app.route('/api/drones', methods=['GET'])
 def get_drones_api():
-    """Get all drones with enhanced data"""
+    """Get all drones with enhanced data, or only those changed since ?since=<cursor>"""
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "Invalid 'since' cursor"}), 400
+
     conn = get_db_connection()
     drones_list = []
     if conn:
         try:
             with conn.cursor() as cur:
-                cur.execute("""
+                if since is None:
+                    cursor = current_cursor(cur)
+                    key_filter, key_params = "", None
+                else:
+                    changed_keys, cursor = changed_keys_since(cur, 'dronesdata', since)
+                    key_filter, key_params = "AND id = ANY(%s::int[])", (changed_keys,)
+                cur.execute(f"""
                     SELECT id, drone_id, drone_name, model, drone_type,
                            weight, max_payload, battery_type, battery_capacity, 
                            gripper_01, gripper_02, gripper_03, camera_key, 
                            communication_key, source_lat, source_lng, dest_lat, dest_lng,
                            status, created_at, updated_at
                     FROM dronesdata 
-                    WHERE status != 'deleted'
+                    WHERE status != 'deleted' {key_filter}
                     ORDER BY created_at DESC
-                """)
+                """, key_params)
                 raw_drones = cur.fetchall()
                 if raw_drones:
                     columns = [desc[0].lower() for desc in cur.description]
@@ -97,6 +117,8 @@ def get_drones_api():
                         if drone_dict.get('updated_at'):
                             drone_dict['updated_at'] = drone_dict['updated_at'].isoformat()
                         drones_list.append(drone_dict)
+        except CursorExpired:
+            return jsonify(expired_cursor_body()), 410
         except psycopg2.Error as e:
             print(f"Error fetching drones for API: {e}")
             return jsonify({"error": f"Database error: {e}"}), 500
@@ -104,7 +126,9 @@ def get_drones_api():
             conn.close()
     else:
         return jsonify({"error": "Failed to connect to the database"}), 500
-    return jsonify(drones_list)
+    if since is not None:
+        return jsonify(delta_payload(changed_keys, drones_list, 'id', cursor))
+    return with_cursor_header(jsonify(drones_list), cursor)
 
 @app.route('/add_drone', methods=['POST'])
 def add_drone():
@@ -688,5 +712,12 @@ def health_check():
     except Exception as e:
         return jsonify({"status": "unhealthy", "error": str(e)}), 503
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5014, debug=True)
\ No newline at end of file
@@ -0,0 +1,372 @@
+"""
+Arrival estimates for packages in flight, written to packagemanagement.estimated_arrival_time.
+
+The estimate for a package is the remaining great-circle distance divided by an
+expected speed, plus a fixed handling time for every stop still ahead of it:
+
+    remaining   from the drone's last telemetry fix via any earlier stops of its route
+                to the package's tower; without a recent fix, the route length from
+                the warehouse less the distance flown at the expected speed since dispatch
+    speed       the drone's recent groundspeed blended with the route's historical speed
+                (median dispatch_time -> delivery_time of past deliveries between the
+                same warehouse and tower); ETA_CRUISE_KMH when neither is known
+
+EtaService keeps every in-flight package in numpy arrays, so a full recompute is one
+vectorized pass. Telemetry recomputes only the reporting drone's packages. Estimates
+are served from memory and written back in one batched UPDATE, only when one has
+moved by at least ETA_WRITE_THRESHOLD_SECONDS. The change notifications those writes
+raise are recognised and do not trigger a reload.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+from geo import haversine_km
+
+logger = logging.getLogger(__name__)
+
+ETA_CRUISE_KMH = float(os.environ.get('ETA_CRUISE_KMH', 36))
+ETA_STOP_SECONDS = float(os.environ.get('ETA_STOP_SECONDS', 45))     # descent, drop and climb per stop
+ETA_REFRESH_SECONDS = float(os.environ.get('ETA_REFRESH_SECONDS', 60))
+ETA_FLUSH_SECONDS = float(os.environ.get('ETA_FLUSH_SECONDS', 10))
+ETA_WRITE_THRESHOLD_SECONDS = float(os.environ.get('ETA_WRITE_THRESHOLD_SECONDS', 30))
+TELEMETRY_STALE_SECONDS = 60
+LIVE_SPEED_WEIGHT = 0.7
+MIN_LIVE_SPEED_KMH = 7.2            # below 2 m/s the drone is hovering or landing
+SPEED_LIMITS_KMH = (5.0, 150.0)
+HISTORY_DAYS = 90
+HISTORY_MIN_SAMPLES = 3
+
+IN_FLIGHT_STATUSES = ('Dispatched', 'In Transit', 'Out for Delivery')
+
+# delivery_time is free text: a value that looks like a timestamp can still fail the
+# cast (2025-02-30 10:00), and one bad row must not abort the whole history query
+SAFE_TIMESTAMP_FUNCTION = """
+    CREATE OR REPLACE FUNCTION try_timestamptz(value TEXT) RETURNS timestamptz AS $$
+    BEGIN
+        RETURN value::timestamptz;
+    EXCEPTION WHEN others THEN
+        RETURN NULL;
+    END;
+    $$ LANGUAGE plpgsql STABLE;
+"""
+
+# Only ISO-like timestamps take part in the history
+ROUTE_HISTORY_QUERY = """
+    SELECT warehouse_name, destination_lat, destination_lng,
+           percentile_cont(0.5) WITHIN GROUP (ORDER BY seconds) AS median_seconds,
+           COUNT(*) AS samples
+    FROM (
+        SELECT warehouse_name, destination_lat, destination_lng,
+               EXTRACT(EPOCH FROM (try_timestamptz(delivery_time) - dispatch_time)) AS seconds
+        FROM packagemanagement
+        WHERE dispatch_time IS NOT NULL
+          AND dispatch_time > CURRENT_TIMESTAMP - %s * INTERVAL '1 day'
+          AND delivery_time ~ '^\\d{4}-\\d{2}-\\d{2}[ T]\\d{2}:\\d{2}'
+    ) deliveries
+    WHERE seconds > 0
+    GROUP BY warehouse_name, destination_lat, destination_lng
+    HAVING COUNT(*) >= %s
+"""
+
+
+def install_eta(conn):
+    """Creates try_timestamptz() for ROUTE_HISTORY_QUERY. Safe to call on every startup."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(SAFE_TIMESTAMP_FUNCTION)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"Error creating try_timestamptz(): {e}")
+        conn.rollback()
+        return False
+
+
+def route_speeds_kmh(rows, warehouses):
+    """{(warehouse_name, lat, lng): median effective km/h} from ROUTE_HISTORY_QUERY rows."""
+    speeds = {}
+    for row in rows:
+        origin = warehouses.get(row['warehouse_name'])
+        if origin is None or row['destination_lat'] is None or row['destination_lng'] is None:
+            continue
+        km = float(haversine_km(origin[0], origin[1], row['destination_lat'], row['destination_lng']))
+        flying = max(float(row['median_seconds']) - ETA_STOP_SECONDS, 60.0)
+        speeds[(row['warehouse_name'], row['destination_lat'], row['destination_lng'])] = \
+            float(np.clip(km / flying * 3600, *SPEED_LIMITS_KMH))
+    return speeds
+
+
+class EtaService:
+    """In-memory ETAs for in-flight packages, recomputed in batches and on telemetry."""
+
+    def __init__(self, connect):
+        self._connect = connect
+        self._lock = threading.Lock()
+        self._stale = True
+        self._refreshed_at = 0.0
+        self._thread = None
+        self._drones = {}           # drone_id -> (lat, lng, groundspeed km/h, received monotonic)
+        self._written = {}          # package_id -> epoch last written to the database
+        self._echoes = {}           # package_id -> (own writes not yet notified, expiry monotonic)
+        self._installed = False
+        self._set_packages([])
+
+    # --- public API ---
+    def get(self, package_id):
+        """Cached estimate for one package, or None when it is not in flight."""
+        with self._lock:
+            i = self._index.get(package_id)
+            return None if i is None else self._entry(i)
+
+    def snapshot(self):
+        with self._lock:
+            return [self._entry(i) for i in range(len(self._ids))]
+
+    def invalidate(self, event=None):
+        """
+        Forces a full reload on the next cycle (change bus handler). The one update
+        notification each of flush()'s own writes raises is skipped.
+        """
+        if event and event.get('op') == 'U':
+            with self._lock:
+                pending, expires = self._echoes.get(event.get('key'), (0, 0.0))
+                if pending and time.monotonic() < expires:
+                    if pending > 1:
+                        self._echoes[event['key']] = (pending - 1, expires)
+                    else:
+                        del self._echoes[event['key']]
+                    return
+        self._stale = True
+
+    def on_telemetry(self, drone_id, telemetry):
+        """Records a telemetry fix and re-estimates only that drone's packages."""
+        try:
+            lat = float(telemetry.get('latitude'))
+            lng = float(telemetry.get('longitude'))
+        except (TypeError, ValueError):
+            return
+        try:
+            speed = float(telemetry.get('groundspeed')) * 3.6      # m/s -> km/h
+        except (TypeError, ValueError):
+            speed = np.nan
+        with self._lock:
+            self._drones[drone_id] = (lat, lng, speed, time.monotonic())
+            rows = self._by_drone.get(drone_id)
+            if rows is not None:
+                self._drone_lat[rows], self._drone_lng[rows] = lat, lng
+                self._live_kmh[rows], self._fix_at[rows] = speed, time.monotonic()
+                self._estimate(rows)
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="eta-service", daemon=True)
+            self._thread.start()
+
+    # --- batch recompute ---
+    def refresh(self):
+        """Reloads every in-flight package and recomputes all estimates in one pass."""
+        conn = self._connect()
+        if not conn:
+            return
+        try:
+            if not self._installed:
+                self._installed = install_eta(conn)
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SELECT name, latitude, longitude FROM warehouses WHERE latitude IS NOT NULL")
+                warehouses = {r['name']: (float(r['latitude']), float(r['longitude'])) for r in cur.fetchall()}
+                cur.execute(ROUTE_HISTORY_QUERY, (HISTORY_DAYS, HISTORY_MIN_SAMPLES))
+                history = route_speeds_kmh(cur.fetchall(), warehouses)
+                cur.execute("""
+                    SELECT package_id, assigned_drone_id, warehouse_name, destination_lat, destination_lng,
+                           dispatch_time, estimated_arrival_time
+                    FROM packagemanagement
+                    WHERE current_status = ANY(%s) AND assigned_drone_id IS NOT NULL
+                      AND destination_lat IS NOT NULL AND destination_lng IS NOT NULL
+                      AND (delivery_time IS NULL OR delivery_time = '')
+                """, (list(IN_FLIGHT_STATUSES),))
+                packages = cur.fetchall()
+                cur.execute("SELECT to_regclass('drone_routes') IS NOT NULL AS present")
+                routes = []
+                if cur.fetchone()['present']:
+                    cur.execute("SELECT drone_id, origin_lat, origin_lng, stops FROM drone_routes WHERE status = 'Active'")
+                    routes = cur.fetchall()
+            conn.rollback()
+        finally:
+            conn.close()
+
+        legs = _route_legs(routes)
+        rows = []
+        for p in packages:
+            origin = warehouses.get(p['warehouse_name'])
+            dest = (p['destination_lat'], p['destination_lng'])
+            # Route packages: fly to the route's current stop first, then on through the later stops
+            target, via_km, stops_ahead, planned_km = legs.get(p['package_id'], (dest, 0.0, 0, None))
+            if planned_km is None:
+                planned_km = float(haversine_km(*origin, *dest)) if origin else np.nan
+            written = p['estimated_arrival_time']
+            rows.append({
+                'package_id': p['package_id'],
+                'drone_id': p['assigned_drone_id'],
+                'target': target,
+                'via_km': via_km,
+                'stops_ahead': stops_ahead,
+                'planned_km': planned_km,
+                'history_kmh': history.get((p['warehouse_name'], p['destination_lat'], p['destination_lng']), np.nan),
+                'dispatched_at': p['dispatch_time'].timestamp() if p['dispatch_time'] else np.nan,
+                'written': written.timestamp() if written else None,
+            })
+        with self._lock:
+            self._set_packages(rows)
+            self._written = {r['package_id']: r['written'] for r in rows if r['written'] is not None}
+            self._estimate(np.arange(len(rows)))
+        self._stale = False
+        self._refreshed_at = time.monotonic()
+
+    def flush(self):
+        """Writes estimates that moved by at least ETA_WRITE_THRESHOLD_SECONDS; returns how many."""
+        with self._lock:
+            changed = []
+            for package_id, i in self._index.items():
+                eta = self._eta[i]
+                if not np.isfinite(eta):
+                    continue
+                written = self._written.get(package_id)
+                if written is None or abs(eta - written) >= ETA_WRITE_THRESHOLD_SECONDS:
+                    changed.append((package_id, float(eta)))
+        if not changed:
+            return 0
+        conn = self._connect()
+        if not conn:
+            return 0
+        # Registered before the write so a notification cannot arrive first
+        expires = time.monotonic() + ETA_REFRESH_SECONDS
+        with self._lock:
+            now = time.monotonic()
+            self._echoes = {k: v for k, v in self._echoes.items() if v[1] > now}
+            for package_id, _ in changed:
+                self._echoes[package_id] = (self._echoes.get(package_id, (0, 0.0))[0] + 1, expires)
+        try:
+            with conn.cursor() as cur:
+                psycopg2.extras.execute_values(cur, """
+                    UPDATE packagemanagement p SET estimated_arrival_time = to_timestamp(v.eta)
+                    FROM (VALUES %s) AS v(package_id, eta)
+                    WHERE p.package_id = v.package_id
+                """, changed)
+            conn.commit()
+        except psycopg2.Error as e:
+            logger.error(f"Writing arrival estimates failed: {e}")
+            conn.rollback()
+            with self._lock:
+                for package_id, _ in changed:
+                    self._echoes.pop(package_id, None)
+            return 0
+        finally:
+            conn.close()
+        with self._lock:
+            self._written.update(changed)
+        return len(changed)
+
+    # --- internals ---
+    def _set_packages(self, rows):
+        n = len(rows)
+        self._ids = [r['package_id'] for r in rows]
+        self._index = {package_id: i for i, package_id in enumerate(self._ids)}
+        self._drone_ids = [r['drone_id'] for r in rows]
+        self._by_drone = {}
+        for i, drone_id in enumerate(self._drone_ids):
+            self._by_drone.setdefault(drone_id, []).append(i)
+        self._by_drone = {d: np.array(rows_, dtype=np.int64) for d, rows_ in self._by_drone.items()}
+        self._target_lat = np.array([r['target'][0] for r in rows], dtype=np.float64)
+        self._target_lng = np.array([r['target'][1] for r in rows], dtype=np.float64)
+        self._via_km = np.array([r['via_km'] for r in rows], dtype=np.float64)
+        self._stops_ahead = np.array([r['stops_ahead'] for r in rows], dtype=np.float64)
+        self._planned_km = np.array([r['planned_km'] for r in rows], dtype=np.float64)
+        self._history_kmh = np.array([r['history_kmh'] for r in rows], dtype=np.float64)
+        self._dispatched_at = np.array([r['dispatched_at'] for r in rows], dtype=np.float64)
+        fixes = [self._drones.get(d, (np.nan, np.nan, np.nan, -np.inf)) for d in self._drone_ids]
+        self._drone_lat = np.array([f[0] for f in fixes], dtype=np.float64)
+        self._drone_lng = np.array([f[1] for f in fixes], dtype=np.float64)
+        self._live_kmh = np.array([f[2] for f in fixes], dtype=np.float64)
+        self._fix_at = np.array([f[3] for f in fixes], dtype=np.float64)
+        self._remaining_km = np.full(n, np.nan)
+        self._speed_kmh = np.full(n, np.nan)
+        self._eta = np.full(n, np.nan)
+
+    def _estimate(self, rows):
+        """Vectorized estimate for the given package rows; caller holds the lock."""
+        if len(rows) == 0:
+            return
+        now, now_monotonic = time.time(), time.monotonic()
+        base = np.where(np.isfinite(self._history_kmh[rows]), self._history_kmh[rows], ETA_CRUISE_KMH)
+        fresh = (now_monotonic - self._fix_at[rows]) <= TELEMETRY_STALE_SECONDS
+        live = self._live_kmh[rows]
+        live_ok = fresh & np.isfinite(live) & (live >= MIN_LIVE_SPEED_KMH)
+        speed = np.clip(np.where(live_ok, LIVE_SPEED_WEIGHT * live + (1 - LIVE_SPEED_WEIGHT) * base, base),
+                        *SPEED_LIMITS_KMH)
+
+        from_fix = haversine_km(self._drone_lat[rows], self._drone_lng[rows],
+                                self._target_lat[rows], self._target_lng[rows]) + self._via_km[rows]
+        elapsed_h = np.where(np.isfinite(self._dispatched_at[rows]), (now - self._dispatched_at[rows]) / 3600, 0.0)
+        dead_reckoned = np.maximum(self._planned_km[rows] - np.maximum(elapsed_h, 0) * speed, 0.0)
+        remaining = np.where(fresh & np.isfinite(from_fix), from_fix, dead_reckoned)
+
+        self._remaining_km[rows] = remaining
+        self._speed_kmh[rows] = speed
+        self._eta[rows] = now + remaining / speed * 3600 + (self._stops_ahead[rows] + 1) * ETA_STOP_SECONDS
+
+    def _entry(self, i):
+        eta = self._eta[i]
+        return {
+            'package_id': self._ids[i],
+            'drone_id': self._drone_ids[i],
+            'estimated_arrival_time': (datetime.datetime.fromtimestamp(eta, datetime.timezone.utc).isoformat()
+                                       if np.isfinite(eta) else None),
+            'remaining_km': None if not np.isfinite(self._remaining_km[i]) else round(float(self._remaining_km[i]), 3),
+            'speed_kmh': None if not np.isfinite(self._speed_kmh[i]) else round(float(self._speed_kmh[i]), 1),
+            'stops_ahead': int(self._stops_ahead[i]),
+        }
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            try:
+                if self._stale or started - self._refreshed_at > ETA_REFRESH_SECONDS:
+                    self.refresh()
+                self.flush()
+            except Exception as e:
+                logger.error(f"ETA cycle failed: {e}")
+            time.sleep(max(0.0, ETA_FLUSH_SECONDS - (time.monotonic() - started)))
+
+
+def _route_legs(routes):
+    """
+    For every pending stop of the active routes: package_id -> (current stop (lat, lng),
+    km from the current stop on to this stop, pending stops before it, route km from the
+    warehouse to it).
+    """
+    legs = {}
+    for route in routes:
+        stops = route['stops']
+        pending = [s for s in stops if s.get('state') == 'pending']
+        if not pending:
+            continue
+        lat = np.array([route['origin_lat'], *(s['lat'] for s in stops)], dtype=np.float64)
+        lng = np.array([route['origin_lng'], *(s['lng'] for s in stops)], dtype=np.float64)
+        from_origin = np.concatenate(([0.0], np.cumsum(haversine_km(lat[:-1], lng[:-1], lat[1:], lng[1:]))))
+        current = pending[0]
+        current_index = stops.index(current) + 1
+        for ahead, stop in enumerate(pending):
+            index = stops.index(stop) + 1
+            legs[stop['package_id']] = ((current['lat'], current['lng']),
+                                        float(from_origin[index] - from_origin[current_index]),
+                                        ahead, float(from_origin[index]))
+    return legs
@@ -0,0 +1,220 @@
+import cv2
+import numpy as np
+import argparse
+import multiprocessing
+import queue
+import threading
+import time
+from multiprocessing import shared_memory
+
+# --- Configuration ---
+ANALYSIS_WIDTH = 320        # Frames are downscaled to this width before any analysis
+BLUR_THRESHOLD = 60.0       # Laplacian variance below this reads as blurred
+DARK_LEVEL = 16             # Pixels at or below count as crushed shadows
+BRIGHT_LEVEL = 240          # Pixels at or above count as blown highlights
+CLIPPED_SHARE = 0.25        # Share of clipped pixels that makes a frame under/over exposed
+ANALYSIS_SLOTS = 2          # Shared-memory frame buffers between capture and the analysis process
+
+# Landing-pad markers are ArUco tags; detection is skipped on OpenCV builds without the aruco module
+ARUCO_DICTIONARY = "DICT_4X4_50"
+
+
+def _marker_detector():
+    aruco = getattr(cv2, "aruco", None)
+    if aruco is None:
+        return None
+    dictionary = aruco.getPredefinedDictionary(getattr(aruco, ARUCO_DICTIONARY))
+    if hasattr(aruco, "ArucoDetector"):
+        detector = aruco.ArucoDetector(dictionary, aruco.DetectorParameters())
+        return detector.detectMarkers
+    parameters = aruco.DetectorParameters_create()
+    return lambda gray: aruco.detectMarkers(gray, dictionary, parameters=parameters)
+
+
+class FrameAnalyzer:
+    """CPU-only checks on one downscaled frame: motion energy, blur, exposure and landing-pad markers."""
+
+    def __init__(self, detect_markers=True):
+        self._previous = None
+        self._detect = _marker_detector() if detect_markers else None
+
+    def analyze(self, frame):
+        height, width = frame.shape[:2]
+        scale = ANALYSIS_WIDTH / width
+        small = cv2.resize(frame, (ANALYSIS_WIDTH, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+        gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+        # Motion: mean absolute change since the previous sampled frame, 0..1
+        motion = None
+        if self._previous is not None and self._previous.shape == gray.shape:
+            motion = float(cv2.absdiff(gray, self._previous).mean()) / 255.0
+        self._previous = gray
+
+        sharpness = float(cv2.Laplacian(gray, cv2.CV_64F).var())
+        brightness = float(gray.mean()) / 255.0
+        dark = float(np.count_nonzero(gray <= DARK_LEVEL)) / gray.size
+        bright = float(np.count_nonzero(gray >= BRIGHT_LEVEL)) / gray.size
+        exposure = "under" if dark > CLIPPED_SHARE else "over" if bright > CLIPPED_SHARE else "ok"
+
+        result = {
+            "motion": None if motion is None else round(motion, 4),
+            "sharpness": round(sharpness, 1),
+            "blurred": sharpness < BLUR_THRESHOLD,
+            "brightness": round(brightness, 3),
+            "exposure": exposure,
+            "markers": [],
+        }
+        if self._detect is not None:
+            corners, ids, _ = self._detect(gray)
+            if ids is not None:
+                for marker_id, marker_corners in zip(ids.flatten(), corners):
+                    cx, cy = marker_corners[0].mean(axis=0)
+                    # Centre in 0..1 image coordinates, independent of the analysis size
+                    result["markers"].append({"id": int(marker_id), "x": round(float(cx) / gray.shape[1], 4),
+                                              "y": round(float(cy) / gray.shape[0], 4)})
+        return result
+
+
+def _analysis_process(shm_name, shape, jobs, results):
+    """Analysis process: reads sampled frames from shared memory and returns results and the freed slot."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frames = np.ndarray((ANALYSIS_SLOTS, *shape), dtype=np.uint8, buffer=shm.buf)
+    analyzer = FrameAnalyzer()
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            slot, stamp = job
+            started = time.process_time()
+            try:
+                result = analyzer.analyze(frames[slot])
+            except Exception as e:
+                result = {"error": str(e)}
+            result["cpu_ms"] = round((time.process_time() - started) * 1000, 2)
+            result["captured_at"] = stamp
+            result["analyzed_at"] = time.time()
+            results.put((slot, result))
+    finally:
+        del frames
+        shm.close()
+
+
+class AnalyticsWorker:
+    """
+    Optional analysis stage for one camera. The capture thread offers every Nth frame;
+    it is copied into a free shared-memory slot and analysed in a separate process, so
+    analysis can never stall capture or encoding. When both slots are still busy the
+    sample is skipped.
+    """
+
+    def __init__(self, name, width, height, every=10):
+        self.name = name
+        self.every = every
+        self.shape = (height, width, 3)
+        self.latest = None
+        self.skipped = 0
+        self._offered = 0
+        self._lock = threading.Lock()
+        self._stopped = False
+        size = ANALYSIS_SLOTS * height * width * 3
+        self._shm = shared_memory.SharedMemory(create=True, size=size)
+        self._frames = np.ndarray((ANALYSIS_SLOTS, *self.shape), dtype=np.uint8, buffer=self._shm.buf)
+        self._free = queue.SimpleQueue()
+        for slot in range(ANALYSIS_SLOTS):
+            self._free.put(slot)
+        # spawn: the camera process is multi-threaded, which fork() does not handle safely
+        context = multiprocessing.get_context("spawn")
+        self._jobs = context.Queue()
+        self._results = context.Queue()
+        self._process = context.Process(target=_analysis_process, args=(self._shm.name, self.shape, self._jobs, self._results),
+                                        name=f"{name}-analytics", daemon=True)
+        self._reader = threading.Thread(target=self._read_results, name=f"{name}-analytics-results", daemon=True)
+
+    def start(self):
+        self._process.start()
+        self._reader.start()
+        print(f"🔍 [{self.name}] Frame analytics on every {self.every}th frame (pid {self._process.pid})")
+
+    def offer(self, frame, stamp):
+        """Called by the capture thread for every captured frame; copies only the sampled ones."""
+        self._offered += 1
+        if self._offered % self.every:
+            return False
+        with self._lock:
+            if self._stopped:
+                return False
+            try:
+                slot = self._free.get_nowait()
+            except queue.Empty:
+                self.skipped += 1
+                return False
+            np.copyto(self._frames[slot], frame)
+            self._jobs.put((slot, stamp))
+        return True
+
+    def _read_results(self):
+        while True:
+            item = self._results.get()
+            if item is None:
+                break
+            slot, result = item
+            self._free.put(slot)
+            self.latest = result
+
+    def alive(self):
+        return self._process.is_alive()
+
+    def stop(self):
+        with self._lock:
+            self._stopped = True
+        self._jobs.put(None)
+        self._process.join(timeout=5)
+        if self._process.is_alive():
+            self._process.terminate()
+        self._results.put(None)
+        self._reader.join(timeout=5)
+        del self._frames
+        self._shm.close()
+        self._shm.unlink()
+
+
+# --- Benchmark ---
+def benchmark(width, height, frames):
+    """Per-frame CPU cost of the analysis on synthetic frames of the given size."""
+    rng = np.random.default_rng(0)
+    base = rng.integers(0, 255, (height, width, 3), dtype=np.uint8)
+    analyzer = FrameAnalyzer()
+    cpu, wall = [], []
+    for i in range(frames):
+        frame = np.roll(base, i * 4, axis=1)
+        started_cpu, started_wall = time.process_time(), time.perf_counter()
+        analyzer.analyze(frame)
+        cpu.append((time.process_time() - started_cpu) * 1000)
+        wall.append((time.perf_counter() - started_wall) * 1000)
+    cpu.sort()
+    wall.sort()
+    return {
+        "frame": f"{width}x{height}",
+        "frames": frames,
+        "markers": analyzer._detect is not None,
+        "cpu_ms_median": round(cpu[len(cpu) // 2], 2),
+        "cpu_ms_p95": round(cpu[min(len(cpu) - 1, int(len(cpu) * 0.95))], 2),
+        "wall_ms_median": round(wall[len(wall) // 2], 2),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure the CPU cost of frame analytics per frame")
+    parser.add_argument("--width", type=int, default=940)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--fps", type=float, default=60, help="camera frame rate, to report load at --every")
+    parser.add_argument("--every", type=int, default=10, help="analyse every Nth frame")
+    args = parser.parse_args()
+
+    report = benchmark(args.width, args.height, args.frames)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    load = report["cpu_ms_median"] * args.fps / args.every / 1000
+    print(f"analysing every {args.every}th frame at {args.fps:g} FPS: {load:.1%} of one core")
@@ -0,0 +1,146 @@
+"""
+Single-process entry point for every backend service.
+
+Each service module is imported once and its Flask app is mounted in one WSGI
+application, sharing one interpreter, one database pool (db.py) and one change bus
+listener. Requests are routed by the port they arrive on, so the frontends keep
+their existing URLs, or by a /<service>/ path prefix on the gateway port.
+
+Production (listens on every service port plus GATEWAY_PORT):
+
+    gunicorn -c gunicorn.conf.py 'gateway:create_app()'
+
+Development (threaded werkzeug servers, no reloader):
+
+    python gateway.py
+"""
+import importlib
+import logging
+import os
+import sys
+import threading
+import time
+
+import db
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# service module -> port it has always served on
+SERVICES = {
+    "admin": 5000,
+    "admins": 5072,
+    "assign": 5008,
+    "delivery": 5042,
+    "drones": 5014,
+    "home": 5080,
+    "packagemanagement": 5024,
+    "warehouse_details": 5028,
+    "users": 5062,
+    "tower_control": 5090,
+    "drone_monitering": 5095,
+}
+
+GATEWAY_PORT = int(os.environ.get('GATEWAY_PORT', 8000))
+GATEWAY_HOST = os.environ.get('GATEWAY_HOST', '0.0.0.0')
+DB_POOL_MIN = int(os.environ.get('DB_POOL_MIN', 1))
+DB_POOL_MAX = int(os.environ.get('DB_POOL_MAX', 20))
+
+
+def resident_memory_mb():
+    """
+    Current resident set size, falling back to the peak where /proc is unavailable,
+    and NaN where neither is (Windows has no resource module or os.sysconf).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return float('nan')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KB on Linux and bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class Gateway:
+    """WSGI app dispatching to the mounted service apps by server port, then by path prefix."""
+
+    def __init__(self, apps):
+        self.apps = apps
+        self._by_port = {str(SERVICES[name]): app for name, app in apps.items()}
+
+    def __call__(self, environ, start_response):
+        app = self._by_port.get(environ.get('SERVER_PORT'))
+        if app is None:
+            app = self._mount_by_prefix(environ)
+        if app is None:
+            return self._not_found(environ, start_response)
+        return app(environ, start_response)
+
+    def _mount_by_prefix(self, environ):
+        path = environ.get('PATH_INFO', '')
+        name, _, rest = path.lstrip('/').partition('/')
+        app = self.apps.get(name)
+        if app is not None:
+            environ['SCRIPT_NAME'] = environ.get('SCRIPT_NAME', '') + '/' + name
+            environ['PATH_INFO'] = '/' + rest
+        return app
+
+    def _not_found(self, environ, start_response):
+        body = ("Unknown service. Mounted: " + ", ".join(f"/{name}/" for name in self.apps)).encode('utf-8')
+        start_response('404 Not Found', [('Content-Type', 'text/plain'), ('Content-Length', str(len(body)))])
+        return [body]
+
+
+def load_services(names=None):
+    """
+    Imports the service modules and returns {name: flask_app}, logging boot time and memory.
+    Only import-time code runs here: a module's `if __name__ == '__main__'` block never
+    does, so table creation and other startup setup must happen at import.
+    """
+    started = time.perf_counter()
+    rss_before = resident_memory_mb()
+    db.enable_pool(DB_POOL_MIN, DB_POOL_MAX)
+
+    apps = {}
+    for name in names or SERVICES:
+        module_started = time.perf_counter()
+        module = importlib.import_module(name)
+        apps[name] = module.app
+        logger.info(f"Mounted {name} (port {SERVICES[name]}) in {time.perf_counter() - module_started:.2f}s")
+
+    logger.info(f"Gateway booted {len(apps)} services in {time.perf_counter() - started:.2f}s, "
+                f"RSS {resident_memory_mb():.1f} MB (interpreter {rss_before:.1f} MB), pid {os.getpid()}")
+    return apps
+
+
+def create_app(names=None):
+    return Gateway(load_services(names))
+
+
+def bind_addresses():
+    """Every address the gateway listens on: the legacy service ports plus GATEWAY_PORT."""
+    return [f"{GATEWAY_HOST}:{port}" for port in [GATEWAY_PORT, *SERVICES.values()]]
+
+
+def main():
+    from werkzeug.serving import make_server
+
+    application = create_app()
+    servers = []
+    for address in bind_addresses():
+        host, _, port = address.rpartition(':')
+        servers.append(make_server(host, int(port), application, threaded=True))
+    for server in servers[1:]:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Development gateway listening on {', '.join(bind_addresses())}")
+    servers[0].serve_forever()
+
+
+if __name__ == '__main__':
+    main()
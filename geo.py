@@ -0,0 +1,16 @@
+"""Great-circle helpers shared by dispatch, route planning and the other planners."""
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    """Great-circle distance in km; arguments broadcast like numpy arrays."""
+    lat1, lng1, lat2, lng2 = (np.radians(np.asarray(v, dtype=np.float64)) for v in (lat1, lng1, lat2, lng2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def location_key(lat, lng):
+    # Packages name their tower by its coordinates (see tower_control.get_ddts)
+    return round(float(lat), 6), round(float(lng), 6)
@@ -0,0 +1,43 @@
+# Production settings for the single-process gateway:
+#   gunicorn -c gunicorn.conf.py 'gateway:create_app()'
+import os
+
+from gateway import bind_addresses
+
+# Every legacy service port plus GATEWAY_PORT, so the frontends keep their URLs
+bind = bind_addresses()
+
+# Every open SSE stream (/api/events on each service, /api/live-map/stream) holds one
+# worker thread for as long as the browser tab stays open, and every other request
+# needs a free thread too. A dashboard opens a few streams, so the default of 256
+# threads serves roughly 60-80 open dashboards with room left for normal requests.
+# Raise GATEWAY_THREADS beyond that. Streams hold no database connection, so
+# DB_POOL_MAX (gateway.py) only bounds concurrent normal requests.
+worker_class = 'gthread'
+threads = int(os.environ.get('GATEWAY_THREADS', 256))
+
+# Keep one worker. Each worker is a full, independent copy of every service, so
+# GATEWAY_WORKERS > 1 splits the in-memory state between them: airspace corridors
+# (deconfliction), ETA estimates, launch/rack trackers in tower_control, the range
+# matrix, live-map clients and the in-memory login rate limiter. A request would see
+# only its own worker's copy.
+workers = int(os.environ.get('GATEWAY_WORKERS', 1))
+
+# Services start background threads (change bus, telemetry poller) on import,
+# which do not survive fork(), so each worker loads the app itself
+preload_app = False
+
+# Worker heartbeat limits; SSE streams run on the worker threads and are not cut by them
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+
+accesslog = '-'
+errorlog = '-'
+loglevel = os.environ.get('GATEWAY_LOG_LEVEL', 'info')
+
+
+def when_ready(server):
+    if workers > 1:
+        server.log.warning(f"GATEWAY_WORKERS={workers}: in-memory state (airspace, ETAs, launch trackers, "
+                           f"range matrix, live map) is split between workers and will disagree")
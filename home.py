@@ -5,9 +5,16 @@ import logging
 import hashlib
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
+from location_search import SEARCH_TABLES, parse_limit, search_locations as location_search
+from viewport import MAP_LAYERS, parse_bbox, parse_zoom, bbox_condition, query_layer, CLUSTER_MAX_ZOOM
 
 app = Flask(__name__)
 CORS(app)
+# Requires an access token (see auth_tokens.AUTH_ENFORCE)
+protect_app(app, exempt={'health_check'})
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -23,7 +30,7 @@ DB_PORT = 5432
 def get_db_connection():
     """Create and return a database connection"""
     try:
-        connection = psycopg2.connect(
+        connection = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -62,10 +69,15 @@ def execute_query(query, params=None, fetch_all=True):
 
 @app.route('/api/warehouses', methods=['GET'])
 def get_warehouses():
-    """Get all warehouses with their coordinates"""
+    """Get all warehouses with their coordinates, optionally limited to ?bbox=minLng,minLat,maxLng,maxLat"""
     try:
-        query = "SELECT name, latitude, longitude FROM warehouses"
-        warehouses = execute_query(query)
+        try:
+            condition, params = bbox_condition(parse_bbox(request.args.get('bbox')))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid bbox: {e}'}), 400
+
+        query = f"SELECT name, latitude, longitude FROM warehouses WHERE {condition}"
+        warehouses = execute_query(query, params)
         
         if warehouses is None:
             return jsonify({'error': 'Failed to fetch warehouses'}), 500
@@ -88,10 +100,15 @@ def get_warehouses():
 
 @app.route('/api/ddts', methods=['GET'])
 def get_ddts():
-    """Get all DDTs (Drone Delivery Terminals) with their coordinates"""
+    """Get all DDTs (Drone Delivery Terminals) with their coordinates, optionally limited to ?bbox="""
     try:
-        query = "SELECT name, latitude, longitude FROM ddts"
-        ddts = execute_query(query)
+        try:
+            condition, params = bbox_condition(parse_bbox(request.args.get('bbox')))
+        except ValueError as e:
+            return jsonify({'error': f'Invalid bbox: {e}'}), 400
+
+        query = f"SELECT name, latitude, longitude FROM ddts WHERE {condition}"
+        ddts = execute_query(query, params)
         
         if ddts is None:
             return jsonify({'error': 'Failed to fetch DDTs'}), 500
@@ -112,6 +129,52 @@ def get_ddts():
         logger.error(f"Error in get_ddts: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
+@app.route('/api/map/viewport', methods=['GET'])
+def get_map_viewport():
+    """
+    Warehouses, DDTs and drone bases (assigned warehouses) inside ?bbox=minLng,minLat,maxLng,maxLat.
+    Below CLUSTER_MAX_ZOOM (?zoom=) points are clustered server-side;
+    ?types=warehouse,ddt,drone_base selects the layers.
+    """
+    try:
+        bbox = parse_bbox(request.args.get('bbox'))
+        zoom = parse_zoom(request.args.get('zoom'))
+    except ValueError as e:
+        return jsonify({'error': f'Invalid viewport: {e}'}), 400
+    if bbox is None:
+        return jsonify({'error': 'bbox parameter is required'}), 400
+
+    requested = request.args.get('types', '')
+    layers = [t.strip() for t in requested.split(',') if t.strip()] or list(MAP_LAYERS)
+    unknown = [t for t in layers if t not in MAP_LAYERS]
+    if unknown:
+        return jsonify({'error': f"Unknown types: {', '.join(unknown)}"}), 400
+
+    connection = get_db_connection()
+    if not connection:
+        return jsonify({'error': 'Database connection failed'}), 500
+    try:
+        cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+        result = {
+            'bbox': list(bbox),
+            'zoom': zoom,
+            'clustered': zoom < CLUSTER_MAX_ZOOM,
+            'layers': {},
+            'truncated': [],
+        }
+        for layer_name in layers:
+            features, truncated = query_layer(cursor, layer_name, bbox, zoom)
+            result['layers'][layer_name] = features
+            if truncated:
+                result['truncated'].append(layer_name)
+        cursor.close()
+        return jsonify(result)
+    except psycopg2.Error as e:
+        logger.error(f"Error in get_map_viewport: {e}")
+        return jsonify({'error': 'Failed to fetch viewport'}), 500
+    finally:
+        connection.close()
+
 @app.route('/api/network-status', methods=['GET'])
 def get_network_status():
     """Get overall network status including counts and statistics"""
@@ -174,51 +237,42 @@ def health_check():
 
 @app.route('/api/locations/search', methods=['GET'])
 def search_locations():
-    """Search for warehouses and DDTs by name or location"""
+    """Ranked, typo-tolerant search for warehouses and DDTs by name (?q=, ?types=, ?limit=)"""
     try:
         search_term = request.args.get('q', '').strip()
         
         if not search_term:
             return jsonify({'error': 'Search term is required'}), 400
-        
-        # Search warehouses
-        warehouse_query = """
-            SELECT 'warehouse' as type, name, latitude, longitude 
-            FROM warehouses 
-            WHERE LOWER(name) LIKE LOWER(%s)
-        """
-        
-        # Search DDTs
-        ddt_query = """
-            SELECT 'ddt' as type, name, latitude, longitude 
-            FROM ddts 
-            WHERE LOWER(name) LIKE LOWER(%s)
-        """
-        
-        search_pattern = f"%{search_term}%"
-        
-        warehouses = execute_query(warehouse_query, (search_pattern,))
-        ddts = execute_query(ddt_query, (search_pattern,))
+
+        requested = request.args.get('types', '')
+        types = [t.strip() for t in requested.split(',') if t.strip()] or None
+        if types and any(t not in SEARCH_TABLES for t in types):
+            return jsonify({'error': f"types must be one of: {', '.join(SEARCH_TABLES)}"}), 400
+        try:
+            limit = parse_limit(request.args.get('limit'))
+        except ValueError:
+            return jsonify({'error': 'limit must be an integer'}), 400
+
+        connection = get_db_connection()
+        if not connection:
+            return jsonify({'error': 'Database connection failed'}), 500
+        try:
+            cursor = connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
+            matches = location_search(cursor, search_term, types=types, limit=limit)
+            cursor.close()
+            connection.commit()
+        finally:
+            connection.close()
         
         results = []
-        
-        if warehouses:
-            for warehouse in warehouses:
-                results.append({
-                    'type': warehouse['type'],
-                    'name': warehouse['name'],
-                    'latitude': float(warehouse['latitude']),
-                    'longitude': float(warehouse['longitude'])
-                })
-        
-        if ddts:
-            for ddt in ddts:
-                results.append({
-                    'type': ddt['type'],
-                    'name': ddt['name'],
-                    'latitude': float(ddt['latitude']),
-                    'longitude': float(ddt['longitude'])
-                })
+        for match in matches:
+            results.append({
+                'type': match['type'],
+                'name': match['name'],
+                'latitude': float(match['latitude']),
+                'longitude': float(match['longitude']),
+                'score': match['score']
+            })
         
         return jsonify({
             'query': search_term,
@@ -238,6 +292,13 @@ def not_found(error):
 def internal_error(error):
     return jsonify({'error': 'Internal server error'}), 500
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     logger.info("Starting ShadowFly Drone Delivery API server...")
     logger.info(f"Database: {DB_NAME} on {DB_HOST}:{DB_PORT}")
@@ -0,0 +1,244 @@
+import json
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from flask import Response, stream_with_context
+from requests.adapters import HTTPAdapter
+from viewport import in_bbox
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_HZ = 2.0
+MAX_MAX_HZ = 10.0
+HEARTBEAT_SECONDS = 15.0
+
+
+def parse_max_hz(value):
+    """Parses ?max_hz=, clamped to (0, MAX_MAX_HZ]. Raises ValueError when malformed."""
+    if not value:
+        return DEFAULT_MAX_HZ
+    max_hz = float(value)
+    if max_hz <= 0:
+        raise ValueError("max_hz must be positive")
+    return min(max_hz, MAX_MAX_HZ)
+
+
+def position_delta(drone_id, telemetry, ts=None):
+    """Builds the compact position record streamed to map clients, or None if the fix is unusable."""
+    try:
+        lat = float(telemetry.get('latitude'))
+        lng = float(telemetry.get('longitude'))
+    except (TypeError, ValueError):
+        return None
+
+    def rounded(key, digits):
+        try:
+            return round(float(telemetry.get(key)), digits)
+        except (TypeError, ValueError):
+            return None
+
+    return {
+        'drone_id': drone_id,
+        'lat': round(lat, 6),
+        'lng': round(lng, 6),
+        'heading': rounded('heading', 1),
+        'battery': rounded('battery_level', 1),
+        'ts': round(ts if ts is not None else time.time(), 3),
+    }
+
+
+class LiveMapHub:
+    """Keeps the latest position per drone and streams coalesced deltas to map clients."""
+
+    def __init__(self):
+        self._positions = {}
+        self._clients = set()
+        self._lock = threading.Lock()
+
+    def client_count(self):
+        with self._lock:
+            return len(self._clients)
+
+    def publish(self, update):
+        """Records a drone position and queues it for every client whose viewport contains it."""
+        drone_id = update['drone_id']
+        with self._lock:
+            previous = self._positions.get(drone_id)
+            if previous and all(previous[k] == update[k] for k in ('lat', 'lng', 'heading', 'battery')):
+                return
+            self._positions[drone_id] = update
+            clients = list(self._clients)
+        for client in clients:
+            client.offer(update)
+
+    def remove(self, drone_id):
+        with self._lock:
+            self._positions.pop(drone_id, None)
+            clients = list(self._clients)
+        for client in clients:
+            client.offer_removal(drone_id)
+
+    def stream(self, bbox=None, max_hz=DEFAULT_MAX_HZ):
+        """Yields SSE frames: a snapshot of the viewport, then deltas at most max_hz per drone."""
+        client = _MapClient(bbox, max_hz)
+        with self._lock:
+            snapshot = list(self._positions.values())
+            self._clients.add(client)
+        try:
+            yield "retry: 3000\n\n"
+            visible = [u for u in snapshot if in_bbox(bbox, u['lat'], u['lng'])]
+            client.visible.update(u['drone_id'] for u in visible)
+            yield f"event: snapshot\ndata: {json.dumps({'updates': visible, 'removed': []})}\n\n"
+            while True:
+                updates, removed = client.drain(HEARTBEAT_SECONDS)
+                if not updates and not removed:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: positions\ndata: {json.dumps({'updates': updates, 'removed': removed})}\n\n"
+        finally:
+            with self._lock:
+                self._clients.discard(client)
+
+    def sse_response(self, bbox=None, max_hz=DEFAULT_MAX_HZ):
+        """Flask response streaming the live map as text/event-stream."""
+        return Response(
+            stream_with_context(self.stream(bbox, max_hz)),
+            mimetype='text/event-stream',
+            headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+        )
+
+
+class _MapClient:
+    """Per-connection state. Pending updates are coalesced per drone, so memory is bounded
+    by the number of drones in the viewport no matter how slowly the client reads."""
+
+    def __init__(self, bbox, max_hz):
+        self.bbox = bbox
+        self.interval = 1.0 / max_hz
+        self.visible = set()
+        self._pending = {}
+        self._removed = set()
+        self._next_flush = 0.0
+        self._cond = threading.Condition()
+
+    def offer(self, update):
+        drone_id = update['drone_id']
+        with self._cond:
+            if in_bbox(self.bbox, update['lat'], update['lng']):
+                self._pending[drone_id] = update
+                self._removed.discard(drone_id)
+            elif drone_id in self.visible or drone_id in self._pending:
+                self._pending.pop(drone_id, None)
+                self._removed.add(drone_id)
+            else:
+                return
+            self._cond.notify()
+
+    def offer_removal(self, drone_id):
+        with self._cond:
+            self._pending.pop(drone_id, None)
+            if drone_id in self.visible:
+                self._removed.add(drone_id)
+                self._cond.notify()
+
+    def drain(self, timeout):
+        with self._cond:
+            if not self._pending and not self._removed:
+                self._cond.wait(timeout)
+            if not self._pending and not self._removed:
+                return [], []
+        # Rate limit: a drone's position is sent at most once per interval
+        wait = self._next_flush - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+        with self._cond:
+            updates = list(self._pending.values())
+            removed = [d for d in self._removed if d in self.visible]
+            self._pending.clear()
+            self._removed.clear()
+            self.visible.update(u['drone_id'] for u in updates)
+            self.visible.difference_update(removed)
+        self._next_flush = time.monotonic() + self.interval
+        return updates, removed
+
+
+class TelemetryPoller:
+    """Polls each drone's communication_key endpoint over pooled keep-alive connections
+    and feeds the hub (and on_telemetry(drone_id, telemetry), if given). Polling only
+    runs while at least one map client is connected."""
+
+    def __init__(self, connect, hub, interval=1.0, roster_refresh=30.0, max_workers=8, timeout=(2.0, 3.0),
+                 on_telemetry=None):
+        self._connect = connect
+        self._hub = hub
+        self._on_telemetry = on_telemetry
+        self._interval = interval
+        self._roster_refresh = roster_refresh
+        self._timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="telemetry")
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+        self._roster = {}
+        self._roster_loaded_at = 0.0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def ensure_running(self):
+        with self._lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name="telemetry-poller", daemon=True)
+            self._thread.start()
+
+    def invalidate_roster(self, event=None):
+        """Forces the drone list to be re-read on the next cycle (change bus handler)."""
+        self._roster_loaded_at = 0.0
+
+    def _load_roster(self):
+        conn = self._connect()
+        if not conn:
+            return
+        try:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT drone_id, communication_key FROM dronesdata
+                    WHERE status != 'deleted' AND communication_key IS NOT NULL AND communication_key != ''
+                """)
+                roster = {row[0]: row[1] for row in cur.fetchall()}
+        finally:
+            conn.close()
+        for drone_id in set(self._roster) - set(roster):
+            self._hub.remove(drone_id)
+        self._roster = roster
+        self._roster_loaded_at = time.monotonic()
+
+    def _poll_one(self, drone_id, url):
+        try:
+            response = self._session.get(url, timeout=self._timeout)
+            response.raise_for_status()
+            telemetry = response.json()
+            update = position_delta(drone_id, telemetry)
+            if update:
+                self._hub.publish(update)
+            if self._on_telemetry:
+                self._on_telemetry(drone_id, telemetry)
+        except (requests.RequestException, ValueError) as e:
+            logger.debug(f"Telemetry poll failed for drone {drone_id}: {e}")
+
+    def _run(self):
+        while True:
+            started = time.monotonic()
+            if self._hub.client_count() > 0:
+                try:
+                    if started - self._roster_loaded_at > self._roster_refresh:
+                        self._load_roster()
+                    futures = [self._executor.submit(self._poll_one, d, u) for d, u in self._roster.items()]
+                    for future in futures:
+                        future.result()
+                except Exception as e:
+                    logger.error(f"Telemetry poll cycle failed: {e}")
+            time.sleep(max(0.0, self._interval - (time.monotonic() - started)))
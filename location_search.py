@@ -0,0 +1,115 @@
+import logging
+import psycopg2
+from viewport import bbox_condition
+
+logger = logging.getLogger(__name__)
+
+# Searchable entity types and the table holding them.
+SEARCH_TABLES = {
+    'warehouse': 'warehouses',
+    'ddt': 'ddts',
+}
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+# Minimum trigram similarity for a typo-tolerant match (pg_trgm default is 0.3).
+SIMILARITY_THRESHOLD = 0.3
+
+SEARCH_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS idx_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops);
+"""
+
+_trigram_available = None
+
+
+def install_search_indexes(conn):
+    """Enables pg_trgm and creates the trigram name indexes. Safe to call on every startup."""
+    global _trigram_available
+    try:
+        with conn.cursor() as cur:
+            cur.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm;")
+            for table in SEARCH_TABLES.values():
+                cur.execute(SEARCH_INDEX_DDL.format(table=table))
+        conn.commit()
+        _trigram_available = True
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"Error creating search indexes, falling back to ILIKE search: {e}")
+        conn.rollback()
+        return False
+
+
+def trigram_available(cur):
+    """Whether pg_trgm is installed; checked once per process."""
+    global _trigram_available
+    if _trigram_available is None:
+        cur.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        _trigram_available = cur.fetchone() is not None
+    return _trigram_available
+
+
+def parse_limit(value, default=DEFAULT_LIMIT):
+    """Parses ?limit=, clamped to [1, MAX_LIMIT]. Raises ValueError when malformed."""
+    if value is None or value == '':
+        return default
+    return max(1, min(int(value), MAX_LIMIT))
+
+
+def _like_pattern(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _as_dict(cur, row):
+    if isinstance(row, dict):
+        return dict(row)
+    return dict(zip([column[0] for column in cur.description], row))
+
+
+def search_locations(cur, term, types=None, limit=DEFAULT_LIMIT, bbox=None):
+    """
+    Ranked name search across warehouses and DDTs in one query. Prefix matches rank
+    first, then substring matches, then typo-tolerant trigram matches. Returns dicts
+    with type, name, latitude, longitude and score.
+    """
+    types = types or list(SEARCH_TABLES)
+    contains = f"%{_like_pattern(term)}%"
+    prefix = f"{_like_pattern(term)}%"
+    area, area_params = bbox_condition(bbox)
+    fuzzy = trigram_available(cur)
+
+    branches = []
+    params = []
+    for entity_type in types:
+        table = SEARCH_TABLES[entity_type]
+        if fuzzy:
+            branches.append(f"""
+                SELECT '{entity_type}' AS type, name, latitude, longitude,
+                       GREATEST(similarity(name, %s), word_similarity(%s, name))
+                       + CASE WHEN name ILIKE %s THEN 2 WHEN name ILIKE %s THEN 1 ELSE 0 END AS score
+                FROM {table}
+                WHERE (name %% %s OR %s <%% name OR name ILIKE %s) AND {area}
+            """)
+            params += [term, term, prefix, contains, term, term, contains, *area_params]
+        else:
+            branches.append(f"""
+                SELECT '{entity_type}' AS type, name, latitude, longitude,
+                       CASE WHEN name ILIKE %s THEN 2 ELSE 1 END AS score
+                FROM {table}
+                WHERE name ILIKE %s AND {area}
+            """)
+            params += [prefix, contains, *area_params]
+
+    query = " UNION ALL ".join(branches) + " ORDER BY score DESC, name LIMIT %s"
+    params.append(limit)
+
+    if fuzzy:
+        cur.execute("SET LOCAL pg_trgm.similarity_threshold = %s", (SIMILARITY_THRESHOLD,))
+        cur.execute("SET LOCAL pg_trgm.word_similarity_threshold = %s", (SIMILARITY_THRESHOLD,))
+    cur.execute(query, params)
+    results = []
+    for row in cur.fetchall():
+        item = _as_dict(cur, row)
+        item['score'] = round(float(item['score']), 3)
+        results.append(item)
+    return results
@@ -3,11 +3,17 @@ import psycopg2
 import psycopg2.extras
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
 import datetime
 import logging
+from change_log import install_change_log, parse_cursor, current_cursor, changed_keys_since, delta_payload, with_cursor_header, CursorExpired, expired_cursor_body
 
 app = Flask(__name__)
 CORS(app)
+# Requires an access token (see auth_tokens.AUTH_ENFORCE)
+protect_app(app)
 
 # Configure basic logging
 logging.basicConfig(level=logging.INFO)
@@ -22,7 +28,7 @@ DB_PORT = 5432
 def get_db_connection():
     """Establishes a connection to the PostgreSQL database."""
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -71,6 +77,7 @@ def init_db():
             """)
             conn.commit()
             app.logger.info("packagemanagement table creation command executed and committed.")
+        install_change_log(conn)
         app.logger.info("Database initialization process completed successfully.")
     except psycopg2.Error as e:
         app.logger.critical(f"CRITICAL: Error during database initialization: {e}")
@@ -238,13 +245,24 @@ def create_package():
 
 @app.route('/api/packages', methods=['GET'])
 def get_all_packages():
-    """Retrieves all packages."""
+    """Retrieves all packages, or only those changed since ?since=<cursor>."""
+    try:
+        since = parse_cursor(request.args.get('since'))
+    except ValueError:
+        return jsonify({"error": "Invalid 'since' cursor"}), 400
+
     conn = get_db_connection()
     if not conn:
         return jsonify({"error": "Database connection failed"}), 500
     try:
         with conn.cursor(cursor_factory=psycopg2.extras.DictCursor) as cur:
-            cur.execute("SELECT * FROM packagemanagement ORDER BY last_update_time DESC;")
+            if since is None:
+                cursor = current_cursor(cur)
+                cur.execute("SELECT * FROM packagemanagement ORDER BY last_update_time DESC;")
+            else:
+                changed_keys, cursor = changed_keys_since(cur, 'packagemanagement', since)
+                cur.execute("SELECT * FROM packagemanagement WHERE package_id = ANY(%s) ORDER BY last_update_time DESC;",
+                            (changed_keys,))
             packages = cur.fetchall()
             result = []
             for package in packages:
@@ -253,7 +271,11 @@ def get_all_packages():
                     if isinstance(value, datetime.datetime):
                         pkg_dict[key] = value.isoformat()
                 result.append(pkg_dict)
-            return jsonify(result), 200
+            if since is not None:
+                return jsonify(delta_payload(changed_keys, result, 'package_id', cursor)), 200
+            return with_cursor_header(jsonify(result), cursor), 200
+    except CursorExpired:
+        return jsonify(expired_cursor_body()), 410
     except psycopg2.Error as e:
         app.logger.error(f"Database error in get_all_packages: {str(e)}")
         return jsonify({"error": f"Database error: {str(e)}"}), 500
@@ -539,6 +561,13 @@ def get_all_tower_names():
         if conn:
             conn.close()
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     app.logger.info("Starting Flask application...")
     app.run(debug=True, port=5024)
\ No newline at end of file
@@ -0,0 +1,192 @@
+"""
+Pluggable password hashing. Every stored hash names its algorithm and cost, so rows
+hashed under older settings keep verifying while new hashes use the current ones:
+
+    $scrypt$n=16384,r=8,p=1$<salt>$<hash>
+    $pbkdf2-sha256$i=600000$<salt>$<hash>
+    $2b$12$...                          (bcrypt, its own format)
+    <64 hex chars>                      (legacy unsalted SHA-256, verify only)
+
+PasswordHasher.needs_rehash() tells callers when a verified password should be
+stored again under the configured algorithm and cost (rehash on login).
+
+Measure verify latency at a given cost before changing it:
+
+    python password_hashing.py --algorithm scrypt --params n=32768,r=8,p=1 --target 20
+"""
+import argparse
+import base64
+import hashlib
+import hmac
+import os
+import re
+import statistics
+import time
+
+try:
+    import bcrypt
+except ImportError:
+    bcrypt = None
+
+PASSWORD_HASH_ALGORITHM = os.environ.get('PASSWORD_HASH_ALGORITHM', 'scrypt')
+PASSWORD_HASH_PARAMS = os.environ.get('PASSWORD_HASH_PARAMS', '')
+
+LEGACY_SHA256 = re.compile(r'^[0-9a-f]{64}$')
+
+
+def _b64encode(raw):
+    return base64.b64encode(raw).decode('ascii').rstrip('=')
+
+
+def _b64decode(text):
+    return base64.b64decode(text + '=' * (-len(text) % 4))
+
+
+def parse_params(text):
+    """'n=16384,r=8,p=1' -> {'n': 16384, 'r': 8, 'p': 1}"""
+    params = {}
+    for item in filter(None, (part.strip() for part in text.split(','))):
+        key, _, value = item.partition('=')
+        if not value:
+            raise ValueError(f"Invalid hash parameter '{item}', expected key=value")
+        params[key.strip()] = int(value)
+    return params
+
+
+def format_params(params):
+    return ','.join(f"{key}={value}" for key, value in sorted(params.items()))
+
+
+class Scrypt:
+    name = 'scrypt'
+    defaults = {'n': 2 ** 14, 'r': 8, 'p': 1}
+
+    def derive(self, password, salt, params):
+        # maxmem leaves headroom above the 128 * n * r bytes scrypt needs
+        return hashlib.scrypt(password.encode('utf-8'), salt=salt, n=params['n'], r=params['r'], p=params['p'],
+                              maxmem=256 * params['n'] * params['r'] + 1024 * 1024, dklen=32)
+
+
+class Pbkdf2Sha256:
+    name = 'pbkdf2-sha256'
+    defaults = {'i': 600000}
+
+    def derive(self, password, salt, params):
+        return hashlib.pbkdf2_hmac('sha256', password.encode('utf-8'), salt, params['i'])
+
+
+class Bcrypt:
+    name = 'bcrypt'
+    defaults = {'rounds': 12}
+
+    def hash(self, password, params):
+        if bcrypt is None:
+            raise RuntimeError("bcrypt is not installed")
+        return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=params['rounds'])).decode('ascii')
+
+    def verify(self, password, encoded):
+        if bcrypt is None:
+            raise RuntimeError("bcrypt is not installed")
+        return bcrypt.checkpw(password.encode('utf-8'), encoded.encode('ascii'))
+
+    def params_of(self, encoded):
+        return {'rounds': int(encoded.split('$')[2])}
+
+
+# Key derivation functions stored as $name$params$salt$hash
+KDFS = {kdf.name: kdf for kdf in (Scrypt(), Pbkdf2Sha256())}
+ALGORITHMS = [*KDFS, Bcrypt.name]
+
+
+class PasswordHasher:
+    """Hashes with one configured algorithm and cost; verifies every supported format."""
+
+    def __init__(self, algorithm=None, params=None):
+        self.algorithm = algorithm or PASSWORD_HASH_ALGORITHM
+        if self.algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown password hash algorithm '{self.algorithm}', expected one of: {', '.join(ALGORITHMS)}")
+        self._bcrypt = Bcrypt()
+        defaults = self._bcrypt.defaults if self.algorithm == Bcrypt.name else KDFS[self.algorithm].defaults
+        if isinstance(params, str) or params is None:
+            params = parse_params(params if params is not None else PASSWORD_HASH_PARAMS)
+        self.params = {**defaults, **params}
+
+    def hash(self, password):
+        if self.algorithm == Bcrypt.name:
+            return self._bcrypt.hash(password, self.params)
+        salt = os.urandom(16)
+        derived = KDFS[self.algorithm].derive(password, salt, self.params)
+        return f"${self.algorithm}${format_params(self.params)}${_b64encode(salt)}${_b64encode(derived)}"
+
+    def identify(self, stored):
+        """(algorithm, params) of a stored hash; algorithm is 'sha256' for legacy rows and None if unrecognised."""
+        if not stored:
+            return None, {}
+        if LEGACY_SHA256.match(stored):
+            return 'sha256', {}
+        if stored.startswith(('$2a$', '$2b$', '$2y$')):
+            return Bcrypt.name, self._bcrypt.params_of(stored)
+        parts = stored.split('$')
+        if len(parts) == 5 and parts[1] in KDFS:
+            return parts[1], parse_params(parts[2])
+        return None, {}
+
+    def verify(self, password, stored):
+        algorithm, params = self.identify(stored)
+        if algorithm == 'sha256':
+            candidate = hashlib.sha256(password.encode('utf-8')).hexdigest()
+            return hmac.compare_digest(candidate, stored)
+        if algorithm == Bcrypt.name:
+            return self._bcrypt.verify(password, stored)
+        if algorithm in KDFS:
+            _, _, _, salt, expected = stored.split('$')
+            derived = KDFS[algorithm].derive(password, _b64decode(salt), params)
+            return hmac.compare_digest(derived, _b64decode(expected))
+        return False
+
+    def needs_rehash(self, stored):
+        """True when stored was not produced by the configured algorithm and cost."""
+        algorithm, params = self.identify(stored)
+        return algorithm != self.algorithm or params != self.params
+
+
+def benchmark(hasher, rounds=20):
+    """Verify latency in milliseconds at the hasher's cost."""
+    stored = hasher.hash('benchmark-password')
+    timings = []
+    for _ in range(rounds):
+        started = time.perf_counter()
+        hasher.verify('benchmark-password', stored)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+    return {
+        'algorithm': hasher.algorithm,
+        'params': format_params(hasher.params),
+        'rounds': rounds,
+        'median_ms': round(statistics.median(timings), 2),
+        'p95_ms': round(timings[min(len(timings) - 1, int(len(timings) * 0.95))], 2),
+        'verifies_per_second_per_core': round(1000 / statistics.median(timings), 1),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure password verify latency at a given cost")
+    parser.add_argument('--algorithm', default=PASSWORD_HASH_ALGORITHM, choices=ALGORITHMS)
+    parser.add_argument('--params', default=PASSWORD_HASH_PARAMS, help="e.g. n=16384,r=8,p=1 or i=600000 or rounds=12")
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=2, help="verifier threads serving logins")
+    parser.add_argument('--target', type=float, default=None, help="required logins per second")
+    args = parser.parse_args()
+
+    report = benchmark(PasswordHasher(args.algorithm, args.params), args.rounds)
+    for key, value in report.items():
+        print(f"{key}: {value}")
+    capacity = report['verifies_per_second_per_core'] * args.workers
+    print(f"capacity with {args.workers} workers: {capacity:.1f} logins/s")
+    if args.target is not None:
+        verdict = "meets" if capacity >= args.target else "MISSES"
+        print(f"{verdict} the target of {args.target:g} logins/s")
+
+
+if __name__ == '__main__':
+    main()
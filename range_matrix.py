@@ -0,0 +1,477 @@
+"""
+Battery-aware range for every warehouse x DDT pair.
+
+RangeMatrix keeps the great-circle distance of every warehouse (row) to every DDT
+(column) in one float32 array. For every drone model it also keeps the energy of
+the round trip flown empty. Entities map to fixed array slots, so a feasibility
+check is a few array reads:
+
+    energy(model, w, t, payload) = empty_round_trip_wh[model][w, t] + WH_PER_KG_KM * distance_km[w, t] * payload
+
+The outbound leg carries the payload; the return leg is flown empty. A trip is
+feasible when that energy fits in the model's usable battery energy and the payload
+in its max_payload.
+
+Dispatch takes a FleetRange snapshot per planning round and checks every package
+against all drones with one lookup of its warehouse x DDT cell per drone model.
+
+Adding or moving a warehouse or DDT recomputes only its row or column. Changes
+arrive from admin.add_ddt/update_ddt/update_warehouse and, across processes, from
+the change bus. A changed drone recomputes only its model's energy array.
+
+The energy model is linear in all-up mass and distance, plus a fixed take-off and
+landing overhead per sortie. Tune it per fleet with RANGE_WH_PER_KG_KM,
+RANGE_SORTIE_OVERHEAD_WH and RANGE_USABLE_FRACTION.
+"""
+import logging
+import os
+import re
+import threading
+
+import numpy as np
+import psycopg2.extras
+
+from geo import haversine_km, location_key
+
+logger = logging.getLogger(__name__)
+
+WH_PER_KG_KM = float(os.environ.get('RANGE_WH_PER_KG_KM', 2.5))
+SORTIE_OVERHEAD_WH = float(os.environ.get('RANGE_SORTIE_OVERHEAD_WH', 15))
+USABLE_FRACTION = float(os.environ.get('RANGE_USABLE_FRACTION', 0.8))      # keep a landing reserve
+DEFAULT_PACK_VOLTAGE = float(os.environ.get('RANGE_DEFAULT_PACK_VOLTAGE', 22.2))  # 6S LiPo when only mAh is given
+
+MATRIX_TABLES = ('warehouses', 'ddts', 'dronesdata')
+
+WATT_HOURS = re.compile(r'(\d+(?:\.\d+)?)\s*wh\b', re.IGNORECASE)
+MILLIAMP_HOURS = re.compile(r'(\d+(?:\.\d+)?)\s*mah\b', re.IGNORECASE)
+AMP_HOURS = re.compile(r'(\d+(?:\.\d+)?)\s*ah\b', re.IGNORECASE)
+VOLTS = re.compile(r'(\d+(?:\.\d+)?)\s*v\b', re.IGNORECASE)
+CELLS = re.compile(r'(\d+)\s*s\b', re.IGNORECASE)
+
+
+def battery_wh(text):
+    """
+    Battery energy in Wh from dronesdata.battery_capacity: '222Wh', '10000mAh 22.2V',
+    '6S 10000mAh', '10Ah' or a bare number of mAh. None when it cannot be read.
+    """
+    if text is None:
+        return None
+    text = str(text)
+    match = WATT_HOURS.search(text)
+    if match:
+        return float(match.group(1))
+    volts = VOLTS.search(text)
+    cells = CELLS.search(text)
+    voltage = float(volts.group(1)) if volts else int(cells.group(1)) * 3.7 if cells else DEFAULT_PACK_VOLTAGE
+    match = MILLIAMP_HOURS.search(text)
+    if match:
+        return float(match.group(1)) / 1000 * voltage
+    match = AMP_HOURS.search(text)
+    if match:
+        return float(match.group(1)) * voltage
+    try:
+        return float(text) / 1000 * voltage
+    except ValueError:
+        return None
+
+
+def sortie_wh(reposition_km, delivery_km, weight_kg, payload_kg):
+    """Energy of flying reposition_km empty, then delivery_km out with payload_kg and back empty."""
+    return WH_PER_KG_KM * (reposition_km * weight_kg + delivery_km * (2 * weight_kg + payload_kg)) + SORTIE_OVERHEAD_WH
+
+
+def tour_wh(reposition_km, tour_km, weight_kg, payload_kg):
+    """Energy of flying reposition_km empty, then a multi-stop tour_km sortie with all of payload_kg on board throughout."""
+    return WH_PER_KG_KM * (reposition_km * weight_kg + tour_km * (weight_kg + payload_kg)) + SORTIE_OVERHEAD_WH
+
+
+class DroneModel:
+    """Energy parameters of one model; the most conservative values over its drones."""
+
+    def __init__(self, name, weight_kg, battery_wh, max_payload_kg):
+        self.name = name
+        self.weight_kg = weight_kg
+        self.battery_wh = battery_wh
+        self.max_payload_kg = max_payload_kg
+
+    @property
+    def usable_wh(self):
+        return self.battery_wh * USABLE_FRACTION
+
+    def trip_wh(self, km, payload_kg=0.0):
+        """Round trip of km each way, payload out and empty back; numpy arrays broadcast."""
+        return sortie_wh(0.0, np.asarray(km), self.weight_kg, payload_kg)
+
+    def max_distance_km(self, payload_kg=0.0, battery_fraction=1.0):
+        """Farthest tower (one way) the model can serve with payload_kg and return from."""
+        if payload_kg > self.max_payload_kg:
+            return 0.0
+        budget = self.usable_wh * battery_fraction - SORTIE_OVERHEAD_WH
+        return max(0.0, budget / (WH_PER_KG_KM * (2 * self.weight_kg + payload_kg)))
+
+    def as_dict(self):
+        return {'model': self.name, 'weight_kg': self.weight_kg, 'battery_wh': round(self.battery_wh, 1),
+                'max_payload_kg': self.max_payload_kg, 'empty_range_km': round(self.max_distance_km(), 2)}
+
+
+def drone_models(rows):
+    """({model name: DroneModel}, {drone_id: model name}) from dronesdata rows; unusable drones are skipped."""
+    grouped = {}
+    for row in rows:
+        capacity = battery_wh(row['battery_capacity'])
+        if capacity is None or row['weight'] is None or row['max_payload'] is None:
+            continue
+        name = row['model'] or row['drone_id']
+        grouped.setdefault(name, []).append((row['drone_id'], float(row['weight']), capacity, float(row['max_payload'])))
+    models, drone_model = {}, {}
+    for name, drones in grouped.items():
+        models[name] = DroneModel(name, max(d[1] for d in drones), min(d[2] for d in drones), min(d[3] for d in drones))
+        drone_model.update((d[0], name) for d in drones)
+    return models, drone_model
+
+
+class _Axis:
+    """Entity id -> array slot for one side of the matrix, reusing the slots of removed entities."""
+
+    def __init__(self):
+        self.slot = {}          # entity id -> slot
+        self.by_key = {}        # name or location -> slot
+        self.keys = {}          # slot -> (name, location)
+        self.free = []
+        self.size = 0
+
+    def assign(self, entity_id):
+        if entity_id in self.slot:
+            return self.slot[entity_id]
+        slot = self.free.pop() if self.free else self.size
+        if slot == self.size:
+            self.size += 1
+        self.slot[entity_id] = slot
+        return slot
+
+    def release(self, entity_id):
+        slot = self.slot.pop(entity_id, None)
+        if slot is not None:
+            for key in self.keys.pop(slot, ()):
+                self.by_key.pop(key, None)
+            self.free.append(slot)
+        return slot
+
+    def label(self, slot, *keys):
+        for key in self.keys.pop(slot, ()):
+            self.by_key.pop(key, None)
+        self.keys[slot] = keys
+        for key in keys:
+            self.by_key[key] = slot
+
+
+class RangeMatrix:
+    """Warehouse x DDT distances and per-model round-trip energy, updated one row or column at a time."""
+
+    def __init__(self, connect, initial_capacity=64):
+        self._connect = connect
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._models_stale = False
+        self._capacity = (initial_capacity, initial_capacity)
+        self._reset()
+
+    _shared = None
+    _shared_lock = threading.Lock()
+
+    @classmethod
+    def shared(cls, connect):
+        """The process-wide matrix; services mounted in one process (gateway.py) share it."""
+        with cls._shared_lock:
+            if cls._shared is None:
+                cls._shared = cls(connect)
+            return cls._shared
+
+    # --- loading and incremental updates ---
+    def _reset(self):
+        rows, cols = self._capacity
+        self.warehouses = _Axis()
+        self.towers = _Axis()
+        self.warehouse_lat = np.full(rows, np.nan)
+        self.warehouse_lng = np.full(rows, np.nan)
+        self.tower_lat = np.full(cols, np.nan)
+        self.tower_lng = np.full(cols, np.nan)
+        self.tower_names = {}
+        self.distance_km = np.full((rows, cols), np.inf, dtype=np.float32)
+        self.models = {}
+        self.drone_model = {}
+        self.empty_round_trip_wh = {}
+
+    def ensure_loaded(self):
+        with self._lock:
+            if not self._loaded:
+                self.load()
+            elif self._models_stale:
+                self.reload_drones()
+
+    def load(self):
+        """Builds the whole matrix from the database."""
+        conn = self._connect()
+        if not conn:
+            raise RuntimeError("Database connection failed")
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("SELECT id, name, latitude, longitude FROM warehouses")
+                warehouses = cur.fetchall()
+                cur.execute("SELECT id, name, latitude, longitude, status FROM ddts")
+                towers = cur.fetchall()
+                cur.execute("""
+                    SELECT drone_id, model, weight, max_payload, battery_capacity
+                    FROM dronesdata WHERE status != 'deleted'
+                """)
+                drones = cur.fetchall()
+            conn.rollback()
+        finally:
+            conn.close()
+
+        with self._lock:
+            self._capacity = (max(64, len(warehouses)), max(64, len(towers)))
+            self._reset()
+            for w in warehouses:
+                self._place_warehouse(w)
+            for t in towers:
+                if t['status'] in (None, 'Active'):
+                    self._place_tower(t)
+            # One vectorized pass for the whole matrix
+            rows = self.warehouses.size
+            cols = self.towers.size
+            self.distance_km[:rows, :cols] = haversine_km(self.warehouse_lat[:rows, None], self.warehouse_lng[:rows, None],
+                                                          self.tower_lat[None, :cols], self.tower_lng[None, :cols])
+            self.distance_km[np.isnan(self.distance_km)] = np.inf
+            self.models, self.drone_model = drone_models(drones)
+            self.empty_round_trip_wh = {name: self._energy(model) for name, model in self.models.items()}
+            self._models_stale = False
+            self._loaded = True
+        logger.info(f"Range matrix loaded: {len(warehouses)} warehouses x {len(towers)} DDTs, {len(self.models)} drone models")
+
+    def upsert_warehouse(self, row):
+        """Adds or moves a warehouse ({id, name, latitude, longitude}); recomputes only its row."""
+        with self._lock:
+            if not self._loaded:
+                return
+            slot = self._place_warehouse(row)
+            cols = self.towers.size
+            distances = haversine_km(self.warehouse_lat[slot], self.warehouse_lng[slot],
+                                     self.tower_lat[:cols], self.tower_lng[:cols])
+            self.distance_km[slot, :cols] = np.where(np.isnan(distances), np.inf, distances)
+            for name, model in self.models.items():
+                self.empty_round_trip_wh[name][slot, :cols] = model.trip_wh(self.distance_km[slot, :cols])
+
+    def upsert_tower(self, row):
+        """Adds or moves a DDT ({id, name, latitude, longitude, status}); recomputes only its column."""
+        with self._lock:
+            if not self._loaded:
+                return
+            if row.get('status') not in (None, 'Active'):
+                self.remove_tower(row['id'])
+                return
+            slot = self._place_tower(row)
+            rows = self.warehouses.size
+            distances = haversine_km(self.warehouse_lat[:rows], self.warehouse_lng[:rows],
+                                     self.tower_lat[slot], self.tower_lng[slot])
+            self.distance_km[:rows, slot] = np.where(np.isnan(distances), np.inf, distances)
+            for name, model in self.models.items():
+                self.empty_round_trip_wh[name][:rows, slot] = model.trip_wh(self.distance_km[:rows, slot])
+
+    def remove_warehouse(self, warehouse_id):
+        with self._lock:
+            slot = self.warehouses.release(warehouse_id)
+            if slot is not None:
+                self.warehouse_lat[slot] = self.warehouse_lng[slot] = np.nan
+                self.distance_km[slot, :] = np.inf
+
+    def remove_tower(self, tower_id):
+        with self._lock:
+            slot = self.towers.release(tower_id)
+            if slot is not None:
+                self.tower_lat[slot] = self.tower_lng[slot] = np.nan
+                self.tower_names.pop(slot, None)
+                self.distance_km[:, slot] = np.inf
+
+    def reload_drones(self):
+        """Re-reads drone models; only models whose weight changed get a new energy array."""
+        conn = self._connect()
+        if not conn:
+            return
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                cur.execute("""
+                    SELECT drone_id, model, weight, max_payload, battery_capacity
+                    FROM dronesdata WHERE status != 'deleted'
+                """)
+                models, drone_model = drone_models(cur.fetchall())
+            conn.rollback()
+        finally:
+            conn.close()
+        with self._lock:
+            energy = {}
+            for name, model in models.items():
+                old = self.models.get(name)
+                unchanged = old is not None and old.weight_kg == model.weight_kg
+                energy[name] = self.empty_round_trip_wh[name] if unchanged else self._energy(model)
+            self.models, self.drone_model, self.empty_round_trip_wh = models, drone_model, energy
+            self._models_stale = False
+
+    def on_change(self, event):
+        """Change bus handler: re-reads just the changed warehouse or DDT; drone models lazily."""
+        if event.get('op') == 'RESYNC':
+            self._loaded = False
+            return
+        table = event.get('table')
+        if table not in MATRIX_TABLES or not self._loaded:
+            return
+        if table == 'dronesdata':
+            # Grippers and destinations change constantly; re-read models on the next query only
+            self._models_stale = True
+            return
+        try:
+            entity_id = int(event.get('key'))
+        except (TypeError, ValueError):
+            return
+        if event.get('op') == 'D':
+            (self.remove_warehouse if table == 'warehouses' else self.remove_tower)(entity_id)
+            return
+        conn = self._connect()
+        if not conn:
+            return
+        try:
+            with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+                if table == 'warehouses':
+                    cur.execute("SELECT id, name, latitude, longitude FROM warehouses WHERE id = %s", (entity_id,))
+                else:
+                    cur.execute("SELECT id, name, latitude, longitude, status FROM ddts WHERE id = %s", (entity_id,))
+                row = cur.fetchone()
+            conn.rollback()
+        finally:
+            conn.close()
+        if row is None:
+            (self.remove_warehouse if table == 'warehouses' else self.remove_tower)(entity_id)
+        elif table == 'warehouses':
+            self.upsert_warehouse(row)
+        else:
+            self.upsert_tower(row)
+
+    # --- queries ---
+    def can_reach(self, drone_id, warehouse_name, tower_name, payload_kg=0.0):
+        """Whether drone_id can fly payload_kg from the warehouse to the tower and back. O(1)."""
+        with self._lock:
+            self.ensure_loaded()
+            model = self.models.get(self.drone_model.get(drone_id))
+            w = self.warehouses.by_key.get(('warehouse', warehouse_name))
+            t = self.towers.by_key.get(('tower', tower_name))
+            if model is None or w is None or t is None or payload_kg > model.max_payload_kg:
+                return False
+            energy = self.empty_round_trip_wh[model.name][w, t] + WH_PER_KG_KM * self.distance_km[w, t] * payload_kg
+            return bool(energy <= model.usable_wh)
+
+    def reachable_towers(self, drone_id, warehouse_name, payload_kg=0.0, battery_fraction=1.0):
+        """
+        Towers drone_id can serve from the warehouse carrying payload_kg, nearest first, with
+        distance and energy. One threshold over the warehouse's row; None if drone or
+        warehouse is unknown.
+        """
+        with self._lock:
+            self.ensure_loaded()
+            model = self.models.get(self.drone_model.get(drone_id))
+            w = self.warehouses.by_key.get(('warehouse', warehouse_name))
+            if model is None or w is None:
+                return None
+            if payload_kg > model.max_payload_kg:
+                return []
+            cols = self.towers.size
+            distances = self.distance_km[w, :cols]
+            reachable = np.flatnonzero(distances <= model.max_distance_km(payload_kg, battery_fraction))
+            reachable = reachable[np.argsort(distances[reachable])]
+            energy = self.empty_round_trip_wh[model.name][w, reachable] + WH_PER_KG_KM * distances[reachable] * payload_kg
+            return [{'ddt_name': self.tower_names[t], 'distance_km': round(float(distances[t]), 3),
+                     'energy_wh': round(float(e), 1)} for t, e in zip(reachable, energy)]
+
+    def model_for(self, drone_id):
+        with self._lock:
+            self.ensure_loaded()
+            return self.models.get(self.drone_model.get(drone_id))
+
+    def fleet_range(self, drone_ids):
+        """FleetRange snapshot for vectorized checks of drone_ids (dispatch.py)."""
+        with self._lock:
+            self.ensure_loaded()
+            return FleetRange(self, drone_ids)
+
+    # --- internals ---
+    def _place_warehouse(self, row):
+        slot = self.warehouses.assign(row['id'])
+        self._grow(rows=slot + 1)
+        self.warehouse_lat[slot] = float(row['latitude']) if row['latitude'] is not None else np.nan
+        self.warehouse_lng[slot] = float(row['longitude']) if row['longitude'] is not None else np.nan
+        self.warehouses.label(slot, ('warehouse', row['name']))
+        return slot
+
+    def _place_tower(self, row):
+        slot = self.towers.assign(row['id'])
+        self._grow(cols=slot + 1)
+        located = row['latitude'] is not None and row['longitude'] is not None
+        self.tower_lat[slot] = float(row['latitude']) if located else np.nan
+        self.tower_lng[slot] = float(row['longitude']) if located else np.nan
+        self.tower_names[slot] = row['name']
+        keys = [('tower', row['name'])]
+        if located:
+            keys.append(('location', location_key(row['latitude'], row['longitude'])))
+        self.towers.label(slot, *keys)
+        return slot
+
+    def _grow(self, rows=0, cols=0):
+        """Doubles the arrays when a new slot falls outside them."""
+        cap_rows, cap_cols = self.distance_km.shape
+        new_rows = cap_rows * 2 if rows > cap_rows else cap_rows
+        new_cols = cap_cols * 2 if cols > cap_cols else cap_cols
+        if (new_rows, new_cols) == (cap_rows, cap_cols):
+            return
+        pad = ((0, new_rows - cap_rows), (0, new_cols - cap_cols))
+        self.distance_km = np.pad(self.distance_km, pad, constant_values=np.inf)
+        self.empty_round_trip_wh = {name: np.pad(e, pad, constant_values=np.inf) for name, e in self.empty_round_trip_wh.items()}
+        self.warehouse_lat = np.pad(self.warehouse_lat, (0, new_rows - cap_rows), constant_values=np.nan)
+        self.warehouse_lng = np.pad(self.warehouse_lng, (0, new_rows - cap_rows), constant_values=np.nan)
+        self.tower_lat = np.pad(self.tower_lat, (0, new_cols - cap_cols), constant_values=np.nan)
+        self.tower_lng = np.pad(self.tower_lng, (0, new_cols - cap_cols), constant_values=np.nan)
+        self._capacity = (new_rows, new_cols)
+
+    def _energy(self, model):
+        return model.trip_wh(self.distance_km).astype(np.float32)
+
+
+class FleetRange:
+    """
+    The matrix's drone models for one list of drones, so a warehouse x DDT pair is checked
+    for all of them at once: one cell per model, then array indexing by drone.
+    Drones without a known model, and pairs the matrix does not know, are not vetoed.
+    """
+
+    def __init__(self, matrix, drone_ids):
+        names = sorted(matrix.models)
+        index = {name: i for i, name in enumerate(names)}
+        self._matrix = matrix
+        self._names = names
+        # -1 (unknown model) picks the trailing entry: no energy use, unlimited budget and payload
+        self.model = np.array([index.get(matrix.drone_model.get(d), -1) for d in drone_ids], dtype=np.int64)
+        self.usable_wh = np.array([matrix.models[name].usable_wh for name in names] + [np.inf])
+        self.max_payload_kg = np.array([matrix.models[name].max_payload_kg for name in names] + [np.inf])
+
+    def feasible(self, warehouse_name, tower_name, payload_kg, battery_fraction=1.0):
+        """Per drone: whether its model can fly payload_kg from the warehouse to the tower and back."""
+        matrix = self._matrix
+        # Under the matrix lock: a concurrent update may grow its arrays or reload the models
+        with matrix._lock:
+            w = matrix.warehouses.by_key.get(('warehouse', warehouse_name))
+            t = matrix.towers.by_key.get(('tower', tower_name))
+            if w is None or t is None:
+                return np.ones(len(self.model), dtype=bool)
+            energy = matrix.empty_round_trip_wh
+            empty = np.array([energy[name][w, t] if name in energy else 0.0 for name in self._names] + [0.0])
+            distance = float(matrix.distance_km[w, t])
+        needed = empty[self.model] + WH_PER_KG_KM * distance * payload_kg
+        return (needed <= self.usable_wh[self.model] * battery_fraction) & (payload_kg <= self.max_payload_kg[self.model])
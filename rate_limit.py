@@ -0,0 +1,151 @@
+import logging
+import math
+import threading
+import time
+from collections import OrderedDict
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucketLimiter:
+    """
+    In-memory token buckets shared by every thread of the process. Each key holds up to
+    capacity tokens and regains refill_per_second; a request spends one token.
+    Idle buckets are evicted least-recently-used beyond max_keys.
+    """
+
+    def __init__(self, capacity, refill_per_second, max_keys=10000):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def allow(self, key):
+        """Spends a token for key. Returns (allowed, retry_after_seconds)."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated = self._buckets.pop(key, (self.capacity, now))
+            tokens = min(self.capacity, tokens + (now - updated) * self.refill_per_second)
+            allowed = tokens >= 1
+            if allowed:
+                tokens -= 1
+            self._buckets[key] = (tokens, now)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        if allowed:
+            return True, 0
+        return False, math.ceil((1 - tokens) / self.refill_per_second)
+
+
+RATE_LIMIT_DDL = """
+    CREATE TABLE IF NOT EXISTS rate_limit_buckets (
+        bucket_key VARCHAR(255) PRIMARY KEY,
+        tokens DOUBLE PRECISION NOT NULL,
+        updated_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT CURRENT_TIMESTAMP
+    );
+    -- When the bucket is back to full capacity; from then on the row is indistinguishable
+    -- from a missing one and can be pruned, whichever limiter (capacity, rate) wrote it
+    ALTER TABLE rate_limit_buckets ADD COLUMN IF NOT EXISTS full_at TIMESTAMP WITH TIME ZONE;
+    CREATE INDEX IF NOT EXISTS rate_limit_buckets_full_at ON rate_limit_buckets (full_at);
+"""
+
+# Seconds between prunes of refilled buckets, per limiter and process
+RATE_LIMIT_PRUNE_INTERVAL = 300
+
+
+class PostgresTokenBucketLimiter:
+    """
+    Token buckets kept in Postgres, so every worker process and service shares them.
+    Refill and spend happen in one upsert. Rejected requests still drain the bucket
+    (down to -1 token), so a sustained flood stays locked out. Buckets that have
+    refilled are deleted every RATE_LIMIT_PRUNE_INTERVAL seconds.
+    """
+
+    def __init__(self, connect, capacity, refill_per_second, prune_interval=RATE_LIMIT_PRUNE_INTERVAL):
+        self._connect = connect
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.prune_interval = prune_interval
+        self._next_prune = time.monotonic() + prune_interval
+        self._prune_lock = threading.Lock()
+
+    def install(self):
+        """Creates the buckets table. Returns False, without raising, when the database is unreachable."""
+        conn = None
+        try:
+            conn = self._connect()
+            if not conn:
+                logger.error("Rate limiter table not installed: database connection failed")
+                return False
+            with conn.cursor() as cur:
+                cur.execute(RATE_LIMIT_DDL)
+            conn.commit()
+            return True
+        except psycopg2.Error as e:
+            logger.error(f"Rate limiter table not installed: {e}")
+            return False
+        finally:
+            if conn:
+                conn.close()
+
+    def allow(self, key):
+        """Spends a token for key. Returns (allowed, retry_after_seconds). Fails open if the database is down."""
+        conn = None
+        try:
+            conn = self._connect()
+            if not conn:
+                logger.error("Rate limiter unavailable, allowing request: database connection failed")
+                return True, 0
+            with conn.cursor() as cur:
+                cur.execute("""
+                    INSERT INTO rate_limit_buckets (bucket_key, tokens, updated_at)
+                    VALUES (%(key)s, %(capacity)s - 1, CURRENT_TIMESTAMP)
+                    ON CONFLICT (bucket_key) DO UPDATE SET
+                        tokens = GREATEST(LEAST(%(capacity)s, rate_limit_buckets.tokens
+                                     + EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - rate_limit_buckets.updated_at) * %(rate)s) - 1, -1),
+                        updated_at = CURRENT_TIMESTAMP
+                    RETURNING tokens
+                """, {'key': key, 'capacity': self.capacity, 'rate': self.refill_per_second})
+                tokens = cur.fetchone()[0]
+                cur.execute("""
+                    UPDATE rate_limit_buckets
+                    SET full_at = updated_at + (%(capacity)s - tokens) / %(rate)s * INTERVAL '1 second'
+                    WHERE bucket_key = %(key)s
+                """, {'key': key, 'capacity': self.capacity, 'rate': self.refill_per_second})
+            conn.commit()
+            self._prune_if_due(conn)
+        except psycopg2.Error as e:
+            logger.error(f"Rate limiter unavailable, allowing request: {e}")
+            return True, 0
+        finally:
+            if conn:
+                conn.close()
+        if tokens >= 0:
+            return True, 0
+        return False, math.ceil((1 - tokens) / self.refill_per_second)
+
+    def _prune_if_due(self, conn):
+        """Deletes buckets that have refilled to capacity; at most one prune per interval, never raises."""
+        with self._prune_lock:
+            now = time.monotonic()
+            if now < self._next_prune:
+                return
+            self._next_prune = now + self.prune_interval
+        try:
+            with conn.cursor() as cur:
+                # Rows written before full_at existed: every limiter here refills well within a day
+                cur.execute("""
+                    DELETE FROM rate_limit_buckets
+                    WHERE full_at < CURRENT_TIMESTAMP
+                       OR (full_at IS NULL AND updated_at < CURRENT_TIMESTAMP - INTERVAL '1 day')
+                """)
+                pruned = cur.rowcount
+            conn.commit()
+            if pruned:
+                logger.info(f"Pruned {pruned} refilled rate limit buckets")
+        except psycopg2.Error as e:
+            if not conn.closed:
+                conn.rollback()
+            logger.error(f"Rate limit bucket prune failed: {e}")
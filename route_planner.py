@@ -0,0 +1,217 @@
+"""
+Multi-stop sorties for drones carrying up to three packages, one per gripper.
+
+Dispatch (dispatch.py) batches packages bound for towers within ROUTE_BATCH_RADIUS_KM
+of each other onto one drone. This module orders each drone's stops, persists the
+route in drone_routes and walks the drone through it:
+
+    Planned    stops ordered and packages assigned, not launched yet
+    Active     launched; dronesdata.dest_lat/dest_lng point at the current stop
+    Completed  every stop delivered or failed; the drone heads back to its warehouse
+
+Stops are ordered by solving the closed tour warehouse -> stops -> warehouse
+exactly, which for at most three stops is six permutations.
+"""
+import datetime
+import itertools
+import json
+import os
+
+import numpy as np
+import psycopg2
+import psycopg2.extras
+
+from geo import haversine_km
+
+ROUTE_BATCH_RADIUS_KM = float(os.environ.get('ROUTE_BATCH_RADIUS_KM', 5))
+MAX_STOPS = 3
+
+OPEN_STATUSES = ('Planned', 'Active')
+
+ROUTES_DDL = """
+    CREATE TABLE IF NOT EXISTS drone_routes (
+        id SERIAL PRIMARY KEY,
+        drone_id VARCHAR(225) NOT NULL,
+        warehouse_name VARCHAR(255),
+        origin_lat DOUBLE PRECISION,
+        origin_lng DOUBLE PRECISION,
+        stops JSONB NOT NULL DEFAULT '[]',
+        current_stop INTEGER NOT NULL DEFAULT 0,
+        planned_km DOUBLE PRECISION,
+        status VARCHAR(50) NOT NULL DEFAULT 'Planned',
+        created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_drone_routes_open
+        ON drone_routes (drone_id) WHERE status IN ('Planned', 'Active');
+    CREATE INDEX IF NOT EXISTS idx_drone_routes_stops ON drone_routes USING GIN (stops jsonb_path_ops);
+"""
+
+
+def install_routes(conn):
+    """Creates the drone_routes table and its indexes. Safe to call on every startup."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(ROUTES_DDL)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        print(f"❌ Error creating drone_routes table: {e}")
+        conn.rollback()
+        return False
+
+
+def order_stops(origin, stops):
+    """
+    Shortest closed tour from origin (lat, lng) through every stop and back.
+    Returns (ordered stops, tour km).
+    """
+    if not stops:
+        return [], 0.0
+    lat = np.array([origin[0], *(s['lat'] for s in stops)], dtype=np.float64)
+    lng = np.array([origin[1], *(s['lng'] for s in stops)], dtype=np.float64)
+    legs = haversine_km(lat[:, None], lng[:, None], lat[None, :], lng[None, :])
+    best, best_km = None, np.inf
+    for order in itertools.permutations(range(1, len(stops) + 1)):
+        path = (0, *order, 0)
+        km = sum(legs[a, b] for a, b in zip(path, path[1:]))
+        if km < best_km:
+            best, best_km = order, km
+    return [stops[i - 1] for i in best], float(best_km)
+
+
+def build_routes(assignments):
+    """Groups a dispatch plan's assignments by drone into ordered routes."""
+    by_drone = {}
+    for a in assignments:
+        route = by_drone.setdefault(a['drone_id'], {
+            'drone_id': a['drone_id'],
+            'warehouse_name': a['warehouse_name'],
+            'origin_lat': a['warehouse_lat'],
+            'origin_lng': a['warehouse_lng'],
+            'stops': [],
+        })
+        route['stops'].append({'package_id': a['package_id'], 'ddt_name': a['ddt_name'],
+                               'lat': a['ddt_lat'], 'lng': a['ddt_lng'], 'state': 'pending'})
+    routes = []
+    for route in by_drone.values():
+        route['stops'], km = order_stops((route['origin_lat'], route['origin_lng']), route['stops'])
+        route['planned_km'] = round(km, 3)
+        routes.append(route)
+    return routes
+
+
+def save_routes(cur, routes):
+    """
+    Persists planned routes. A drone that already has a Planned route (packages from an
+    earlier round) gets the new stops merged in and the whole tour re-ordered. Stops whose
+    package is no longer a pending package of that drone are dropped from the old route,
+    and a merged route longer than MAX_STOPS raises ValueError.
+    """
+    for route in routes:
+        cur.execute("""
+            SELECT id, origin_lat, origin_lng, stops FROM drone_routes
+            WHERE drone_id = %s AND status = 'Planned'
+            FOR UPDATE
+        """, (route['drone_id'],))
+        existing = cur.fetchone()
+        if existing:
+            route_id, origin_lat, origin_lng, stops = existing
+            cur.execute("""
+                SELECT package_id FROM packagemanagement
+                WHERE package_id = ANY(%s) AND assigned_drone_id = %s AND current_status = 'Pending'
+            """, ([s['package_id'] for s in stops], route['drone_id']))
+            waiting = {row[0] for row in cur.fetchall()}
+            stops = [s for s in stops if s['package_id'] in waiting and s['state'] == 'pending']
+            if len(stops) + len(route['stops']) > MAX_STOPS:
+                raise ValueError(f"Route of drone {route['drone_id']} would have "
+                                 f"{len(stops) + len(route['stops'])} stops (max {MAX_STOPS})")
+            stops, km = order_stops((origin_lat, origin_lng), [*stops, *route['stops']])
+            cur.execute("""
+                UPDATE drone_routes SET stops = %s, planned_km = %s, updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (json.dumps(stops), round(km, 3), route_id))
+        else:
+            cur.execute("""
+                INSERT INTO drone_routes (drone_id, warehouse_name, origin_lat, origin_lng, stops, planned_km)
+                VALUES (%s, %s, %s, %s, %s, %s)
+            """, (route['drone_id'], route['warehouse_name'], route['origin_lat'], route['origin_lng'],
+                  json.dumps(route['stops']), route['planned_km']))
+
+
+def open_route_for_package(cur, package_id):
+    """The Planned or Active route carrying package_id, as a dict, or None."""
+    with cur.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as dict_cur:
+        dict_cur.execute("""
+            SELECT * FROM drone_routes
+            WHERE status = ANY(%s) AND stops @> %s::jsonb
+            FOR UPDATE
+        """, (list(OPEN_STATUSES), json.dumps([{'package_id': package_id}])))
+        return dict_cur.fetchone()
+
+
+def open_route_for_drone(cur, drone_id):
+    with cur.connection.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as dict_cur:
+        dict_cur.execute("SELECT * FROM drone_routes WHERE drone_id = %s AND status = ANY(%s)",
+                         (drone_id, list(OPEN_STATUSES)))
+        return dict_cur.fetchone()
+
+
+def _set_destination(cur, drone_id, lat, lng):
+    cur.execute("UPDATE dronesdata SET dest_lat = %s, dest_lng = %s WHERE drone_id = %s", (lat, lng, drone_id))
+
+
+def launch_route(cur, package_id, dispatched=True):
+    """
+    Starts the route carrying package_id: every package on it goes Out for Delivery and
+    the drone's destination becomes the first pending stop. Returns the route, or None
+    when the package is not on a route (single-package launches). Launching a package
+    of an already Active route changes nothing. With dispatched=False (a launch held
+    back by deconfliction) dispatch_time is left for the launch itself to set.
+    """
+    route = open_route_for_package(cur, package_id)
+    if route is None or route['status'] == 'Active':
+        return route
+    now = datetime.datetime.now()
+    package_ids = [s['package_id'] for s in route['stops']]
+    cur.execute("""
+        UPDATE packagemanagement
+        SET current_status = 'Out for Delivery', dispatch_time = %s, last_update_time = %s
+        WHERE package_id = ANY(%s)
+    """, (now if dispatched else None, now, package_ids))
+    stop = route['stops'][route['current_stop']]
+    _set_destination(cur, route['drone_id'], stop['lat'], stop['lng'])
+    cur.execute("UPDATE drone_routes SET status = 'Active', updated_at = CURRENT_TIMESTAMP WHERE id = %s",
+                (route['id'],))
+    route['status'] = 'Active'
+    return route
+
+
+def complete_stop(cur, package_id, delivered=True):
+    """
+    Records the outcome of package_id's stop and points the drone at the next pending
+    stop, or back at its warehouse once none are left. Returns the next stop, or None
+    when the route is finished or the package is not on an active route.
+    """
+    route = open_route_for_package(cur, package_id)
+    if route is None or route['status'] != 'Active':
+        return None
+    stops = route['stops']
+    for stop in stops:
+        if stop['package_id'] == package_id and stop['state'] == 'pending':
+            stop['state'] = 'delivered' if delivered else 'failed'
+    remaining = [i for i, stop in enumerate(stops) if stop['state'] == 'pending']
+    if remaining:
+        next_stop = stops[remaining[0]]
+        _set_destination(cur, route['drone_id'], next_stop['lat'], next_stop['lng'])
+        cur.execute("""
+            UPDATE drone_routes SET stops = %s, current_stop = %s, updated_at = CURRENT_TIMESTAMP
+            WHERE id = %s
+        """, (json.dumps(stops), remaining[0], route['id']))
+        return next_stop
+    _set_destination(cur, route['drone_id'], route['origin_lat'], route['origin_lng'])
+    cur.execute("""
+        UPDATE drone_routes SET stops = %s, current_stop = %s, status = 'Completed', updated_at = CURRENT_TIMESTAMP
+        WHERE id = %s
+    """, (json.dumps(stops), len(stops), route['id']))
+    return None
@@ -1,23 +1,76 @@
 import cv2
+import numpy as np
 import subprocess
 import threading
 import time
 import socket
-import queue
 import os
+import json
+import argparse
+import urllib.request
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from frame_analytics import AnalyticsWorker
 
 # --- Configuration ---
 CAMERA_INDEX = "/dev/video0"
 FRAME_WIDTH = 940
 FRAME_HEIGHT = 480
 FRAME_RATE = 60
-VIDEO_CODEC = "libx264"
+VIDEO_CODEC = os.environ.get("STREAM_CODEC", "libx264")
 FFMPEG_PATH = "ffmpeg"
 SHOW_CAMERA_FEED = False  # Set to False for headless Raspberry Pi
 
 RTP_ADDRESS = "in1.pitunnel.net:27020"
 RTP_PORT = 8050
 MEDIA_NAME = "QC60_shadowfly"
+RING_SLOTS = 4  # Preallocated frame buffers shared by capture and encoder
+
+# Cameras streamed in parallel, each to its own UDP port. "synthetic" or "synthetic:WxH@FPS"
+# as the device generates test frames instead of opening a camera.
+# Override with STREAM_CAMERAS='[{"name": "front", "device": "/dev/video0", "port": 8050}, ...]'
+CAMERAS = [{"name": MEDIA_NAME, "device": CAMERA_INDEX, "port": RTP_PORT}]
+
+# --- Supervision ---
+STATUS_PORT = int(os.environ.get("STREAM_STATUS_PORT", 8091))  # GET /status for every pipeline
+RESTART_BACKOFF = 1.0       # First restart delay of a failed capture or encoder, doubled per failure...
+MAX_RESTART_BACKOFF = 30.0  # ...up to this
+STABLE_AFTER = 60.0         # A component running this long starts over at RESTART_BACKOFF
+
+# --- Frame Analytics (frame_analytics.py) ---
+ANALYTICS_EVERY = int(os.environ.get("STREAM_ANALYTICS_EVERY", 0))  # Analyse every Nth frame; 0 disables
+# Results are pushed to drone_monitering (e.g. http://server:5095) next to the drone's parameters
+TELEMETRY_URL = os.environ.get("STREAM_TELEMETRY_URL")
+DRONE_ID = os.environ.get("DRONE_ID")
+VISION_PUSH_TOKEN = os.environ.get("VISION_PUSH_TOKEN")  # Shared with drone_monitering; pushes without it are rejected
+
+# --- Adaptive Quality ---
+STATS_INTERVAL = 5.0        # Seconds between stats lines and quality decisions
+LAG_DROP_RATIO = 0.2        # Encoder is behind when more than this share of frames is dropped
+RECOVER_DROP_RATIO = 0.02   # ...and keeping up when drops stay below this share
+CPU_HIGH = 0.85             # Encoder CPU, as a share of all cores, that counts as overloaded
+CPU_LOW = 0.5               # ...and that leaves headroom to step up
+MIN_SPEED = 0.95            # FFmpeg slower than real time (encoder or uplink cannot keep up)
+DOWN_WINDOWS = 2            # Unhealthy intervals in a row before stepping down the ladder
+UP_WINDOWS = 6              # Healthy intervals in a row before stepping up
+DECISION_LOG = os.environ.get("STREAM_DECISION_LOG", "stream_decisions.jsonl")
+
+# Quality ladder, best first: width, height, FPS, bitrate (kbit/s). The encoder scales the
+# captured frames down to the rung size. Override with STREAM_LADDER='[[940, 480, 60, 3000], ...]'
+LADDER = [
+    (940, 480, 60, 3000),
+    (940, 480, 30, 1800),
+    (640, 326, 30, 1000),
+    (480, 244, 20, 500),
+    (320, 164, 15, 250),
+]
+
+# Codec-specific flags; rate control (-b:v/-maxrate/-bufsize) is common to all
+ENCODER_OPTIONS = {
+    "libx264": ["-preset", "veryfast", "-tune", "zerolatency"],
+    "h264_v4l2m2m": [],   # Raspberry Pi hardware encoder
+    "h264_omx": [],
+}
 
 # --- Detect Headless Environment ---
 if not os.environ.get("DISPLAY"):
@@ -35,132 +88,801 @@ def get_local_ip():
         s.close()
     return ip
 
+# --- Frame Ring ---
+class FrameRing:
+    """
+    Fixed set of preallocated frame buffers. The capture side decodes straight into a
+    free slot and publishes it; the writer hands the slot's memoryview to FFmpeg and
+    returns it. No per-frame allocation or copy: only slot indices move between threads.
+
+    Latest frame wins: at most one frame waits for the encoder. Publishing a newer one
+    recycles the waiting frame and counts it as dropped, so the encoder never works
+    through a backlog of stale frames.
+    """
+
+    def __init__(self, slots, width, height, channels=3):
+        self.frames = np.empty((slots, height, width, channels), dtype=np.uint8)
+        self.views = [memoryview(self.frames[i]).cast('B') for i in range(slots)]
+        self.shape = (height, width, channels)
+        self.stamps = [0.0] * slots  # monotonic capture time of each slot's frame
+        self._free = deque(range(slots))
+        self._ready = None
+        self._cond = threading.Condition()
+
+    def acquire(self):
+        """Free slot index to capture into, or None if the writer still holds every slot."""
+        with self._cond:
+            return self._free.popleft() if self._free else None
+
+    def publish(self, slot, stamp):
+        """Hands a captured frame to the writer. Returns True if it replaced an unencoded frame."""
+        with self._cond:
+            self.stamps[slot] = stamp
+            replaced = self._ready
+            if replaced is not None:
+                self._free.append(replaced)
+            self._ready = slot
+            self._cond.notify()
+        return replaced is not None
+
+    def take(self, timeout=None):
+        """Newest published slot index, or None after timeout."""
+        with self._cond:
+            if self._ready is None and not self._cond.wait_for(lambda: self._ready is not None, timeout):
+                return None
+            slot, self._ready = self._ready, None
+            return slot
+
+    def release(self, slot):
+        with self._cond:
+            self._free.append(slot)
+
+    def read_into(self, cap, slot):
+        """cap.read() decoding into the slot; falls back to one copy if OpenCV allocated its own frame."""
+        target = self.frames[slot]
+        ret, frame = cap.read(target)
+        if ret and frame is not None and frame.ctypes.data != target.ctypes.data:
+            if frame.shape != self.shape:
+                return False
+            np.copyto(target, frame)
+        return ret
+
+
+class StreamStats:
+    """Frame counters shared by the capture and writer threads, with per-interval windows."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.captured = 0
+        self.encoded = 0
+        self.dropped = 0
+        self._window = self._empty_window()
+        self._window_started = time.monotonic()
+
+    @staticmethod
+    def _empty_window():
+        return {'captured': 0, 'encoded': 0, 'dropped': 0, 'queue_age': 0.0, 'write_time': 0.0}
+
+    def frame_captured(self, replaced):
+        with self._lock:
+            self.captured += 1
+            self._window['captured'] += 1
+            if replaced:
+                self.dropped += 1
+                self._window['dropped'] += 1
+
+    def frame_encoded(self, queue_age, write_time):
+        with self._lock:
+            self.encoded += 1
+            self._window['encoded'] += 1
+            self._window['queue_age'] += queue_age
+            self._window['write_time'] += write_time
+
+    def due(self, now):
+        return now - self._window_started >= STATS_INTERVAL
+
+    def roll(self, now):
+        """Closes the current window and returns its rates and averages."""
+        with self._lock:
+            window, self._window = self._window, self._empty_window()
+            elapsed, self._window_started = now - self._window_started, now
+            totals = {'captured': self.captured, 'encoded': self.encoded, 'dropped': self.dropped}
+        encoded = window['encoded'] or 1
+        return {
+            **totals,
+            'capture_fps': window['captured'] / elapsed,
+            'encode_fps': window['encoded'] / elapsed,
+            'drop_ratio': window['dropped'] / window['captured'] if window['captured'] else 0.0,
+            'queue_age_ms': window['queue_age'] / encoded * 1000,
+            'encoder_lag_ms': window['write_time'] / encoded * 1000,
+        }
+
+
+class CaptureThrottle:
+    """Paces the frames handed to the encoder at the current ladder rung's frame rate."""
+
+    def __init__(self, fps):
+        self.fps = fps
+        self._next_due = 0.0
+
+    def due(self, now):
+        if now < self._next_due:
+            return False
+        # Schedule from the ideal time so camera jitter does not pull the rate below target
+        period = 1.0 / self.fps
+        self._next_due = max(self._next_due, now - period / 2) + period
+        return True
+
+
+def print_stats(name, window, fps):
+    print(f"📊 [{name}] captured={window['captured']} encoded={window['encoded']} dropped={window['dropped']} | "
+          f"{window['capture_fps']:.1f}/{window['encode_fps']:.1f} FPS in/out (target {fps}), "
+          f"drop {window['drop_ratio']:.0%}, queue age {window['queue_age_ms']:.1f} ms, "
+          f"encoder lag {window['encoder_lag_ms']:.1f} ms")
+
+
+def write_all(pipe, view):
+    """Writes a memoryview to an unbuffered pipe, resuming after partial writes without copying."""
+    while view:
+        written = pipe.write(view)
+        view = view[written:]
+
+
 # --- FFmpeg Writer ---
-def ffmpeg_writer(ffmpeg_process, frame_queue, stop_event):
+def ffmpeg_writer(name, ffmpeg_process, ring, stats, stop_event):
     while not stop_event.is_set():
+        slot = None
         try:
             if ffmpeg_process.poll() is not None:
-                print("❌ FFmpeg process exited.")
+                print(f"❌ [{name}] FFmpeg process exited.")
                 break
 
-            frame = frame_queue.get(timeout=1.0)
-            if frame is None or frame.size == 0:
+            slot = ring.take(timeout=1.0)
+            if slot is None:
                 continue
-            ffmpeg_process.stdin.write(frame.tobytes())
-        except queue.Empty:
-            continue
+            started = time.monotonic()
+            write_all(ffmpeg_process.stdin, ring.views[slot])
+            stats.frame_encoded(started - ring.stamps[slot], time.monotonic() - started)
         except BrokenPipeError:
-            print("❌ FFmpeg pipe broken.")
+            print(f"❌ [{name}] FFmpeg pipe broken.")
             break
         except Exception as e:
-            print(f"⚠️ FFmpeg write error: {e}")
+            print(f"⚠️ [{name}] FFmpeg write error: {e}")
             time.sleep(0.1)
+        finally:
+            if slot is not None:
+                ring.release(slot)
 
 # --- FFmpeg Log Reader ---
-def log_ffmpeg_errors(proc):
+def log_ffmpeg_errors(name, proc):
     for line in iter(proc.stderr.readline, b''):
-        print("FFmpeg:", line.decode(errors="ignore"), end='')
+        print(f"FFmpeg [{name}]:", line.decode(errors="ignore"), end='')
 
-# --- Streaming ---
-def stream_camera():
-    local_ip = get_local_ip()
-    print(f"\n📡 WebRTC Stream Ready!")
-    print(f"▶️ Open in browser: http://{local_ip}:8889/{MEDIA_NAME}\n")
-
-    frame_queue = queue.Queue(maxsize=10)
-    stop_event = threading.Event()
+# --- Encoder ---
+def load_ladder():
+    raw = os.environ.get("STREAM_LADDER")
+    ladder = [tuple(int(v) for v in rung) for rung in json.loads(raw)] if raw else list(LADDER)
+    for width, height, fps, kbps in ladder:
+        if width % 2 or height % 2 or fps <= 0 or kbps <= 0:
+            raise ValueError(f"Invalid ladder rung {width}x{height}@{fps} {kbps}k (sizes must be even)")
+    return ladder
 
-    while True:
-        cap = cv2.VideoCapture(CAMERA_INDEX)
-        if not cap.isOpened():
-            print(f"❌ Failed to open camera. Retrying in 2s...")
-            time.sleep(2)
-            continue
-
-        cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
-        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
-        cap.set(cv2.CAP_PROP_FPS, FRAME_RATE)
 
-        actual_width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
-        actual_height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+class Encoder:
+    """One FFmpeg process encoding ring frames at a ladder rung, with its writer, log and progress readers."""
 
-        print(f"📷 Camera opened at {actual_width}x{actual_height}, {FRAME_RATE} FPS")
+    def __init__(self, name, ring, stats, rung, output_url):
+        self.name = name
+        self.ring = ring
+        self.stats = stats
+        self.rung = rung
+        self.output_url = output_url
+        self.process = None
+        self._stop_event = threading.Event()
+        self._threads = []
+        self._progress = {}
+        self._last_sample = None
 
-        ffmpeg_cmd = [
+    def command(self):
+        height, width, _ = self.ring.shape
+        out_width, out_height, fps, kbps = self.rung
+        return [
             FFMPEG_PATH,
+            "-nostats", "-progress", "pipe:1",
             "-f", "rawvideo",
             "-pix_fmt", "bgr24",
-            "-s", f"{actual_width}x{actual_height}",
-            "-r", str(FRAME_RATE),
+            "-s", f"{width}x{height}",
+            # Frames are stamped on arrival, so a throttled capture rate keeps real-time playback
+            "-use_wallclock_as_timestamps", "1",
             "-i", "pipe:0",
+            "-vsync", "0",
             "-an",
-            "-vf", "format=yuv420p",
+            "-vf", f"scale={out_width}:{out_height},format=yuv420p",
             "-c:v", VIDEO_CODEC,
-            "-preset", "veryfast",
-            "-tune", "zerolatency",
-            "-g", "15",
-            "-keyint_min", "15",
+            *ENCODER_OPTIONS.get(VIDEO_CODEC, []),
+            "-b:v", f"{kbps}k",
+            "-maxrate", f"{kbps}k",
+            "-bufsize", f"{kbps // 2}k",  # ~0.5 s of video keeps latency low
+            "-g", str(max(1, fps // 4)),
+            "-keyint_min", str(max(1, fps // 4)),
             "-mpegts_flags", "resend_headers",
             "-bsf:v", "h264_mp4toannexb",
             "-f", "mpegts",
-            f"udp://{RTP_ADDRESS}:{RTP_PORT}?pkt_size=1316"
+            self.output_url
         ]
 
-        ffmpeg_process = subprocess.Popen(
-            ffmpeg_cmd,
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command(),
             stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
             stderr=subprocess.PIPE,
             bufsize=0
         )
+        self._threads = [
+            threading.Thread(target=ffmpeg_writer, args=(self.name, self.process, self.ring, self.stats, self._stop_event),
+                             name=f"{self.name}-writer", daemon=True),
+            threading.Thread(target=log_ffmpeg_errors, args=(self.name, self.process), name=f"{self.name}-log", daemon=True),
+            threading.Thread(target=self._read_progress, name=f"{self.name}-progress", daemon=True),
+        ]
+        for thread in self._threads:
+            thread.start()
+        width, height, fps, kbps = self.rung
+        print(f"🎥 [{self.name}] Encoder started at {width}x{height}, {fps} FPS, {kbps} kbit/s ({VIDEO_CODEC})")
 
-        writer_thread = threading.Thread(target=ffmpeg_writer, args=(ffmpeg_process, frame_queue, stop_event))
-        writer_thread.start()
+    def alive(self):
+        return self.process is not None and self.process.poll() is None
 
-        log_thread = threading.Thread(target=log_ffmpeg_errors, args=(ffmpeg_process,))
-        log_thread.start()
+    def _read_progress(self):
+        # -progress writes key=value blocks, each closed by a progress=continue|end line
+        block = {}
+        for line in iter(self.process.stdout.readline, b''):
+            key, _, value = line.decode(errors="ignore").strip().partition('=')
+            block[key] = value
+            if key == 'progress':
+                self._progress, block = block, {}
 
-        print("🎥 Streaming... Press Ctrl+C to stop.")
-        time.sleep(2)
+    def _cpu_seconds(self):
+        try:
+            with open(f"/proc/{self.process.pid}/stat") as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+        except (OSError, IndexError, ValueError):
+            return None
 
+    def sample(self):
+        """Output bitrate, CPU share of all cores and encoding speed since the previous sample."""
+        now = time.monotonic()
+        progress = self._progress
         try:
-            while True:
-                ret, frame = cap.read()
-                if not ret:
-                    print("⚠️ Frame read failed. Restarting camera...")
-                    cap.release()
-                    break
+            total_size = int(progress.get('total_size', 0))
+        except ValueError:
+            total_size = 0
+        try:
+            speed = float(progress.get('speed', '').rstrip('x'))
+        except ValueError:
+            speed = None
+        cpu_seconds = self._cpu_seconds()
 
-                if SHOW_CAMERA_FEED:
-                    cv2.imshow("Preview", frame)
-                    if cv2.waitKey(1) & 0xFF == ord('q'):
-                        raise KeyboardInterrupt
+        previous, self._last_sample = self._last_sample, (now, total_size, cpu_seconds)
+        if previous is None:
+            return {'output_kbps': None, 'cpu': None, 'speed': speed}
+        elapsed = max(now - previous[0], 1e-6)
+        cpu = None
+        if cpu_seconds is not None and previous[2] is not None:
+            cpu = (cpu_seconds - previous[2]) / elapsed / (os.cpu_count() or 1)
+        return {
+            'output_kbps': (total_size - previous[1]) * 8 / elapsed / 1000,
+            'cpu': cpu,
+            'speed': speed,
+        }
 
-                if not frame_queue.full():
-                    frame_queue.put_nowait(frame)
-        except KeyboardInterrupt:
-            print("🛑 Stopping stream...")
-            break
+    def stop(self):
+        self._stop_event.set()
+        if self.process:
+            try:
+                self.process.stdin.close()
+                self.process.wait(timeout=5)
+            except Exception:
+                self.process.kill()
+        for thread in self._threads:
+            thread.join(timeout=5)
+
+
+class AdaptiveController:
+    """
+    Steps the stream along the quality ladder from the encoder's CPU share, its speed
+    against real time and the frame drop ratio. Every evaluation is appended to
+    DECISION_LOG as one JSON line for later analysis.
+    """
+
+    def __init__(self, name, ladder, log_path=DECISION_LOG):
+        self.name = name
+        self.ladder = ladder
+        self.index = 0
+        self._log_path = log_path
+        self._unhealthy = 0
+        self._healthy = 0
+
+    @property
+    def rung(self):
+        return self.ladder[self.index]
+
+    def decide(self, window, sample):
+        """New ladder index to switch to, or None to keep the current rung."""
+        cpu, speed = sample['cpu'], sample['speed']
+        reasons = []
+        if window['drop_ratio'] > LAG_DROP_RATIO:
+            reasons.append(f"drop ratio {window['drop_ratio']:.0%}")
+        if cpu is not None and cpu > CPU_HIGH:
+            reasons.append(f"encoder CPU {cpu:.0%}")
+        if speed is not None and speed < MIN_SPEED:
+            reasons.append(f"speed {speed:.2f}x")
+
+        healthy = (not reasons and window['drop_ratio'] < RECOVER_DROP_RATIO
+                   and (cpu is None or cpu < CPU_LOW))
+        self._unhealthy = self._unhealthy + 1 if reasons else 0
+        self._healthy = self._healthy + 1 if healthy else 0
+
+        action, target = 'hold', None
+        if self._unhealthy >= DOWN_WINDOWS and self.index < len(self.ladder) - 1:
+            action, target = 'down', self.index + 1
+        elif self._healthy >= UP_WINDOWS and self.index > 0:
+            action, target = 'up', self.index - 1
+            reasons.append("sustained headroom")
+
+        self._log(action, target, reasons, window, sample)
+        if target is None:
+            return None
+        self.index = target
+        self._unhealthy = self._healthy = 0
+        width, height, fps, kbps = self.rung
+        print(f"🎚️ [{self.name}] Quality {action} to {width}x{height}, {fps} FPS, {kbps} kbit/s: {', '.join(reasons)}")
+        return target
+
+    def _log(self, action, target, reasons, window, sample):
+        entry = {
+            'time': time.time(),
+            'camera': self.name,
+            'action': action,
+            'rung': list(self.rung),
+            'target': list(self.ladder[target]) if target is not None else None,
+            'reasons': reasons,
+            'capture_fps': round(window['capture_fps'], 2),
+            'encode_fps': round(window['encode_fps'], 2),
+            'drop_ratio': round(window['drop_ratio'], 4),
+            'encoder_lag_ms': round(window['encoder_lag_ms'], 2),
+            'output_kbps': None if sample['output_kbps'] is None else round(sample['output_kbps'], 1),
+            'cpu': None if sample['cpu'] is None else round(sample['cpu'], 3),
+            'speed': sample['speed'],
+        }
+        try:
+            with open(self._log_path, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+        except OSError as e:
+            print(f"⚠️ Could not write decision log: {e}")
+
+# --- Frame Sources ---
+class SyntheticSource:
+    """
+    Stand-in for cv2.VideoCapture that paints a moving bar at a fixed rate, for running
+    and testing the pipeline without a camera. fail_after makes read() fail after that
+    many frames, to exercise capture restarts.
+    """
+
+    def __init__(self, width=640, height=360, fps=30, fail_after=None):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.fail_after = fail_after
+        self._frames = 0
+        self._next_frame = time.monotonic()
+        self._opened = True
+
+    @classmethod
+    def from_device(cls, device):
+        """Parses "synthetic" or "synthetic:WxH@FPS"."""
+        _, _, spec = device.partition(':')
+        if not spec:
+            return cls()
+        size, _, fps = spec.partition('@')
+        width, height = (int(v) for v in size.split('x'))
+        return cls(width, height, int(fps or 30))
+
+    def isOpened(self):
+        return self._opened
+
+    def set(self, prop, value):
+        return False
+
+    def get(self, prop):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            return self.width
+        if prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            return self.height
+        if prop == cv2.CAP_PROP_FPS:
+            return self.fps
+        return 0
+
+    def grab(self):
+        if not self._opened or (self.fail_after is not None and self._frames >= self.fail_after):
+            return False
+        # Deliver frames at the source rate, like a camera does
+        delay = self._next_frame - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        self._next_frame = max(self._next_frame + 1.0 / self.fps, time.monotonic())
+        self._frames += 1
+        return True
+
+    def read(self, image=None):
+        if not self.grab():
+            return False, None
+        if image is None or image.shape != (self.height, self.width, 3):
+            image = np.empty((self.height, self.width, 3), dtype=np.uint8)
+        image.fill(40)
+        bar = (self._frames * 8) % self.width
+        image[:, bar:bar + 16] = (0, 200, 255)
+        return True, image
+
+    def release(self):
+        self._opened = False
+
+
+def open_source(device):
+    if str(device).startswith("synthetic"):
+        return SyntheticSource.from_device(device)
+    return cv2.VideoCapture(device)
+
+
+class Backoff:
+    """Restart delay per component: doubles on each failure, starts over once the component ran stably."""
+
+    def __init__(self):
+        self.delay = RESTART_BACKOFF
+        self._next_attempt = 0.0
+        self._started = None
+
+    def ready(self, now):
+        return now >= self._next_attempt
+
+    def started(self, now):
+        self._started = now
+
+    def failed(self, now):
+        if self._started is not None and now - self._started >= STABLE_AFTER:
+            self.delay = RESTART_BACKOFF
+        delay = self.delay
+        self._next_attempt = now + delay
+        self.delay = min(MAX_RESTART_BACKOFF, self.delay * 2)
+        self._started = None
+        return delay
+
+
+# --- Camera Pipeline ---
+class CameraPipeline:
+    """
+    One camera: a capture thread filling the frame ring, an Encoder (writer, log and
+    progress threads) and a monitor thread. The monitor restarts only the part that
+    failed, with backoff, and drives the quality ladder.
+    """
+
+    def __init__(self, name, device, output_url, ladder):
+        self.name = name
+        self.device = device
+        self.output_url = output_url
+        self.state = 'starting'
+        self.restarts = {'capture': 0, 'encoder': 0, 'analytics': 0}
+        self.last_error = None
+        self.stats = StreamStats()
+        self.controller = AdaptiveController(name, ladder)
+        self.throttle = CaptureThrottle(self.controller.rung[2])
+        self.ring = None
+        self.encoder = None
+        self.analytics = None
+        self.last_window = None
+        self.last_slot = None
+        self._cap = None
+        self._capture_error = None
+        self._capture_thread = None
+        self._monitor_thread = None
+        self._stop_event = threading.Event()
+        self._capture_backoff = Backoff()
+        self._encoder_backoff = Backoff()
+        self._analytics_backoff = Backoff()
+        self._started_at = time.monotonic()
+
+    def start(self):
+        self._monitor_thread = threading.Thread(target=self._monitor, name=f"{self.name}-monitor", daemon=True)
+        self._monitor_thread.start()
+
+    def stop(self):
+        self._stop_event.set()
+        if self._monitor_thread:
+            self._monitor_thread.join(timeout=10)
+        if self._capture_thread:
+            self._capture_thread.join(timeout=5)
+        if self.encoder:
+            self.encoder.stop()
+        if self.analytics:
+            self.analytics.stop()
+
+    def _failed(self, component, backoff, error):
+        self.restarts[component] += 1
+        self.last_error = f"{component}: {error}"
+        delay = backoff.failed(time.monotonic())
+        self.state = 'restarting'
+        print(f"⚠️ [{self.name}] {error}. Restarting {component} in {delay:.0f}s...")
+
+    def _open_camera(self):
+        """Opens the source and sizes the ring to it. Returns False if the camera is unavailable."""
+        cap = open_source(self.device)
+        if not cap.isOpened():
+            cap.release()
+            return False
+        cap.set(cv2.CAP_PROP_FRAME_WIDTH, FRAME_WIDTH)
+        cap.set(cv2.CAP_PROP_FRAME_HEIGHT, FRAME_HEIGHT)
+        cap.set(cv2.CAP_PROP_FPS, FRAME_RATE)
+        width = int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        height = int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        print(f"📷 [{self.name}] Camera {self.device} opened at {width}x{height}")
+
+        # Buffers sized to what the camera actually delivers; kept across reopens of the same size
+        if self.ring is None or self.ring.shape != (height, width, 3):
+            if self.encoder:
+                self.encoder.stop()
+                self.encoder = None
+            self.ring = FrameRing(RING_SLOTS, width, height)
+            if self.analytics:
+                old, self.analytics = self.analytics, None
+                old.stop()
+        self._cap = cap
+        return True
+
+    def _capture(self, cap):
+        ring, stats, throttle = self.ring, self.stats, self.throttle
+        try:
+            while not self._stop_event.is_set():
+                slot = ring.acquire() if throttle.due(time.monotonic()) else None
+                if slot is None:
+                    # Not due, or the encoder holds every buffer: grab and discard so the camera does not stall
+                    ret = cap.grab()
+                else:
+                    ret = ring.read_into(cap, slot)
+                if not ret:
+                    if slot is not None:
+                        ring.release(slot)
+                    self._capture_error = "frame read failed"
+                    return
+                if slot is not None:
+                    self.last_slot = slot
+                    stamp = time.monotonic()
+                    analytics = self.analytics
+                    if analytics is not None:
+                        # Copies only every Nth frame, before the slot can be recycled
+                        analytics.offer(ring.frames[slot], stamp)
+                    stats.frame_captured(ring.publish(slot, stamp))
         except Exception as e:
-            print(f"❌ Runtime error: {e}")
+            self._capture_error = str(e)
         finally:
             cap.release()
-            stop_event.set()
-            if writer_thread:
-                writer_thread.join()
-            if log_thread:
-                log_thread.join()
-            if ffmpeg_process:
-                try:
-                    ffmpeg_process.stdin.close()
-                    ffmpeg_process.wait(timeout=5)
-                except Exception:
-                    ffmpeg_process.kill()
-            print("♻️ Restarting stream loop...")
-
-    cv2.destroyAllWindows()
-    print("✅ Stream closed.")
+
+    def _start_encoder(self):
+        self.encoder = Encoder(self.name, self.ring, self.stats, self.controller.rung, self.output_url)
+        self.throttle.fps = self.controller.rung[2]
+        try:
+            self.encoder.start()
+        except OSError as e:
+            self.encoder = None
+            raise RuntimeError(f"FFmpeg failed to start: {e}")
+
+    def _monitor(self):
+        while not self._stop_event.is_set():
+            now = time.monotonic()
+
+            # Capture: reopen the camera only
+            if (self._capture_thread is None or not self._capture_thread.is_alive()) and self._capture_backoff.ready(now):
+                if self._capture_thread is not None:
+                    self._capture_thread = None
+                    self._failed('capture', self._capture_backoff, self._capture_error or "capture stopped")
+                elif self._open_camera():
+                    self._capture_error = None
+                    self._capture_thread = threading.Thread(target=self._capture, args=(self._cap,),
+                                                            name=f"{self.name}-capture", daemon=True)
+                    self._capture_thread.start()
+                    self._capture_backoff.started(now)
+                else:
+                    self._failed('capture', self._capture_backoff, f"failed to open camera {self.device}")
+
+            # Encoder: restart FFmpeg only; capture keeps filling the ring meanwhile
+            if self.ring is not None and self._encoder_backoff.ready(now):
+                if self.encoder is not None and not self.encoder.alive():
+                    self.encoder.stop()
+                    self.encoder = None
+                    self._failed('encoder', self._encoder_backoff, "encoder exited")
+                elif self.encoder is None:
+                    try:
+                        self._start_encoder()
+                        self._encoder_backoff.started(now)
+                    except RuntimeError as e:
+                        self._failed('encoder', self._encoder_backoff, str(e))
+
+            # Analytics: its own process, restarted on its own; never holds up capture or encoding
+            if ANALYTICS_EVERY and self.ring is not None and self._analytics_backoff.ready(now):
+                if self.analytics is not None and not self.analytics.alive():
+                    dead, self.analytics = self.analytics, None
+                    dead.stop()
+                    self._failed('analytics', self._analytics_backoff, "frame analytics exited")
+                elif self.analytics is None:
+                    height, width, _ = self.ring.shape
+                    analytics = AnalyticsWorker(self.name, width, height, ANALYTICS_EVERY)
+                    analytics.start()
+                    self.analytics = analytics
+                    self._analytics_backoff.started(now)
+
+            # Quality ladder: a rung change restarts the encoder without counting as a failure
+            if self.stats.due(now):
+                self.last_window = self.stats.roll(now)
+                print_stats(self.name, self.last_window, self.throttle.fps)
+                if self.encoder is not None and self.encoder.alive():
+                    if self.controller.decide(self.last_window, self.encoder.sample()) is not None:
+                        self.encoder.stop()
+                        try:
+                            self._start_encoder()
+                        except RuntimeError as e:
+                            self._failed('encoder', self._encoder_backoff, str(e))
+
+            capture_ok = self._capture_thread is not None and self._capture_thread.is_alive()
+            if capture_ok and self.encoder is not None and self.encoder.alive():
+                self.state = 'running'
+            self._stop_event.wait(0.5)
+        self.state = 'stopped'
+
+    def status(self):
+        width, height, fps, kbps = self.controller.rung
+        return {
+            'name': self.name,
+            'device': str(self.device),
+            'output': self.output_url,
+            'state': self.state,
+            'uptime_s': round(time.monotonic() - self._started_at, 1),
+            'rung': {'width': width, 'height': height, 'fps': fps, 'kbps': kbps},
+            'capture_alive': self._capture_thread is not None and self._capture_thread.is_alive(),
+            'encoder_alive': self.encoder is not None and self.encoder.alive(),
+            'restarts': dict(self.restarts),
+            'last_error': self.last_error,
+            'frames': {'captured': self.stats.captured, 'encoded': self.stats.encoded, 'dropped': self.stats.dropped},
+            'window': self.last_window,
+            'vision': self.analytics.latest if self.analytics else None,
+            'analytics_skipped': self.analytics.skipped if self.analytics else 0,
+        }
+
+
+# --- Supervisor ---
+class StreamSupervisor:
+    """Runs every camera pipeline in parallel and serves their status as JSON on GET /status."""
+
+    def __init__(self, pipelines, status_port=STATUS_PORT):
+        self.pipelines = pipelines
+        self.status_port = status_port
+        self._server = None
+
+    def start(self):
+        for pipeline in self.pipelines:
+            pipeline.start()
+        if self.status_port:
+            supervisor = self
+
+            class StatusHandler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.rstrip('/') not in ('', '/status'):
+                        self.send_error(404)
+                        return
+                    body = json.dumps(supervisor.status()).encode()
+                    self.send_response(200)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer(("0.0.0.0", self.status_port), StatusHandler)
+            threading.Thread(target=self._server.serve_forever, name="status-server", daemon=True).start()
+            print(f"🩺 Stream status at http://{get_local_ip()}:{self.status_port}/status")
+        if ANALYTICS_EVERY and TELEMETRY_URL and DRONE_ID:
+            if not VISION_PUSH_TOKEN:
+                print("⚠️ VISION_PUSH_TOKEN is not set; drone_monitering will reject vision pushes")
+            threading.Thread(target=self._push_vision, name="vision-push", daemon=True).start()
+
+    def _push_vision(self):
+        """Posts the latest analytics of every camera to drone_monitering, next to the drone's parameters."""
+        url = f"{TELEMETRY_URL.rstrip('/')}/api/drone-vision/{DRONE_ID}"
+        while True:
+            time.sleep(STATS_INTERVAL)
+            cameras = {p.name: p.analytics.latest for p in self.pipelines if p.analytics and p.analytics.latest}
+            if not cameras:
+                continue
+            headers = {'Content-Type': 'application/json'}
+            if VISION_PUSH_TOKEN:
+                headers['Authorization'] = f"Bearer {VISION_PUSH_TOKEN}"
+            request = urllib.request.Request(url, data=json.dumps({'cameras': cameras}).encode(),
+                                             headers=headers, method='POST')
+            try:
+                urllib.request.urlopen(request, timeout=3).close()
+            except OSError as e:
+                print(f"⚠️ Vision telemetry push failed: {e}")
+
+    def status(self):
+        pipelines = [pipeline.status() for pipeline in self.pipelines]
+        return {
+            'healthy': all(p['state'] == 'running' for p in pipelines),
+            'pipelines': pipelines,
+        }
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+        for pipeline in self.pipelines:
+            pipeline.stop()
+
+    def run(self):
+        """Blocks until Ctrl+C; shows the first camera's preview when a display is available."""
+        self.start()
+        print("🎥 Streaming... Press Ctrl+C to stop.")
+        try:
+            while True:
+                pipeline = self.pipelines[0]
+                if SHOW_CAMERA_FEED and pipeline.ring is not None and pipeline.last_slot is not None:
+                    cv2.imshow("Preview", pipeline.ring.frames[pipeline.last_slot])
+                    if cv2.waitKey(100) & 0xFF == ord('q'):
+                        break
+                else:
+                    time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        print("🛑 Stopping streams...")
+        self.stop()
+        cv2.destroyAllWindows()
+        print("✅ Streams closed.")
+
+
+def load_cameras():
+    raw = os.environ.get("STREAM_CAMERAS")
+    return json.loads(raw) if raw else list(CAMERAS)
+
+
+def build_pipelines(cameras, ladder):
+    pipelines = []
+    for index, camera in enumerate(cameras):
+        port = camera.get("port", RTP_PORT + index)
+        output_url = f"udp://{RTP_ADDRESS}:{port}?pkt_size=1316"
+        pipelines.append(CameraPipeline(camera.get("name", f"camera{index}"), camera["device"], output_url, ladder))
+    return pipelines
+
+
+# --- Streaming ---
+def stream_camera(cameras=None, status_port=STATUS_PORT):
+    local_ip = get_local_ip()
+    print(f"\n📡 WebRTC Stream Ready!")
+    for camera in cameras or load_cameras():
+        print(f"▶️ Open in browser: http://{local_ip}:8889/{camera.get('name', MEDIA_NAME)}")
+    print()
+
+    supervisor = StreamSupervisor(build_pipelines(cameras or load_cameras(), load_ladder()), status_port)
+    supervisor.run()
 
 # --- Entry Point ---
 if __name__ == "__main__":
-    stream_camera()
+    parser = argparse.ArgumentParser(description="Stream drone cameras to the media server")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N",
+                        help="stream N synthetic test sources instead of the configured cameras")
+    parser.add_argument("--status-port", type=int, default=STATUS_PORT, help="0 disables the status endpoint")
+    args = parser.parse_args()
+
+    cameras = None
+    if args.synthetic:
+        cameras = [{"name": f"synthetic{i}", "device": "synthetic:640x360@30", "port": RTP_PORT + i}
+                   for i in range(args.synthetic)]
+    stream_camera(cameras, args.status_port)
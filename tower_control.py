@@ -1,8 +1,15 @@
 import os
 import psycopg2
+import psycopg2.errors
 import psycopg2.extras
 from flask import Flask, request, jsonify, render_template
 from flask_cors import CORS
+import db
+import deconfliction
+import dispatch
+import route_planner
+from auth_tokens import protect_app
+from change_bus import ChangeBus
 import datetime
 import uuid
 import logging
@@ -10,9 +17,12 @@ import random
 import requests
 import time
 from threading import Thread
+from change_log import install_change_log, parse_cursor, current_cursor, changed_keys_since, delta_payload, with_cursor_header, CursorExpired, expired_cursor_body
 
 app = Flask(__name__)
 CORS(app, origins="*", methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"], allow_headers=["Content-Type", "Authorization"])
+# Requires an access token (see auth_tokens.AUTH_ENFORCE)
+protect_app(app)
 
 DB_HOST = "localhost"
 DB_NAME = "shadowfly"
@@ -25,10 +35,12 @@ launch_status_tracker = {}
 email_sent_packages = set()
 # Global rack tracking for packages
 package_rack_mapping = {}
+# Corridors of launched missions, checked inline before every launch
+airspace = deconfliction.Airspace()
 
 def get_db_connection():
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -40,6 +52,78 @@ def get_db_connection():
         print(f"Database connection error: {e}")
         return None
 
+# OTPs are scoped to the tower holding the package and are single use.
+# Active (unconsumed) OTPs are unique per tower.
+OTP_SCOPE_DDL = """
+    ALTER TABLE public.customers ADD COLUMN IF NOT EXISTS ddt_name character varying(255);
+    ALTER TABLE public.customers ADD COLUMN IF NOT EXISTS otp_consumed_at timestamp with time zone;
+"""
+
+OTP_SCOPE_BACKFILL = """
+    UPDATE public.customers c SET ddt_name = d.name
+    FROM ddts d, jsonb_each_text(to_jsonb(d)) r
+    WHERE c.ddt_name IS NULL
+      AND r.key ~ '^rack_[0-9]+$'
+      AND r.value = c.package_id
+"""
+
+OTP_SCOPE_INDEX = """
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_customers_active_otp
+    ON public.customers (ddt_name, otp)
+    WHERE otp IS NOT NULL AND otp_consumed_at IS NULL
+"""
+
+# Called by the DDT terminal: consumes an OTP at a tower and clears the
+# package's rack in one statement. A second call for the same OTP returns no row.
+CONSUME_OTP_FUNCTION = """
+    CREATE OR REPLACE FUNCTION consume_otp(p_ddt_name TEXT, p_otp INTEGER)
+    RETURNS SETOF customers AS $$
+    DECLARE
+        consumed customers%ROWTYPE;
+    BEGIN
+        UPDATE customers c SET otp_consumed_at = CURRENT_TIMESTAMP
+        WHERE c.ddt_name = p_ddt_name AND c.otp = p_otp AND c.otp_consumed_at IS NULL
+        RETURNING c.* INTO consumed;
+        IF NOT FOUND THEN
+            RETURN;
+        END IF;
+        IF consumed.rack ~ '^rack_[0-9]+$' THEN
+            EXECUTE format('UPDATE ddts SET %I = NULL WHERE name = $1 AND %I = $2', consumed.rack, consumed.rack)
+            USING p_ddt_name, consumed.package_id;
+        END IF;
+        RETURN NEXT consumed;
+    END;
+    $$ LANGUAGE plpgsql;
+"""
+
+def install_otp_scope(conn):
+    """Adds tower-scoped, single-use OTP columns, index and consume_otp(). Safe to call on every startup."""
+    try:
+        with conn.cursor() as cur:
+            cur.execute(OTP_SCOPE_DDL)
+            cur.execute("SELECT to_regclass('ddts')")
+            if cur.fetchone()[0] is not None:
+                cur.execute(OTP_SCOPE_BACKFILL)
+                if cur.rowcount:
+                    print(f"Backfilled ddt_name for {cur.rowcount} customers")
+            cur.execute(CONSUME_OTP_FUNCTION)
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"❌ Error adding OTP scope columns: {e}")
+        conn.rollback()
+        return False
+    
+    try:
+        with conn.cursor() as cur:
+            cur.execute(OTP_SCOPE_INDEX)
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        # Usually duplicate active OTPs at one tower from before scoping; they clear as packages are picked up
+        print(f"❌ Error creating active OTP index: {e}")
+        conn.rollback()
+        return False
+
 def create_customers_table_if_not_exists():
     """Create customers table if it doesn't exist"""
     try:
@@ -66,11 +150,18 @@ def create_customers_table_if_not_exists():
         
         ALTER TABLE IF EXISTS public.customers
             OWNER to postgres;
+        
+        -- Rack occupants are looked up by package (DDT tower details)
+        CREATE INDEX IF NOT EXISTS idx_customers_package_id ON public.customers (package_id);
         """
         
         cursor.execute(create_table_query)
         conn.commit()
         cursor.close()
+        install_change_log(conn)
+        install_otp_scope(conn)
+        route_planner.install_routes(conn)
+        deconfliction.install_airspace(conn)
         conn.close()
         
         print("✅ Customers table created/verified successfully")
@@ -79,8 +170,22 @@ def create_customers_table_if_not_exists():
     except Exception as e:
         print(f"❌ Error creating customers table: {e}")
         return False
-    
+
+def load_airspace():
+    """Books the corridors of missions already in flight, so they survive restarts"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        print(f"Airspace: {airspace.load(conn)} missions in flight")
+    except Exception as e:
+        print(f"Error loading missions in flight: {e}")
+    finally:
+        conn.close()
+
+# At import, so the setup also runs when the service is mounted by gateway.py
 create_customers_table_if_not_exists()
+load_airspace()
 
 def update_drone_source_coordinates(conn, drone_id, source_lat, source_lng):
     """Updates the source coordinates in the dronesdata table."""
@@ -143,19 +248,31 @@ def update_ddt_rack_with_package(conn, package_id, ddt_name, rack_column):
         print(f"Error updating DDT rack: {e}")
         return False
 
-def update_customer_otp(conn, package_id, otp):
-    """Update customer OTP in database"""
-    try:
-        with conn.cursor() as cur:
-            cur.execute("""
-                UPDATE customers SET otp = %s WHERE package_id = %s
-            """, (otp, package_id))
-            rows_affected = cur.rowcount
-            print(f"Updated OTP for package {package_id}. Rows affected: {rows_affected}")
-            return rows_affected > 0
-    except psycopg2.Error as e:
-        print(f"Error updating customer OTP: {e}")
-        return False
+def update_customer_otp(conn, package_id, ddt_name, attempts=10):
+    """Assign a fresh OTP for the package at ddt_name, retrying on collision with another active OTP there.
+    Returns the OTP, or None on failure."""
+    for _ in range(attempts):
+        otp = generate_otp()
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SAVEPOINT assign_otp")
+                cur.execute("""
+                    UPDATE customers SET otp = %s, ddt_name = COALESCE(%s, ddt_name), otp_consumed_at = NULL
+                    WHERE package_id = %s
+                """, (otp, ddt_name, package_id))
+                rows_affected = cur.rowcount
+                cur.execute("RELEASE SAVEPOINT assign_otp")
+                print(f"Updated OTP for package {package_id}. Rows affected: {rows_affected}")
+                return otp if rows_affected > 0 else None
+        except psycopg2.errors.UniqueViolation:
+            with conn.cursor() as cur:
+                cur.execute("ROLLBACK TO SAVEPOINT assign_otp")
+            print(f"OTP collision at {ddt_name} for package {package_id}, retrying")
+        except psycopg2.Error as e:
+            print(f"Error updating customer OTP: {e}")
+            return None
+    print(f"Could not assign a unique OTP for package {package_id} after {attempts} attempts")
+    return None
 
 def update_customer_rack(conn, package_id, selected_rack):
     """Update customer rack information when package is delivered"""
@@ -185,6 +302,146 @@ def clear_ddt_rack(conn, ddt_name, rack_column):
         print(f"Error clearing DDT rack: {e}")
         return False
 
+def finish_delivery_stop(package_id, delivered):
+    """
+    Records delivery_time for a delivered package (the ETA history) and moves a
+    multi-stop drone on to its next stop, or home, once package_id's stop is done
+    """
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cursor:
+            if delivered:
+                cursor.execute("""
+                    UPDATE packagemanagement SET delivery_time = %s, last_update_time = %s
+                    WHERE package_id = %s AND (delivery_time IS NULL OR delivery_time = '')
+                """, (datetime.datetime.now().astimezone().isoformat(), datetime.datetime.now(), package_id))
+            next_stop = route_planner.complete_stop(cursor, package_id, delivered)
+        conn.commit()
+        if next_stop:
+            print(f"Route continues to {next_stop['ddt_name']} for package {next_stop['package_id']}")
+    except Exception as e:
+        print(f"Error finishing delivery stop for package {package_id}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def send_ddt_launch(package_id, control_key, ddt_name, rack_column, altitude_m=None):
+    """
+    Asks the DDT control server to launch the package at its deconflicted cruise altitude,
+    records the dispatch time and starts monitoring it; returns an error message or None
+    """
+    launch_payload = {
+        "package_id": package_id,
+        "ddt_name": ddt_name,
+        "rack_column": rack_column
+    }
+    if altitude_m is not None:
+        launch_payload["altitude_m"] = altitude_m
+    try:
+        response = requests.post(
+            f"{control_key}/launch",
+            json=launch_payload,
+            timeout=10,
+            headers={"Content-Type": "application/json"}
+        )
+    except requests.RequestException as e:
+        return f"Failed to communicate with DDT server: {str(e)}"
+    if response.status_code != 200:
+        return f"Launch failed: HTTP {response.status_code}"
+    mark_dispatched(package_id)
+    
+    # Initialize status tracking
+    launch_status_tracker[package_id] = "Processing"
+    
+    # Start background monitoring thread
+    monitor_thread = Thread(
+        target=monitor_delivery_status,
+        args=(package_id, control_key, ddt_name, rack_column),
+        daemon=True
+    )
+    monitor_thread.start()
+    return None
+
+def mark_dispatched(package_id):
+    """Sets dispatch_time once the launch command has actually been sent"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("""
+                UPDATE packagemanagement SET dispatch_time = %s, last_update_time = %s WHERE package_id = %s
+            """, (datetime.datetime.now(), datetime.datetime.now(), package_id))
+        conn.commit()
+    except psycopg2.Error as e:
+        print(f"Error recording dispatch time for package {package_id}: {e}")
+        conn.rollback()
+    finally:
+        conn.close()
+
+def schedule_launch(cursor, launch, drone_id, altitude_m, launch_at):
+    """Records a launch held back by deconfliction, so it survives a restart"""
+    package_id, control_key, ddt_name, rack_column = launch
+    cursor.execute("""
+        INSERT INTO scheduled_launches (package_id, drone_id, control_key, ddt_name, rack_column, altitude_m, launch_at)
+        VALUES (%s, %s, %s, %s, %s, %s, to_timestamp(%s))
+        ON CONFLICT (package_id) DO UPDATE SET drone_id = EXCLUDED.drone_id, control_key = EXCLUDED.control_key,
+            ddt_name = EXCLUDED.ddt_name, rack_column = EXCLUDED.rack_column,
+            altitude_m = EXCLUDED.altitude_m, launch_at = EXCLUDED.launch_at
+    """, (package_id, drone_id, control_key, ddt_name, rack_column, altitude_m, launch_at))
+
+def claim_scheduled_launch(package_id):
+    """
+    Removes package_id's scheduled launch; True when this process should send it. False when
+    it was cancelled (reset) or another worker already sent it
+    """
+    conn = get_db_connection()
+    if not conn:
+        print(f"Sending scheduled launch of package {package_id} without a database to claim it")
+        return True
+    try:
+        with conn.cursor() as cursor:
+            cursor.execute("DELETE FROM scheduled_launches WHERE package_id = %s", (package_id,))
+            claimed = cursor.rowcount > 0
+        conn.commit()
+        return claimed
+    except psycopg2.Error as e:
+        print(f"Error claiming scheduled launch of package {package_id}: {e}")
+        conn.rollback()
+        return False
+    finally:
+        conn.close()
+
+def delayed_ddt_launch(delay, drone_id, package_id, control_key, ddt_name, rack_column, altitude_m=None):
+    """Launches a package once its airspace delay has passed; drone_id is None for the later stops of a route"""
+    time.sleep(delay)
+    if not claim_scheduled_launch(package_id):
+        print(f"Scheduled launch of package {package_id} was cancelled or already sent")
+        return
+    error = send_ddt_launch(package_id, control_key, ddt_name, rack_column, altitude_m)
+    if error:
+        print(f"Scheduled launch of package {package_id} failed: {error}")
+        launch_status_tracker[package_id] = "Failed"
+        if drone_id:
+            airspace.release(drone_id)
+
+def reserve_stop_rack(conn, package_id, ddt_name):
+    """Puts package_id into the first free rack of ddt_name; returns (control_key, rack_column) or None"""
+    with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+        cur.execute("SELECT * FROM ddts WHERE name = %s FOR UPDATE", (ddt_name,))
+        ddt = cur.fetchone()
+    if not ddt or not ddt['control_key']:
+        return None
+    racks = dispatch.free_racks(ddt)
+    if not racks or not update_ddt_rack_with_package(conn, package_id, ddt_name, racks[0]):
+        return None
+    control_key = ddt['control_key'].strip()
+    if not control_key.startswith('http'):
+        control_key = f"https://{control_key}"
+    return control_key, racks[0]
+
 def monitor_delivery_status(package_id, control_key, ddt_name, rack_column):
     """Background thread to monitor delivery status"""
     print(f"Starting status monitoring for package {package_id}")
@@ -218,8 +475,8 @@ def monitor_delivery_status(package_id, control_key, ddt_name, rack_column):
                                     mail_id = result[0]
                                     
                                     # Generate and update OTP
-                                    otp = generate_otp()
-                                    if update_customer_otp(conn, package_id, otp):
+                                    otp = update_customer_otp(conn, package_id, ddt_name)
+                                    if otp:
                                         # Update customer rack information
                                         selected_rack = package_rack_mapping.get(package_id)
                                         if selected_rack:
@@ -261,6 +518,7 @@ def monitor_delivery_status(package_id, control_key, ddt_name, rack_column):
                                 conn.rollback()
                             finally:
                                 conn.close()
+                    finish_delivery_stop(package_id, delivered=True)
                     break  # Stop monitoring once delivered
                     
                 elif status == 'Failed':
@@ -278,6 +536,7 @@ def monitor_delivery_status(package_id, control_key, ddt_name, rack_column):
                             print(f"Error clearing rack/gripper after delivery failure: {e}")
                         finally:
                             conn.close()
+                    finish_delivery_stop(package_id, delivered=False)
                     break  # Stop monitoring on failure
                     
             else:
@@ -290,33 +549,83 @@ def monitor_delivery_status(package_id, control_key, ddt_name, rack_column):
             
         time.sleep(3)  # Check every 3 seconds
 
+def resume_scheduled_launches():
+    """Restarts the timers of launches held back by deconfliction when the service stopped"""
+    conn = get_db_connection()
+    if not conn:
+        return
+    try:
+        with conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor) as cur:
+            cur.execute("SELECT * FROM scheduled_launches ORDER BY launch_at")
+            scheduled = cur.fetchall()
+        conn.rollback()
+    except psycopg2.Error as e:
+        print(f"Error loading scheduled launches: {e}")
+        return
+    finally:
+        conn.close()
+    for launch in scheduled:
+        delay = max(0.0, launch['launch_at'].timestamp() - time.time())
+        launch_status_tracker[launch['package_id']] = "Scheduled"
+        Thread(
+            target=delayed_ddt_launch,
+            args=(delay, None, launch['package_id'], launch['control_key'], launch['ddt_name'],
+                  launch['rack_column'], launch['altitude_m']),
+            daemon=True
+        ).start()
+    if scheduled:
+        print(f"Resumed {len(scheduled)} scheduled launch(es)")
+
+# After the launch helpers above are defined; runs under gateway.py too
+resume_scheduled_launches()
+
 @app.route('/api/packages', methods=['GET'])
 def get_packages():
     try:
+        try:
+            since = parse_cursor(request.args.get('since'))
+        except ValueError:
+            return jsonify({"error": "Invalid 'since' cursor"}), 400
+
         conn = get_db_connection()
         if not conn:
             return jsonify({"error": "Database connection failed"}), 500
         
         cursor = conn.cursor(cursor_factory=psycopg2.extras.RealDictCursor)
         
+        conditions = []
+        params = []
+        if since is None:
+            sync_cursor = current_cursor(cursor)
+        else:
+            try:
+                changed_keys, sync_cursor = changed_keys_since(cursor, 'packagemanagement', since)
+            except CursorExpired:
+                cursor.close()
+                conn.close()
+                return jsonify(expired_cursor_body()), 410
+            conditions.append("package_id = ANY(%s)")
+            params.append(changed_keys)
+
         status_filter = request.args.get('status')
         if status_filter:
-            cursor.execute("""
-                SELECT * FROM packagemanagement 
-                WHERE current_status = %s 
-                ORDER BY last_update_time DESC
-            """, (status_filter,))
-        else:
-            cursor.execute("""
-                SELECT * FROM packagemanagement 
-                ORDER BY last_update_time DESC
-            """)
+            conditions.append("current_status = %s")
+            params.append(status_filter)
+
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"""
+            SELECT * FROM packagemanagement 
+            {where_clause}
+            ORDER BY last_update_time DESC
+        """, params)
         
         packages = cursor.fetchall()
         cursor.close()
         conn.close()
         
-        return jsonify(packages)
+        if since is not None:
+            return jsonify(delta_payload(changed_keys, packages, 'package_id', sync_cursor))
+        return with_cursor_header(jsonify(packages), sync_cursor)
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -568,6 +877,7 @@ def get_control_key():
 @app.route('/api/launch-package', methods=['POST'])
 def launch_package():
     """Launch package with proper flow: get control_key -> launch -> monitor status"""
+    clearance = None
     try:
         data = request.json
         package_id = data.get('package_id')
@@ -603,58 +913,103 @@ def launch_package():
         if not control_key.startswith('http'):
             control_key = f"https://{control_key}"
         
+        # A package of an Active route went out when the route was launched
+        route = route_planner.open_route_for_package(cursor, package_id)
+        if route and route['status'] == 'Active':
+            cursor.close()
+            conn.close()
+            return jsonify({"error": f"Package {package_id} was launched with drone {route['drone_id']}'s route"}), 409
+        
+        # Deconflict the sortie against every active mission: altitude layer and launch delay
+        mission = deconfliction.mission_for_package(cursor, package_id)
+        if mission:
+            drone_id, points, package_ids = mission
+            try:
+                clearance = airspace.reserve(drone_id, points, package_ids=package_ids)
+            except deconfliction.AirspaceCongested as e:
+                cursor.close()
+                conn.close()
+                return jsonify({"error": str(e)}), 409
+        
         # Initially update DDT rack with package_id (reserve the rack)
         success = update_ddt_rack_with_package(conn, package_id, ddt_name, rack_column)
         if not success:
+            if clearance:
+                airspace.release(clearance['drone_id'])
+            conn.rollback()
             cursor.close()
             conn.close()
             return jsonify({"error": "Failed to update DDT rack"}), 500
         
+        # A package on a multi-stop route launches the whole route: every other stop gets a
+        # rack at its DDT and is launched and monitored alongside this one
+        delay = clearance['delay_s'] if clearance else 0
+        altitude_m = clearance['altitude_m'] if clearance else None
+        launches = [(package_id, control_key, ddt_name, rack_column)]
+        route = route_planner.launch_route(cursor, package_id, dispatched=delay <= 0)
+        if route:
+            for stop in route['stops']:
+                if stop['package_id'] == package_id or stop['state'] != 'pending':
+                    continue
+                reserved = reserve_stop_rack(conn, stop['package_id'], stop['ddt_name'])
+                if not reserved:
+                    if clearance:
+                        airspace.release(clearance['drone_id'])
+                    conn.rollback()
+                    cursor.close()
+                    conn.close()
+                    return jsonify({"error": f"No free rack at {stop['ddt_name']} for route package {stop['package_id']}"}), 409
+                launches.append((stop['package_id'], reserved[0], stop['ddt_name'], reserved[1]))
+        
+        # The drone flies the layer it was cleared for; a delayed launch is kept until it is sent
+        if clearance:
+            cursor.execute("UPDATE dronesdata SET cruise_altitude_m = %s WHERE drone_id = %s",
+                           (altitude_m, clearance['drone_id']))
+            if delay > 0:
+                for launch in launches:
+                    schedule_launch(cursor, launch, clearance['drone_id'], altitude_m, clearance['launch_at'])
+        
         conn.commit()
         cursor.close()
         conn.close()
+        for stop_package, _, _, stop_rack in launches[1:]:
+            package_rack_mapping[stop_package] = stop_rack
+        
+        # Launch package via external DDT control server, now or after the airspace delay
+        if delay > 0:
+            for i, launch in enumerate(launches):
+                launch_status_tracker[launch[0]] = "Scheduled"
+                Thread(
+                    target=delayed_ddt_launch,
+                    args=(delay, clearance['drone_id'] if i == 0 else None, *launch, altitude_m),
+                    daemon=True
+                ).start()
+        else:
+            error = send_ddt_launch(*launches[0], altitude_m)
+            if error:
+                if clearance:
+                    airspace.release(clearance['drone_id'])
+                return jsonify({"error": error}), 500
+            for launch in launches[1:]:
+                stop_error = send_ddt_launch(*launch, altitude_m)
+                if stop_error:
+                    print(f"Launch of route package {launch[0]} failed: {stop_error}")
+                    launch_status_tracker[launch[0]] = "Failed"
         
-        # Launch package via external DDT control server
-        launch_payload = {
+        return jsonify({
+            "status": "success",
+            "message": (f"Package {package_id} launch scheduled in {delay:g}s" if delay > 0
+                        else f"Package {package_id} launched successfully"),
             "package_id": package_id,
-            "ddt_name": ddt_name,
-            "rack_column": rack_column
-        }
-        
-        try:
-            response = requests.post(
-                f"{control_key}/launch",
-                json=launch_payload,
-                timeout=10,
-                headers={"Content-Type": "application/json"}
-            )
-            
-            if response.status_code == 200:
-                # Initialize status tracking
-                launch_status_tracker[package_id] = "Processing"
-                
-                # Start background monitoring thread
-                monitor_thread = Thread(
-                    target=monitor_delivery_status,
-                    args=(package_id, control_key, ddt_name, rack_column),
-                    daemon=True
-                )
-                monitor_thread.start()
-                
-                return jsonify({
-                    "status": "success",
-                    "message": f"Package {package_id} launched successfully",
-                    "package_id": package_id,
-                    "control_key": control_key,
-                    "selected_rack": rack_column
-                })
-            else:
-                return jsonify({"error": f"Launch failed: HTTP {response.status_code}"}), 500
-                
-        except requests.RequestException as e:
-            return jsonify({"error": f"Failed to communicate with DDT server: {str(e)}"}), 500
+            "control_key": control_key,
+            "selected_rack": rack_column,
+            "airspace": clearance,
+            "route_stops": route['stops'] if route else None
+        })
         
     except Exception as e:
+        if clearance:
+            airspace.release(clearance['drone_id'])
         return jsonify({"error": str(e)}), 500
 
 @app.route('/api/package-status/<package_id>', methods=['GET'])
@@ -730,6 +1085,9 @@ def reset_package(package_id):
             email_sent_packages.remove(package_id)
         if package_id in package_rack_mapping:
             del package_rack_mapping[package_id]
+        airspace.release_package(package_id)
+        # A launch still waiting on its airspace delay is cancelled
+        claim_scheduled_launch(package_id)
         
         return jsonify({
             "status": "success",
@@ -750,7 +1108,7 @@ def generate_otp_for_package(package_id):
         cursor = conn.cursor()
         
         cursor.execute("""
-            SELECT mail_id FROM customers WHERE package_id = %s
+            SELECT mail_id, ddt_name FROM customers WHERE package_id = %s
         """, (package_id,))
         
         result = cursor.fetchone()
@@ -759,12 +1117,13 @@ def generate_otp_for_package(package_id):
             conn.close()
             return jsonify({"error": "Customer not found for package"}), 404
         
-        mail_id = result[0]
-        otp = generate_otp()
-        
-        cursor.execute("""
-            UPDATE customers SET otp = %s WHERE package_id = %s
-        """, (otp, package_id))
+        mail_id, ddt_name = result
+        otp = update_customer_otp(conn, package_id, ddt_name)
+        if not otp:
+            conn.rollback()
+            cursor.close()
+            conn.close()
+            return jsonify({"error": "Failed to generate OTP"}), 500
         
         conn.commit()
         cursor.close()
@@ -802,21 +1161,24 @@ def launch_delivery():
             WHERE package_id = %s
         """, (datetime.datetime.now(), datetime.datetime.now(), package_id))
         
-        cursor.execute("""
-            UPDATE dronesdata 
-            SET dest_lat = (
-                SELECT destination_lat FROM packagemanagement 
-                WHERE package_id = %s
-            ),
-            dest_lng = (
-                SELECT destination_lng FROM packagemanagement 
-                WHERE package_id = %s
-            )
-            WHERE drone_id = (
-                SELECT assigned_drone_id FROM packagemanagement 
-                WHERE package_id = %s
-            )
-        """, (package_id, package_id, package_id))
+        # A package on a multi-stop route launches the whole route; the drone flies to its first stop
+        route = route_planner.launch_route(cursor, package_id)
+        if route is None:
+            cursor.execute("""
+                UPDATE dronesdata 
+                SET dest_lat = (
+                    SELECT destination_lat FROM packagemanagement 
+                    WHERE package_id = %s
+                ),
+                dest_lng = (
+                    SELECT destination_lng FROM packagemanagement 
+                    WHERE package_id = %s
+                )
+                WHERE drone_id = (
+                    SELECT assigned_drone_id FROM packagemanagement 
+                    WHERE package_id = %s
+                )
+            """, (package_id, package_id, package_id))
         
         conn.commit()
         cursor.close()
@@ -827,11 +1189,36 @@ def launch_delivery():
             "message": f"Delivery launched via {delivery_method}",
             "package_id": package_id,
             "delivery_method": delivery_method,
-            "selected_rack": selected_rack
+            "selected_rack": selected_rack,
+            "route_stops": route['stops'] if route else None
         })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/airspace', methods=['GET'])
+def get_airspace():
+    """Active mission corridors with their altitude layers and launch/clear times"""
+    return jsonify({"layers_m": list(deconfliction.ALTITUDE_LAYERS_M), "missions": airspace.snapshot()})
+
+@app.route('/api/drone-route/<drone_id>', methods=['GET'])
+def get_drone_route(drone_id):
+    """Open (Planned or Active) multi-stop route of a drone, stops in flight order"""
+    try:
+        conn = get_db_connection()
+        if not conn:
+            return jsonify({"error": "Database connection failed"}), 500
+        
+        cursor = conn.cursor()
+        route = route_planner.open_route_for_drone(cursor, drone_id)
+        cursor.close()
+        conn.close()
+        
+        if not route:
+            return jsonify({"error": "No open route for this drone"}), 404
+        return jsonify(route)
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
 # New endpoint to clear rack when customer picks up package
 @app.route('/api/pickup-package/<package_id>', methods=['POST'])
 def pickup_package(package_id):
@@ -874,13 +1261,26 @@ def pickup_package(package_id):
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+
+def forget_package_tracking(event):
+    """Drops in-memory launch tracking for packages deleted by another service."""
+    if event.get('op') == 'D':
+        package_id = event.get('key')
+        launch_status_tracker.pop(package_id, None)
+        package_rack_mapping.pop(package_id, None)
+        email_sent_packages.discard(package_id)
+
+change_bus.on('packagemanagement', forget_package_tracking)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
     print("Starting DDT Control Server...")
     
-    # Create customers table if it doesn't exist
-    print("Checking/Creating database tables...")
-    create_customers_table_if_not_exists()
-    
     print("Key endpoints:")
     print("- POST /api/launch-package - Launch package with full flow")
     print("- GET /api/package-status/<package_id> - Get package status")
@@ -888,5 +1288,6 @@ if __name__ == '__main__':
     print("- POST /api/reset-package/<package_id> - Reset package")
     print("- POST /api/pickup-package/<package_id> - Clear rack after customer pickup")
     print("- POST /api/get-control-key - Get control key from coordinates")
+    print("- GET /api/airspace - Active mission corridors and altitude layers")
     print("🆕 NEW: Automatic drone gripper clearing after package delivery!")
     app.run(debug=True, host='0.0.0.0', port=5090)
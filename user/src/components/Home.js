@@ -2,6 +2,7 @@
 
 import { useState, useEffect } from "react"
 import { useNavigate, Link } from "react-router-dom"
+import { clearTokens } from "../utils/authFetch"
 import { FontAwesomeIcon } from "@fortawesome/react-fontawesome"
 import {
   faTowerBroadcast,
@@ -113,6 +114,7 @@ const Home = () => {
     sessionStorage.removeItem("userRole")
     sessionStorage.removeItem("username")
     sessionStorage.removeItem("full_name")
+    clearTokens()
     navigate("/login")
   }
 
@@ -31,6 +31,8 @@ const Login = () => {
 
         sessionStorage.setItem("username", data.username) // Store full_name
         sessionStorage.setItem("full_name", data.full_name) // Store full_name
+        sessionStorage.setItem("access_token", data.access_token) // Sent as "Authorization: Bearer <token>"
+        sessionStorage.setItem("refresh_token", data.refresh_token)
         navigate("/") // Redirect to main page
       } else {
         setError(data.error || "Login failed. Please try again.")
@@ -2,7 +2,6 @@
 
 import { useState } from "react"
 import { useNavigate } from "react-router-dom"
-import emailjs from "@emailjs/browser"
 import { FontAwesomeIcon } from "@fortawesome/react-fontawesome"
 import { faUser, faLock, faKey, faArrowLeft } from "@fortawesome/free-solid-svg-icons"
 
@@ -16,20 +15,8 @@ const ResetPassword = () => {
   const [error, setError] = useState("")
   const [success, setSuccess] = useState("")
   const [loading, setLoading] = useState(false)
-  const [generatedOtp, setGeneratedOtp] = useState("")
-  const [userEmail, setUserEmail] = useState("")
   const [username, setUsername] = useState("")
 
-  // EmailJS configuration
-  const EMAILJS_PUBLIC_KEY = "PYx32kIU5UYnouHXW"
-  const EMAILJS_SERVICE_ID = "service_34u8aka"
-  const EMAILJS_TEMPLATE_ID = "template_tyltts9"
-
-
-  const generateOTP = () => {
-    return Math.floor(100000 + Math.random() * 900000).toString()
-  }
-
   const validatePassword = (password) => {
     if (password.length < 8) {
       return "Password must be at least 8 characters long"
@@ -47,10 +34,10 @@ const ResetPassword = () => {
     setLoading(true)
 
     try {
-      console.log("Checking user existence for:", usernameOrEmail)
+      console.log("Requesting reset code for:", usernameOrEmail)
 
-      // Check if user exists in database
-      const response = await fetch("http://localhost:5062/check_user_exists", {
+      // The backend mails a single-use code to the registered email
+      const response = await fetch("http://localhost:5062/request_password_reset", {
         method: "POST",
         headers: {
           "Content-Type": "application/json",
@@ -59,45 +46,16 @@ const ResetPassword = () => {
       })
 
       console.log("Response status:", response.status)
-
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
-      }
-
       const data = await response.json()
-      console.log("Response data:", data)
 
-      if (data.exists) {
-        // User exists, generate OTP and send email
-        const otpCode = generateOTP()
-        setGeneratedOtp(otpCode)
-        setUserEmail(data.email)
+      if (response.ok) {
         setUsername(data.username)
-
-        console.log("Sending OTP via EmailJS...")
-
-        // Initialize EmailJS
-        emailjs.init(EMAILJS_PUBLIC_KEY)
-
-        // Send OTP via EmailJS
-        const templateParams = {
-          email: data.email,
-          otp: otpCode, // Changed to use 'otp' - clearer variable name
-          name: data.full_name,
-          username: data.username,
-        }
-
-        try {
-          const emailResult = await emailjs.send(EMAILJS_SERVICE_ID, EMAILJS_TEMPLATE_ID, templateParams)
-          console.log("Email sent successfully:", emailResult)
-          setSuccess(`OTP has been sent to your registered email: ${data.email}`)
-          setStep(2)
-        } catch (emailError) {
-          console.error("EmailJS error:", emailError)
-          setError("Failed to send OTP email. Please check your email configuration.")
-        }
-      } else {
+        setSuccess(`OTP has been sent to your registered email: ${data.email}`)
+        setStep(2)
+      } else if (response.status === 404) {
         setError("YOU ARE NOT REGISTERED FOR THIS SITE")
+      } else {
+        setError(data.error || "Failed to send OTP email. Please try again.")
       }
     } catch (err) {
       console.error("Error in handleStep1Submit:", err)
@@ -116,9 +74,8 @@ const ResetPassword = () => {
     setError("")
     setSuccess("")
 
-    // Validate OTP
-    if (otp !== generatedOtp) {
-      setError("Invalid OTP. Please check and try again.")
+    if (!otp) {
+      setError("Please enter the OTP sent to your email.")
       return
     }
 
@@ -149,15 +106,12 @@ const ResetPassword = () => {
         body: JSON.stringify({
           username: username,
           new_password: newPassword,
+          reset_code: otp,
         }),
       })
 
       console.log("Reset password response status:", response.status)
 
-      if (!response.ok) {
-        throw new Error(`HTTP error! status: ${response.status}`)
-      }
-
       const data = await response.json()
       console.log("Reset password response:", data)
 
@@ -0,0 +1,59 @@
+// Attaches the access token stored at login to every request for our own services
+// ("Authorization: Bearer <token>"), and on a 401 exchanges the refresh token once and retries.
+// Requests to third-party APIs (weather, maps, Supabase) are sent unchanged.
+const REFRESH_URL = "http://localhost:5062/refresh"
+
+const nativeFetch = window.fetch.bind(window)
+let refreshing = null
+
+const isOwnService = (url) => {
+  try {
+    const target = new URL(url, window.location.href)
+    return ["localhost", "127.0.0.1"].includes(target.hostname) || target.origin === window.location.origin
+  } catch {
+    return false
+  }
+}
+
+const withToken = (init) => {
+  const token = sessionStorage.getItem("access_token")
+  if (!token) return init
+  const headers = new Headers(init.headers || {})
+  if (!headers.has("Authorization")) headers.set("Authorization", `Bearer ${token}`)
+  return { ...init, headers }
+}
+
+const refreshTokens = async () => {
+  const refreshToken = sessionStorage.getItem("refresh_token")
+  if (!refreshToken) return false
+  const response = await nativeFetch(REFRESH_URL, {
+    method: "POST",
+    headers: { "Content-Type": "application/json" },
+    body: JSON.stringify({ refresh_token: refreshToken }),
+  })
+  if (!response.ok) {
+    clearTokens()
+    return false
+  }
+  const data = await response.json()
+  sessionStorage.setItem("access_token", data.access_token)
+  sessionStorage.setItem("refresh_token", data.refresh_token)
+  return true
+}
+
+export const clearTokens = () => {
+  sessionStorage.removeItem("access_token")
+  sessionStorage.removeItem("refresh_token")
+}
+
+export const installAuthFetch = () => {
+  window.fetch = async (input, init = {}) => {
+    const url = typeof input === "string" ? input : input.url
+    if (!isOwnService(url) || url === REFRESH_URL) return nativeFetch(input, init)
+    const response = await nativeFetch(input, withToken(init))
+    if (response.status !== 401 || !sessionStorage.getItem("refresh_token")) return response
+    // One refresh at a time; concurrent 401s wait for it
+    refreshing = refreshing || refreshTokens().finally(() => { refreshing = null })
+    return (await refreshing) ? nativeFetch(input, withToken(init)) : response
+  }
+}
@@ -2,12 +2,21 @@ import psycopg2
 import psycopg2.extras
 import os
 import logging
+import secrets
+import smtplib
+from email.message import EmailMessage
 from flask import Flask, request, jsonify
 from flask_cors import CORS
 import bcrypt
+from rate_limit import TokenBucketLimiter, PostgresTokenBucketLimiter
+from credential_verifier import CredentialVerifier, VerifierBusy
+import db
+from auth_tokens import AUTH_ENFORCE, AuthError, bearer_token, issue_tokens, protect_app, refresh_tokens, require_auth, verify_token
 
 app = Flask(__name__)
 CORS(app)
+# Every route needs an access token except the login and password reset flows; managing users needs an admin token
+protect_app(app, exempt={'home', 'login', 'refresh', 'check_user_exists', 'request_password_reset', 'reset_password'})
 
 # Database connection details (ensure these are correct)
 DB_HOST = "localhost"
@@ -23,7 +32,7 @@ def get_db_connection():
     """Establishes and returns a database connection."""
     conn = None
     try:
-        conn = psycopg2.connect(
+        conn = db.connect(
             host=DB_HOST,
             database=DB_NAME,
             user=DB_USER,
@@ -61,6 +70,16 @@ def create_tables():
         
         app.logger.info("Table 'users_data' ensured to exist.")
 
+        # One outstanding reset code per user, stored as a bcrypt hash
+        cur.execute("""
+            CREATE TABLE IF NOT EXISTS password_reset_codes (
+                username VARCHAR(255) PRIMARY KEY,
+                code_hash VARCHAR(255) NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                expires_at TIMESTAMP WITH TIME ZONE NOT NULL
+            );
+        """)
+
         conn.commit()
     except (Exception, psycopg2.Error) as e:
         app.logger.error(f"Error creating tables: {e}")
@@ -73,11 +92,76 @@ def create_tables():
 
 create_tables() 
 
+# --- Login throttling ---
+# Per-IP and per-username token buckets; "postgres" shares them across processes and services.
+LOGIN_RATE_LIMIT_STORE = os.environ.get('LOGIN_RATE_LIMIT_STORE', 'memory')
+LOGIN_IP_LIMIT = (20, 20 / 60.0)     # burst of 20, then 20 per minute
+LOGIN_USER_LIMIT = (5, 5 / 60.0)     # burst of 5, then 5 per minute
+
+def make_login_limiter(capacity, refill_per_second):
+    if LOGIN_RATE_LIMIT_STORE == 'postgres':
+        return PostgresTokenBucketLimiter(get_db_connection, capacity, refill_per_second)
+    return TokenBucketLimiter(capacity, refill_per_second)
+
+login_ip_limiter = make_login_limiter(*LOGIN_IP_LIMIT)
+login_user_limiter = make_login_limiter(*LOGIN_USER_LIMIT)
+if LOGIN_RATE_LIMIT_STORE == 'postgres':
+    login_ip_limiter.install()
+
+# At most 2 bcrypt checks run at once (8 more may wait); the request thread waits for its result
+credential_verifier = CredentialVerifier(max_workers=2, max_queue=8)
+
+# --- Password reset codes ---
+# Mailed by this service so the code never passes through the browser before the user types it in
+RESET_CODE_TTL_MINUTES = 15
+RESET_CODE_MAX_ATTEMPTS = 5
+SMTP_HOST = os.environ.get('SMTP_HOST')
+SMTP_PORT = int(os.environ.get('SMTP_PORT', 587))
+SMTP_USER = os.environ.get('SMTP_USER')
+SMTP_PASS = os.environ.get('SMTP_PASS')
+SMTP_FROM = os.environ.get('SMTP_FROM', SMTP_USER or 'no-reply@shadowfly.local')
+
+def send_reset_code(email, full_name, code):
+    message = EmailMessage()
+    message['Subject'] = "ShadowFly password reset code"
+    message['From'] = SMTP_FROM
+    message['To'] = email
+    message.set_content(f"Hello {full_name},\n\nYour password reset code is {code}. "
+                        f"It expires in {RESET_CODE_TTL_MINUTES} minutes.\n")
+    with smtplib.SMTP(SMTP_HOST, SMTP_PORT, timeout=10) as smtp:
+        smtp.starttls()
+        if SMTP_USER:
+            smtp.login(SMTP_USER, SMTP_PASS)
+        smtp.send_message(message)
+
+def consume_reset_code(cur, username, code):
+    """Checks and spends username's reset code inside the caller's transaction. Returns True when it matched."""
+    cur.execute("""
+        SELECT code_hash, attempts FROM password_reset_codes
+        WHERE username = %s AND expires_at > CURRENT_TIMESTAMP
+        FOR UPDATE
+    """, (username,))
+    row = cur.fetchone()
+    if not row or row[1] >= RESET_CODE_MAX_ATTEMPTS:
+        return False
+    if not bcrypt.checkpw(str(code).encode('utf-8'), row[0].encode('utf-8')):
+        cur.execute("UPDATE password_reset_codes SET attempts = attempts + 1 WHERE username = %s", (username,))
+        return False
+    cur.execute("DELETE FROM password_reset_codes WHERE username = %s", (username,))
+    return True
+
+def rate_limited_response(retry_after):
+    response = jsonify({"error": "Too many login attempts. Please try again later."})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(retry_after)
+    return response
+
 @app.route('/')
 def home():
     return "Flask backend is running!"
 
 @app.route('/add_user', methods=['POST'])
+@require_auth('admin')
 def add_user():
     """Endpoint to add a new user to the users_data table."""
     data = request.get_json()
@@ -131,6 +215,7 @@ def add_user():
             conn.close()
 
 @app.route('/update_user/<int:user_id>', methods=['PUT'])
+@require_auth('admin')
 def update_user(user_id):
     """Endpoint to update an existing user in the users_data table."""
     data = request.get_json()
@@ -183,6 +268,7 @@ def update_user(user_id):
             conn.close()
 
 @app.route('/delete_user/<int:user_id>', methods=['DELETE'])
+@require_auth('admin')
 def delete_user(user_id):
     """Endpoint to delete a user from the users_data table."""
     conn = None
@@ -213,6 +299,7 @@ def delete_user(user_id):
             conn.close()
 
 @app.route('/get_users', methods=['GET'])
+@require_auth('admin')
 def get_users():
     """Endpoint to retrieve all users from the users_data table."""
     conn = None
@@ -245,6 +332,14 @@ def login():
     if not username or not password:
         return jsonify({"error": "Username and password are required"}), 400
 
+    # Reject floods before touching the database or bcrypt
+    allowed, retry_after = login_ip_limiter.allow(f"login:ip:{request.remote_addr}")
+    if allowed:
+        allowed, retry_after = login_user_limiter.allow(f"login:user:{username.lower()}")
+    if not allowed:
+        logging.warning(f"Login rate limit hit for user '{username}' from {request.remote_addr}")
+        return rate_limited_response(retry_after)
+
     conn = None
     try:
         conn = get_db_connection()
@@ -259,9 +354,10 @@ def login():
             full_name = user['full_name'] # Get full_name
             if stored_password:
                 # If password is set (not null), compare with hashed password
-                if bcrypt.checkpw(password.encode('utf-8'), stored_password.encode('utf-8')):
+                if credential_verifier.verify(password, stored_password):
                     logging.info(f"User '{username}' logged in successfully.")
-                    return jsonify({"message": "Login successful", "full_name": full_name, "username": username}), 200 # Return full_name and username
+                    return jsonify({"message": "Login successful", "full_name": full_name, "username": username,
+                                    **issue_tokens(username, 'user', name=full_name)}), 200 # Return full_name and username
                 else:
                     logging.warning(f"Failed login attempt for user '{username}': Invalid password.")
                     return jsonify({"error": "Invalid username or password"}), 401
@@ -269,7 +365,8 @@ def login():
                 # If password is null, check if username matches the provided password
                 if username == password:
                     logging.info(f"User '{username}' logged in successfully with username as password.")
-                    return jsonify({"message": "Login successful", "full_name": full_name, "username": username}), 200 # Return full_name and username
+                    return jsonify({"message": "Login successful", "full_name": full_name, "username": username,
+                                    **issue_tokens(username, 'user', name=full_name)}), 200 # Return full_name and username
                 else:
                     logging.warning(f"Failed login attempt for user '{username}': Password null, username-password mismatch.")
                     return jsonify({"error": "Invalid username or password"}), 401
@@ -277,6 +374,12 @@ def login():
             logging.warning(f"Failed login attempt: Username '{username}' not found.")
             return jsonify({"error": "Invalid username or password"}), 401
 
+    except VerifierBusy as e:
+        logging.warning(f"Login verifier overloaded: {e}")
+        response = jsonify({"error": "Login service is busy. Please try again shortly."})
+        response.status_code = 503
+        response.headers['Retry-After'] = '1'
+        return response
     except psycopg2.Error as e:
         logging.error(f"Database error during login: {e}")
         return jsonify({"error": "Database error during login."}), 500
@@ -287,6 +390,15 @@ def login():
         if conn:
             conn.close()
 
+@app.route('/refresh', methods=['POST'])
+def refresh():
+    """Endpoint to exchange a refresh token for a new token pair, without a database lookup."""
+    data = request.get_json(silent=True) or {}
+    try:
+        return jsonify(refresh_tokens(data.get('refresh_token'))), 200
+    except AuthError as e:
+        return jsonify({"error": str(e)}), 401
+
 @app.route('/get_user_details/<string:username>', methods=['GET'])
 def get_user_details(username):
     """Endpoint to retrieve a single user's details by username, excluding password."""
@@ -401,16 +513,92 @@ def check_user_exists():
         if conn:
             conn.close()
 
+@app.route('/request_password_reset', methods=['POST'])
+def request_password_reset():
+    """Endpoint to mail a single-use password reset code to a user's registered email."""
+    data = request.get_json()
+    username_or_email = data.get('username_or_email')
+
+    if not username_or_email:
+        return jsonify({"error": "Username or email is required"}), 400
+
+    allowed, retry_after = login_ip_limiter.allow(f"reset:ip:{request.remote_addr}")
+    if allowed:
+        allowed, retry_after = login_user_limiter.allow(f"reset:user:{username_or_email.lower()}")
+    if not allowed:
+        logging.warning(f"Password reset rate limit hit for '{username_or_email}' from {request.remote_addr}")
+        return rate_limited_response(retry_after)
+
+    if not SMTP_HOST:
+        logging.error("Password reset requested but SMTP_HOST is not configured.")
+        return jsonify({"error": "Password reset email is not configured on the server."}), 503
+
+    conn = None
+    try:
+        conn = get_db_connection()
+        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        cur.execute("SELECT username, email, full_name FROM users_data WHERE username = %s OR email = %s;",
+                    (username_or_email, username_or_email))
+        user = cur.fetchone()
+        if not user:
+            cur.close()
+            return jsonify({"error": "User not found."}), 404
+
+        code = f"{secrets.randbelow(1000000):06d}"
+        code_hash = bcrypt.hashpw(code.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+        cur.execute("""
+            INSERT INTO password_reset_codes (username, code_hash, attempts, expires_at)
+            VALUES (%s, %s, 0, CURRENT_TIMESTAMP + make_interval(mins => %s))
+            ON CONFLICT (username) DO UPDATE SET code_hash = EXCLUDED.code_hash, attempts = 0, expires_at = EXCLUDED.expires_at
+        """, (user['username'], code_hash, RESET_CODE_TTL_MINUTES))
+        send_reset_code(user['email'], user['full_name'], code)
+        conn.commit()
+        cur.close()
+        logging.info(f"Password reset code sent for user '{user['username']}'.")
+        return jsonify({"message": "Reset code sent", "username": user['username'], "email": user['email']}), 200
+
+    except psycopg2.Error as e:
+        conn.rollback()
+        logging.error(f"Database error during password reset request: {e}")
+        return jsonify({"error": "Failed to create a reset code due to a database error."}), 500
+    except (smtplib.SMTPException, OSError) as e:
+        if conn: conn.rollback()
+        logging.error(f"Failed to send password reset email: {e}")
+        return jsonify({"error": "Failed to send the reset code email."}), 502
+    except Exception as e:
+        logging.error(f"An unexpected error occurred during password reset request: {e}")
+        return jsonify({"error": "An internal server error occurred."}), 500
+    finally:
+        if conn:
+            conn.close()
+
 @app.route('/reset_password', methods=['POST'])
 def reset_password():
-    """Endpoint to reset a user's password."""
+    """
+    Endpoint to reset a user's password, with the code from /request_password_reset or an admin's or the
+    account owner's access token. Without either it is open like every other route until AUTH_ENFORCE is set.
+    """
     data = request.get_json()
     username = data.get('username')
     new_password = data.get('new_password')
+    reset_code = data.get('reset_code')
 
     if not username or not new_password:
         return jsonify({"error": "Username and new password are required"}), 400
 
+    claims = None
+    token = bearer_token()
+    if token:
+        try:
+            claims = verify_token(token)
+        except AuthError as e:
+            if AUTH_ENFORCE:
+                return jsonify({"error": str(e)}), 401
+    if claims and claims.get('role') != 'admin' and claims.get('sub') != username:
+        return jsonify({"error": "Insufficient permissions"}), 403
+    if not claims and not reset_code and AUTH_ENFORCE:
+        return jsonify({"error": "A reset code or access token is required"}), 401
+
     # Password validation: 8 characters combo of string & int
     if len(new_password) < 8 or not any(char.isdigit() for char in new_password) or not any(char.isalpha() for char in new_password):
         return jsonify({"error": "Password must be at least 8 characters long and contain a combination of letters and numbers."}), 400
@@ -423,6 +611,10 @@ def reset_password():
         # Hash the new password
         hashed_password = bcrypt.hashpw(new_password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
+        if not claims and reset_code and not consume_reset_code(cur, username, reset_code):
+            conn.commit()  # keeps the failed attempt counted
+            return jsonify({"error": "Invalid or expired reset code"}), 401
+
         update_query = "UPDATE users_data SET password = %s WHERE username = %s;"
         cur.execute(update_query, (hashed_password, username))
         conn.commit()
@@ -0,0 +1,147 @@
+import logging
+import math
+import psycopg2
+
+logger = logging.getLogger(__name__)
+
+# Map layers served by the viewport API: table, label expression and the
+# columns returned for an unclustered point.
+MAP_LAYERS = {
+    'warehouse': {'table': 'warehouses', 'label': 'name', 'columns': 'id, name'},
+    'ddt': {'table': 'ddts', 'label': 'name', 'columns': 'id, name, status'},
+    # Where each drone is based: droneassignment holds its assigned warehouse's location.
+    # Live drone positions are not in the database; they stream from /api/live-map/stream.
+    'drone_base': {'table': 'droneassignment', 'label': 'COALESCE(drone_name, drone_id)',
+                   'columns': 'drone_id, drone_name, name AS warehouse, status'},
+}
+
+# Below this zoom level points are aggregated into grid clusters server-side.
+CLUSTER_MAX_ZOOM = 13
+# Grid cells per 256px map tile when clustering (roughly one cluster per 64px).
+CLUSTER_CELLS_PER_TILE = 4
+# Upper bound on points or clusters returned per layer.
+MAX_FEATURES_PER_LAYER = 2000
+
+# GiST index on the point expression used by bbox_condition(); plain Postgres,
+# no PostGIS required.
+SPATIAL_INDEX_DDL = """
+    CREATE INDEX IF NOT EXISTS idx_{table}_location ON {table} USING gist (point(longitude, latitude));
+"""
+
+
+def install_spatial_indexes(conn):
+    """Ensures the viewport indexes exist on every map layer table. Safe to call on every startup."""
+    try:
+        with conn.cursor() as cur:
+            for layer in MAP_LAYERS.values():
+                cur.execute(SPATIAL_INDEX_DDL.format(table=layer['table']))
+        conn.commit()
+        return True
+    except psycopg2.Error as e:
+        logger.error(f"Error creating spatial indexes: {e}")
+        conn.rollback()
+        return False
+
+
+def parse_bbox(value):
+    """Parses 'minLng,minLat,maxLng,maxLat'. Returns None when absent and raises ValueError when malformed."""
+    if not value:
+        return None
+    parts = [float(p) for p in value.split(',')]
+    if len(parts) != 4 or not all(math.isfinite(p) for p in parts):
+        raise ValueError("bbox must be minLng,minLat,maxLng,maxLat")
+    min_lng, min_lat, max_lng, max_lat = parts
+    if min_lat > max_lat:
+        raise ValueError("bbox minLat must not exceed maxLat")
+    return min_lng, min_lat, max_lng, max_lat
+
+
+def parse_zoom(value, default=CLUSTER_MAX_ZOOM):
+    """Parses a Leaflet zoom level (0-22). Raises ValueError when malformed."""
+    if value is None or value == '':
+        return default
+    zoom = int(float(value))
+    if zoom < 0 or zoom > 22:
+        raise ValueError("zoom must be between 0 and 22")
+    return zoom
+
+
+def in_bbox(bbox, lat, lng):
+    if bbox is None:
+        return True
+    min_lng, min_lat, max_lng, max_lat = bbox
+    if not (min_lat <= lat <= max_lat):
+        return False
+    if min_lng <= max_lng:
+        return min_lng <= lng <= max_lng
+    # Viewport crosses the antimeridian
+    return lng >= min_lng or lng <= max_lng
+
+
+def bbox_condition(bbox):
+    """Returns (sql, params) restricting latitude/longitude to bbox, using the GiST index."""
+    if bbox is None:
+        return "TRUE", ()
+    min_lng, min_lat, max_lng, max_lat = bbox
+    box = "point(longitude, latitude) <@ box(point(%s, %s), point(%s, %s))"
+    if min_lng <= max_lng:
+        return box, (min_lng, min_lat, max_lng, max_lat)
+    # Antimeridian: split into the eastern and western halves
+    return f"({box} OR {box})", (min_lng, min_lat, 180.0, max_lat, -180.0, min_lat, max_lng, max_lat)
+
+
+def cluster_cell_size(zoom):
+    """Grid cell size in degrees for a zoom level."""
+    return 360.0 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+
+
+def query_layer(cur, layer_name, bbox, zoom, limit=MAX_FEATURES_PER_LAYER):
+    """
+    Returns (features, truncated) for one layer inside bbox. Below CLUSTER_MAX_ZOOM
+    points are grouped per grid cell; single-member cells come back as points.
+    """
+    layer = MAP_LAYERS[layer_name]
+    condition, params = bbox_condition(bbox)
+    where = f"latitude IS NOT NULL AND longitude IS NOT NULL AND {condition}"
+
+    if zoom < CLUSTER_MAX_ZOOM:
+        cell = cluster_cell_size(zoom)
+        cur.execute(f"""
+            SELECT COUNT(*) AS count, AVG(latitude) AS latitude, AVG(longitude) AS longitude,
+                   MIN({layer['label']}) AS label
+            FROM {layer['table']}
+            WHERE {where}
+            GROUP BY floor(longitude / %s), floor(latitude / %s)
+            ORDER BY count DESC
+            LIMIT %s
+        """, params + (cell, cell, limit + 1))
+        rows = cur.fetchall()
+        features = []
+        for row in rows[:limit]:
+            feature = {
+                'kind': 'point' if row['count'] == 1 else 'cluster',
+                'count': int(row['count']),
+                'latitude': float(row['latitude']),
+                'longitude': float(row['longitude']),
+            }
+            if row['count'] == 1:
+                feature['name'] = row['label']
+            features.append(feature)
+        return features, len(rows) > limit
+
+    cur.execute(f"""
+        SELECT {layer['columns']}, {layer['label']} AS label, latitude, longitude
+        FROM {layer['table']}
+        WHERE {where}
+        LIMIT %s
+    """, params + (limit + 1,))
+    rows = cur.fetchall()
+    features = []
+    for row in rows[:limit]:
+        feature = dict(row)
+        feature['kind'] = 'point'
+        feature['name'] = feature.pop('label')
+        feature['latitude'] = float(feature['latitude'])
+        feature['longitude'] = float(feature['longitude'])
+        features.append(feature)
+    return features, len(rows) > limit
@@ -3,12 +3,17 @@ import psycopg2
 import psycopg2.extras  # Required for dictionary cursor
 from flask import Flask, request, jsonify
 from flask_cors import CORS
+import db
+from auth_tokens import protect_app
+from change_bus import ChangeBus
 # datetime was imported but not used in the original snippet.
 # render_template was imported but not used in the original snippet.
 
 app = Flask(__name__)
 # Allowing all origins. For production, you might want to restrict this.
-CORS(app) 
+CORS(app)
+# Admin dashboard API: requires an admin access token
+protect_app(app, roles=('admin',))
 
 DB_HOST = "localhost"
 DB_NAME = "shadowfly"
@@ -18,7 +23,7 @@ DB_PORT = 5432
 
 def get_db_connection():
     """Establishes a connection to the PostgreSQL database."""
-    conn = psycopg2.connect(
+    conn = db.connect(
         host=DB_HOST,
         database=DB_NAME,
         user=DB_USER,
@@ -104,6 +109,13 @@ def get_packages_by_warehouse_name(warehouse_name):
         if conn:
             conn.close()
 
+# --- Change notifications ---
+change_bus = ChangeBus.shared(get_db_connection)
+change_bus.start()
+
+# Server-Sent Events stream of row changes at /api/events
+change_bus.register_sse(app)
+
 if __name__ == '__main__':
 
     app.run(debug=True, port=5028)
\ No newline at end of file